@@ -0,0 +1,28 @@
+"""
+a3divider: split scanned A3 spreads into A4 pages
+
+The web app and all command line tools are front ends over Splitter:
+
+    from a3divider import BookletOrdering, FileSink, Splitter
+
+    Splitter(engine='xobject', ordering=BookletOrdering('saddle')).split(
+        'scan.pdf', FileSink('book.pdf'))
+"""
+from .engines import (
+    DEFAULT_ENGINE,
+    GEOMETRIES,
+    SPLIT_ENGINES,
+    half_boxes,
+    iter_ordered_pages,
+    page_box,
+)
+from .compact import compact_available, compact_writer
+from .downsample import COLOR_MODES, ImageDownsampler, ccitt_available, downsample_available
+from .imposition import BINDING_SCHEMES, DEFAULT_SIGNATURE_PAGES, ImpositionPlan, compile_plan
+from .preflight import estimate_ms, preflight_pdf
+from .progress import SplitProgress
+from .rewrite import rewrite_backend, rewrite_pdf
+from .parallel import PARALLEL_MIN_SHEETS
+from .sinks import FileSink, StreamSink
+from .splitter import BLANK_PAGE_SIZE, BookletOrdering, Splitter
+from .timings import SplitTimings, format_server_timing, stream_size
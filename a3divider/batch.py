@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Split many files with one set of options
+
+Files are split in a process pool whose workers stay alive for the whole
+batch, so Python and PyPDF2 start once per worker instead of once per
+file. Every file yields a flat record (status, pages, bytes and stage
+timings) that can be written as a JSON or CSV summary.
+"""
+import csv
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from .engines import DEFAULT_ENGINE
+from .imposition import DEFAULT_SIGNATURE_PAGES
+from .sinks import FileSink
+from .splitter import BookletOrdering, Splitter
+from .timings import SPLIT_STAGES, SplitTimings
+
+# Output file name suffix per mode, as used by the command line tools
+OUTPUT_SUFFIXES = {
+    'simple': '_A4.pdf',
+    'booklet': '_phase2_reordered.pdf',
+}
+
+STATUS_OK = 'ok'
+STATUS_SKIPPED = 'skipped'
+STATUS_FAILED = 'failed'
+
+SUMMARY_FIELDS = (
+    ['input', 'output', 'status', 'sheets', 'pages', 'input_bytes', 'output_bytes', 'seconds']
+    + [f'{stage}_seconds' for stage in SPLIT_STAGES]
+    + ['error']
+)
+
+def mode_splitter(mode, engine=DEFAULT_ENGINE, rotate=False, vertical=False, binding='saddle',
+                  signature_pages=DEFAULT_SIGNATURE_PAGES, rtl=False):
+    """
+    Build the Splitter for a processing mode, with the options of the web form
+
+    Args:
+        mode: 'simple' or 'booklet'
+        engine: Split engine name
+        rotate: Whether to rotate pages 90 degrees
+        vertical: Right half first (simple mode)
+        binding: Binding scheme (booklet mode)
+        signature_pages: Pages per signature for perfect binding (booklet mode)
+        rtl: Right-to-left binding (booklet mode)
+
+    Returns:
+        Splitter
+    """
+    rotate = 90 if rotate else 0
+    if mode == 'booklet':
+        return Splitter(engine, ordering=BookletOrdering(binding, None, signature_pages, rtl), rotate=rotate)
+    if mode == 'simple':
+        return Splitter(engine, geometry='auto-rtl' if vertical else 'auto', rotate=rotate)
+    raise ValueError(f"Unknown mode: {mode}")
+
+def collect_inputs(patterns, recursive=False, exclude_suffix=None):
+    """
+    Expand files, directories and glob patterns into a sorted list of PDFs
+
+    Args:
+        patterns: File paths, directories (all PDFs inside) or glob patterns
+        recursive: Descend into subdirectories (and allow ** in patterns)
+        exclude_suffix: Skip files ending with this, e.g. earlier outputs
+            written next to their inputs
+
+    Returns:
+        List of Paths without duplicates
+    """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = Path(pattern).glob('**/*' if recursive else '*')
+        elif glob.has_magic(pattern):
+            matches = map(Path, glob.glob(pattern, recursive=recursive))
+        else:
+            matches = [Path(pattern)]
+
+        for path in matches:
+            if path.suffix.lower() != '.pdf' or not path.is_file():
+                continue
+            if exclude_suffix and path.name.endswith(exclude_suffix):
+                continue
+            paths.add(path)
+    return sorted(paths)
+
+def output_path_for(input_path, suffix, output_dir=None):
+    """Return the output path of an input: <stem><suffix> in output_dir or next to the input"""
+    input_path = Path(input_path)
+    directory = Path(output_dir) if output_dir is not None else input_path.parent
+    return directory / (input_path.stem + suffix)
+
+def is_up_to_date(input_path, output_path):
+    """Whether the output exists and is not older than the input"""
+    try:
+        return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    except FileNotFoundError:
+        return False
+
+def _record(input_path, output_path, status):
+    record = dict.fromkeys(SUMMARY_FIELDS)
+    record.update(input=str(input_path), output=str(output_path), status=status)
+    return record
+
+def split_file(splitter, input_path, output_path, linearize=False, compact=False, downsample=None):
+    """
+    Split one file and describe the outcome
+
+    Errors are reported in the record instead of being raised, so one
+    broken scan does not stop a batch. linearize writes a linearized PDF,
+    compact a compacted one and downsample, an optional ImageDownsampler,
+    recompresses the images (see sinks).
+
+    Returns:
+        Record dict with the SUMMARY_FIELDS
+    """
+    record = _record(input_path, output_path, STATUS_OK)
+    timings = SplitTimings()
+    start = time.perf_counter()
+    try:
+        record['input_bytes'] = os.path.getsize(input_path)
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        splitter.split(str(input_path), FileSink(output_path, linearize, compact, downsample),
+                       timings=timings)
+    except Exception as e:
+        record.update(status=STATUS_FAILED, error=f"{type(e).__name__}: {e}")
+
+    record.update(
+        seconds=round(time.perf_counter() - start, 4),
+        sheets=timings.pages_in,
+        pages=timings.pages_out,
+        output_bytes=timings.bytes_out,
+    )
+    for stage in SPLIT_STAGES:
+        if stage in timings.stages:
+            record[f'{stage}_seconds'] = round(timings.stages[stage], 4)
+    return record
+
+def run_batch(splitter, inputs, suffix, output_dir=None, jobs=1, force=False, callback=None,
+              linearize=False, compact=False, downsample=None):
+    """
+    Split a list of files
+
+    Args:
+        splitter: Splitter applied to every file
+        inputs: Input paths (see collect_inputs)
+        suffix: Output file name suffix (see OUTPUT_SUFFIXES)
+        output_dir: Directory for the outputs (default: next to each input)
+        jobs: Worker processes (1 splits in this process, 0 = CPU count)
+        force: Split files even if their output is up to date
+        callback: Called with each record as soon as it is known
+        linearize: Write linearized PDFs for fast web view
+        compact: Compact the outputs (see sinks)
+        downsample: Optional ImageDownsampler applied to the outputs
+
+    Returns:
+        List of records in input order
+    """
+    records = {}
+    pending = []
+    for input_path in inputs:
+        output_path = output_path_for(input_path, suffix, output_dir)
+        if not force and is_up_to_date(input_path, output_path):
+            records[input_path] = _record(input_path, output_path, STATUS_SKIPPED)
+            if callback is not None:
+                callback(records[input_path])
+        else:
+            pending.append((input_path, output_path))
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(pending) <= 1:
+        for input_path, output_path in pending:
+            records[input_path] = split_file(splitter, input_path, output_path, linearize, compact,
+                                                downsample)
+            if callback is not None:
+                callback(records[input_path])
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pending))) as executor:
+            futures = {
+                executor.submit(split_file, splitter, input_path, output_path, linearize, compact,
+                                downsample): input_path
+                for input_path, output_path in pending
+            }
+            for future in as_completed(futures):
+                records[futures[future]] = future.result()
+                if callback is not None:
+                    callback(records[futures[future]])
+
+    return [records[input_path] for input_path in inputs]
+
+def write_summary(records, path):
+    """
+    Write batch records as CSV (for a .csv path) or JSON
+
+    The JSON summary also holds totals per status and overall pages and time.
+    """
+    path = Path(path)
+    if path.suffix.lower() == '.csv':
+        with open(path, 'w', newline='') as summary_file:
+            writer = csv.DictWriter(summary_file, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+        return
+
+    totals = {status: sum(record['status'] == status for record in records)
+              for status in (STATUS_OK, STATUS_SKIPPED, STATUS_FAILED)}
+    totals['pages'] = sum(record['pages'] or 0 for record in records)
+    totals['seconds'] = round(sum(record['seconds'] or 0 for record in records), 4)
+    with open(path, 'w') as summary_file:
+        json.dump({'files': records, 'totals': totals}, summary_file, indent=2)
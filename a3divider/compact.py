@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Compaction of a PdfWriter before it is written
+
+    - objects no longer reachable from the catalog are dropped
+    - identical indirect objects (the same ICC profile, font or image
+      embedded once per scanned page) are merged into one
+    - streams without a filter are Flate-compressed
+
+Objects are compared by content, with references compared by the class of
+their target, refining the classes until they are stable; this merges
+identical subtrees and also objects that refer to each other. Page and
+page tree nodes are never merged, since a page tree must stay a tree.
+
+PyPDF2 has no public API for this, so the writer's object table
+(_objects, _root, _info, _pages, _idnum_hash) is rewritten directly. Those
+internals are only known for the PyPDF2 versions in COMPACT_PYPDF2_VERSIONS;
+with any other version compact_available() is False and the sinks skip
+this step (object streams from pikepdf or qpdf are still written).
+"""
+import zlib
+
+import PyPDF2
+from PyPDF2.generic import (
+    ArrayObject,
+    BooleanObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    StreamObject,
+)
+
+# Streams shorter than this are left uncompressed
+MIN_DEFLATE_BYTES = 64
+
+UNMERGED_TYPES = ('/Page', '/Pages', '/Catalog')
+
+# PyPDF2 versions whose PdfWriter internals compact_writer has been checked against
+COMPACT_PYPDF2_VERSIONS = ('3.0.1',)
+
+def compact_available():
+    """Return True if the installed PyPDF2 is one compact_writer supports"""
+    return PyPDF2.__version__ in COMPACT_PYPDF2_VERSIONS
+
+def _references(obj):
+    """Yield the IndirectObjects directly inside obj"""
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, IndirectObject):
+            yield item
+        elif isinstance(item, DictionaryObject):
+            stack.extend(item.values())
+        elif isinstance(item, ArrayObject):
+            stack.extend(item)
+
+def _reachable(pdf_writer, roots):
+    """Return the idnums reachable from roots, in discovery order"""
+    seen = {}
+    stack = list(reversed(roots))
+    while stack:
+        idnum = stack.pop().idnum
+        if idnum in seen:
+            continue
+        seen[idnum] = None
+        obj = pdf_writer._objects[idnum - 1]
+        stack.extend(reversed(list(_references(obj))))
+    return list(seen)
+
+def _signature(obj, classes, stream_data):
+    """Content of obj with references replaced by the class of their target"""
+    if isinstance(obj, IndirectObject):
+        return ('R', classes[obj.idnum])
+    if isinstance(obj, DictionaryObject):
+        items = tuple(sorted((key, _signature(value, classes, stream_data)) for key, value in obj.items()))
+        if isinstance(obj, StreamObject):
+            return ('stream', items, stream_data[id(obj)])
+        return ('dict', items)
+    if isinstance(obj, ArrayObject):
+        return ('array', tuple(_signature(item, classes, stream_data) for item in obj))
+    if isinstance(obj, BooleanObject):
+        return ('bool', obj.value)
+    if isinstance(obj, NullObject):
+        return ('null',)
+    return (type(obj).__name__, obj)
+
+def _merge_classes(pdf_writer, idnums):
+    """Partition objects into classes of identical content; returns {idnum: class}"""
+    objects = {idnum: pdf_writer._objects[idnum - 1] for idnum in idnums}
+    unmerged = {idnum for idnum, obj in objects.items()
+                if isinstance(obj, DictionaryObject) and obj.get('/Type') in UNMERGED_TYPES}
+    # ContentStream serializes its operations on every access to _data
+    stream_data = {id(obj): obj._data for obj in objects.values() if isinstance(obj, StreamObject)}
+
+    classes = dict.fromkeys(idnums, 0)
+    num_classes = 1
+    while True:
+        class_ids = {}
+        refined = {}
+        for idnum, obj in objects.items():
+            if idnum in unmerged:
+                signature = ('unmerged', idnum)
+            else:
+                signature = _signature(obj, classes, stream_data)
+            refined[idnum] = class_ids.setdefault(signature, len(class_ids))
+        classes = refined
+        if len(class_ids) == num_classes:
+            return classes
+        num_classes = len(class_ids)
+
+def _remap(obj, new_ids, pdf_writer):
+    """Point the references inside obj at their new object numbers, in place"""
+    if isinstance(obj, DictionaryObject):
+        items = obj.items()
+    elif isinstance(obj, ArrayObject):
+        items = enumerate(obj)
+    else:
+        return
+    for key, value in list(items):
+        if isinstance(value, IndirectObject):
+            obj[key] = IndirectObject(new_ids[value.idnum], 0, pdf_writer)
+        else:
+            _remap(value, new_ids, pdf_writer)
+
+def _deflate(stream):
+    """Return a Flate-compressed copy of an unfiltered stream"""
+    encoded = EncodedStreamObject()
+    for key, value in stream.items():
+        if key not in ('/Length', '/Filter', '/DecodeParms'):
+            encoded[key] = value
+    encoded[NameObject('/Filter')] = NameObject('/FlateDecode')
+    encoded._data = zlib.compress(stream._data)
+    return encoded
+
+def compact_writer(pdf_writer):
+    """
+    Compact a PdfWriter in place right before it is written
+
+    Args:
+        pdf_writer: PyPDF2 PdfWriter holding the finished document
+
+    Returns:
+        Dict with the number of objects before and after and of the streams compressed
+
+    Raises:
+        RuntimeError: if the installed PyPDF2 is not supported (see compact_available)
+    """
+    if not compact_available():
+        raise RuntimeError(f"Compaction does not support PyPDF2 {PyPDF2.__version__}")
+
+    # Import objects still owned by the source documents, as write() would
+    pdf_writer._sweep_indirect_references(pdf_writer._root)
+
+    objects_before = sum(obj is not None for obj in pdf_writer._objects)
+    idnums = _reachable(pdf_writer, [pdf_writer._root, pdf_writer._info])
+    classes = _merge_classes(pdf_writer, idnums)
+
+    # One object per class, numbered in discovery order
+    new_ids = {}
+    representatives = {}
+    kept = []
+    for idnum in idnums:
+        class_id = classes[idnum]
+        if class_id not in representatives:
+            representatives[class_id] = len(kept) + 1
+            kept.append(pdf_writer._objects[idnum - 1])
+        new_ids[idnum] = representatives[class_id]
+
+    streams_compressed = 0
+    for index, obj in enumerate(kept):
+        _remap(obj, new_ids, pdf_writer)
+        if (isinstance(obj, StreamObject) and '/Filter' not in obj
+                and len(obj._data) >= MIN_DEFLATE_BYTES):
+            kept[index] = _deflate(obj)
+            streams_compressed += 1
+
+    pdf_writer._objects = kept
+    pdf_writer._root = IndirectObject(new_ids[pdf_writer._root.idnum], 0, pdf_writer)
+    pdf_writer._info = IndirectObject(new_ids[pdf_writer._info.idnum], 0, pdf_writer)
+    pdf_writer._pages = IndirectObject(new_ids[pdf_writer._pages.idnum], 0, pdf_writer)
+    pdf_writer._idnum_hash = {}
+
+    return {
+        'objects_before': objects_before,
+        'objects_after': len(kept),
+        'streams_compressed': streams_compressed,
+    }
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Image downsampling and recompression before the output is written
+
+Scanners default to 300-600 dpi color, which is far more than a screen or
+an office printer needs. ImageDownsampler finds every image drawn by the
+output pages, works out the resolution it is displayed at and, where that
+is well above the target, decodes it with Pillow, resamples it and encodes
+it again:
+
+    keep     JPEG in the image's own color space
+    gray     8-bit grayscale JPEG
+    bilevel  1-bit black and white, CCITT Group 4 or Flate
+
+Images are processed concurrently in a thread pool; Pillow releases the
+GIL while decoding, resampling and encoding. An image is only replaced
+when the new encoding is smaller. Images Pillow cannot decode here (CMYK,
+Indexed, 16-bit, CCITT, JBIG2, JPX, /Decode arrays, color key masks
+and stencil masks) are left alone.
+"""
+import io
+import math
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from PyPDF2.generic import (
+    ArrayObject,
+    BooleanObject,
+    ContentStream,
+    DictionaryObject,
+    EncodedStreamObject,
+    NameObject,
+    NumberObject,
+)
+
+from .scan import color_components, multiply_matrix
+
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+COLOR_MODES = ('keep', 'gray', 'bilevel')
+BILEVEL_ENCODINGS = ('ccitt', 'flate')
+
+DEFAULT_DPI = 150
+DEFAULT_JPEG_QUALITY = 75
+
+# Images below this multiple of the target resolution are not resampled
+# (resampling 200 dpi to 150 dpi saves little and costs sharpness)
+DOWNSAMPLE_THRESHOLD = 1.5
+
+# Keys describing the encoding, replaced on the recompressed image
+ENCODING_KEYS = ('/Length', '/Filter', '/DecodeParms', '/Width', '/Height', '/BitsPerComponent',
+                 '/ColorSpace', '/Decode')
+
+IDENTITY = (1, 0, 0, 1, 0, 0)
+
+def downsample_available():
+    """Return True if Pillow is installed"""
+    return Image is not None
+
+def ccitt_available():
+    """Return True if Pillow can write CCITT Group 4 (built with libtiff)"""
+    return Image is not None and features.check('libtiff')
+
+def _image_filter(image):
+    image_filter = image.get('/Filter')
+    if isinstance(image_filter, ArrayObject):
+        return image_filter[0] if len(image_filter) == 1 else '/Chained'
+    return image_filter
+
+def _draws(stream, resources, forms):
+    """
+    List the images a content stream draws, including those inside forms
+
+    Args:
+        stream: Page contents or Form XObject
+        resources: Resources dictionary of the stream
+        forms: Cache {form idnum: draws in form space}, shared between pages
+
+    Returns:
+        List of (image idnum, matrix mapping the unit square to stream space)
+    """
+    resources = resources.get_object() if resources is not None else DictionaryObject()
+    xobjects = resources.get('/XObject')
+    if stream is None or xobjects is None:
+        return []  # Only XObjects can draw images (inline images are left alone)
+    xobjects = xobjects.get_object()
+
+    draws = []
+    matrix = IDENTITY
+    saved = []
+    for operands, operator in ContentStream(stream, None).operations:
+        if operator == b'q':
+            saved.append(matrix)
+        elif operator == b'Q':
+            matrix = saved.pop() if saved else IDENTITY
+        elif operator == b'cm':
+            matrix = multiply_matrix(tuple(float(v) for v in operands), matrix)
+        elif operator == b'Do' and operands[0] in xobjects:
+            reference = xobjects.raw_get(operands[0])
+            xobject = reference.get_object()
+            subtype = xobject.get('/Subtype')
+            if subtype == '/Image':
+                draws.append((reference.idnum, matrix))
+            elif subtype == '/Form':
+                if reference.idnum not in forms:
+                    forms[reference.idnum] = []  # Guards against forms drawing themselves
+                    forms[reference.idnum] = _draws(xobject, xobject.get('/Resources'), forms)
+                form_matrix = multiply_matrix(
+                    tuple(float(v) for v in xobject.get('/Matrix', IDENTITY)), matrix)
+                draws.extend((idnum, multiply_matrix(inner, form_matrix))
+                             for idnum, inner in forms[reference.idnum])
+    return draws
+
+def image_extents(pdf_writer):
+    """
+    Find the largest size each image is drawn at
+
+    Args:
+        pdf_writer: PdfWriter whose references have been swept
+
+    Returns:
+        {image idnum: (width, height)} in points
+    """
+    extents = {}
+    forms = {}
+    for page in pdf_writer.pages:
+        contents = page.get('/Contents')
+        if contents is not None:
+            contents = contents.get_object()
+        for idnum, (a, b, c, d, e, f) in _draws(contents, page.get('/Resources'), forms):
+            width, height = extents.get(idnum, (0.0, 0.0))
+            extents[idnum] = (max(width, math.hypot(a, b)), max(height, math.hypot(c, d)))
+    return extents
+
+class ImageDownsampler:
+    """
+    Resample and recompress the images of a PdfWriter
+    """
+
+    def __init__(self, dpi=DEFAULT_DPI, quality=DEFAULT_JPEG_QUALITY, color='keep',
+                 bilevel_encoding=None, threshold=128, workers=0):
+        """
+        Args:
+            dpi: Target resolution; images displayed above DOWNSAMPLE_THRESHOLD
+                times this are resampled to it
+            quality: JPEG quality (1-95)
+            color: 'keep', 'gray' or 'bilevel' (see COLOR_MODES)
+            bilevel_encoding: 'ccitt' or 'flate' for bilevel images
+                (default: ccitt when Pillow has libtiff)
+            threshold: Gray level (0-255) from which a pixel becomes white in bilevel mode
+            workers: Threads recompressing images (0 = CPU count)
+
+        Raises:
+            ValueError: for out of range or unknown options
+            RuntimeError: if Pillow (or libtiff for ccitt) is not available
+        """
+        if Image is None:
+            raise RuntimeError("Image downsampling needs Pillow")
+        if dpi <= 0:
+            raise ValueError(f"Resolution must be positive: {dpi}")
+        if not 1 <= quality <= 95:
+            raise ValueError(f"JPEG quality must be between 1 and 95: {quality}")
+        if color not in COLOR_MODES:
+            raise ValueError(f"Unknown color mode: {color}")
+        if bilevel_encoding is None:
+            bilevel_encoding = 'ccitt' if ccitt_available() else 'flate'
+        if bilevel_encoding not in BILEVEL_ENCODINGS:
+            raise ValueError(f"Unknown bilevel encoding: {bilevel_encoding}")
+        if bilevel_encoding == 'ccitt' and not ccitt_available():
+            raise RuntimeError("CCITT encoding needs Pillow built with libtiff")
+
+        self.dpi = dpi
+        self.quality = quality
+        self.color = color
+        self.bilevel_encoding = bilevel_encoding
+        self.threshold = threshold
+        self.workers = workers or os.cpu_count() or 1
+
+    def _target_size(self, image, extent):
+        """Pixel size to resample to, or None to keep the resolution"""
+        columns, rows = int(image['/Width']), int(image['/Height'])
+        width, height = extent
+        scale = max(width / 72 * self.dpi / columns, height / 72 * self.dpi / rows)
+        if scale * DOWNSAMPLE_THRESHOLD > 1:
+            return None
+        return max(1, round(columns * scale)), max(1, round(rows * scale))
+
+    def _decode(self, image, size):
+        """
+        Decode an image into a Pillow image in mode L or RGB
+
+        Returns:
+            Pillow image, or None if the image cannot be decoded faithfully
+        """
+        if '/Decode' in image or '/Mask' in image or image.get('/ImageMask'):
+            return None
+        image_filter = _image_filter(image)
+
+        if image_filter == '/DCTDecode':
+            decoded = Image.open(io.BytesIO(image._data))
+            if decoded.mode not in ('L', 'RGB'):
+                return None
+            if size is not None:
+                # Let libjpeg decode at 1/2, 1/4 or 1/8 scale where that still covers size
+                decoded.draft(decoded.mode, size)
+            return decoded
+
+        if image_filter in (None, '/FlateDecode') and int(image.get('/BitsPerComponent', 0)) == 8:
+            mode = {1: 'L', 3: 'RGB'}.get(color_components(image.get('/ColorSpace')))
+            if mode is None:
+                return None
+            columns, rows = int(image['/Width']), int(image['/Height'])
+            return Image.frombuffer(mode, (columns, rows), image.get_data(), 'raw', mode, 0, 1)
+
+        return None
+
+    def _encode(self, decoded, image):
+        """
+        Encode a Pillow image for the configured color mode
+
+        Returns:
+            Tuple (data, {key: value} describing the encoding)
+        """
+        if self.color == 'bilevel':
+            bilevel = decoded.convert('L').point(
+                lambda level: 255 if level >= self.threshold else 0, mode='1')
+            columns, rows = bilevel.size
+            encoding = {
+                '/BitsPerComponent': NumberObject(1),
+                '/ColorSpace': NameObject('/DeviceGray'),
+            }
+            if self.bilevel_encoding == 'flate':
+                encoding['/Filter'] = NameObject('/FlateDecode')
+                return zlib.compress(bilevel.tobytes()), encoding
+
+            # One strip, so the strip is the whole Group 4 stream
+            buffer = io.BytesIO()
+            bilevel.save(buffer, 'TIFF', compression='group4', tiffinfo={278: rows})
+            tiff = Image.open(buffer)
+            offset, length = tiff.tag_v2[273][0], tiff.tag_v2[279][0]
+            encoding['/Filter'] = NameObject('/CCITTFaxDecode')
+            encoding['/DecodeParms'] = DictionaryObject({
+                NameObject('/K'): NumberObject(-1),
+                NameObject('/Columns'): NumberObject(columns),
+                NameObject('/Rows'): NumberObject(rows),
+                NameObject('/BlackIs1'): BooleanObject(tiff.tag_v2.get(262) == 1),
+            })
+            return buffer.getvalue()[offset:offset + length], encoding
+
+        encoding = {
+            '/BitsPerComponent': NumberObject(8),
+            '/Filter': NameObject('/DCTDecode'),
+        }
+        if self.color == 'gray' and decoded.mode != 'L':
+            decoded = decoded.convert('L')
+            encoding['/ColorSpace'] = NameObject('/DeviceGray')
+        else:
+            encoding['/ColorSpace'] = image.raw_get('/ColorSpace')
+        buffer = io.BytesIO()
+        decoded.save(buffer, 'JPEG', quality=self.quality, optimize=True)
+        return buffer.getvalue(), encoding
+
+    def recompress(self, image, extent):
+        """
+        Resample and recompress one image
+
+        Args:
+            image: Image XObject stream
+            extent: (width, height) in points it is drawn at (see image_extents)
+
+        Returns:
+            New EncodedStreamObject, or None to keep the image as it is
+        """
+        size = self._target_size(image, extent)
+        if size is None and self.color == 'keep':
+            return None
+        decoded = self._decode(image, size)
+        if decoded is None:
+            return None
+        if size is not None and decoded.size != size:
+            decoded = decoded.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+        data, encoding = self._encode(decoded, image)
+        if len(data) >= len(image._data):
+            return None
+
+        recompressed = EncodedStreamObject()
+        for key, value in image.items():
+            if key not in ENCODING_KEYS:
+                recompressed[NameObject(key)] = value
+        recompressed[NameObject('/Width')] = NumberObject(decoded.size[0])
+        recompressed[NameObject('/Height')] = NumberObject(decoded.size[1])
+        for key, value in encoding.items():
+            recompressed[NameObject(key)] = value
+        recompressed._data = data
+        return recompressed
+
+    def apply(self, pdf_writer):
+        """
+        Recompress the images of a PdfWriter in place right before it is written
+
+        Args:
+            pdf_writer: PyPDF2 PdfWriter holding the finished document
+
+        Returns:
+            Dict with the number of images found and replaced and their
+            encoded size before and after
+        """
+        # Import images still owned by the source documents, as write() would
+        pdf_writer._sweep_indirect_references(pdf_writer._root)
+        extents = image_extents(pdf_writer)
+        images = [(idnum, pdf_writer._objects[idnum - 1]) for idnum in extents]
+
+        stats = {'images': len(images), 'images_replaced': 0, 'bytes_before': 0, 'bytes_after': 0}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = executor.map(lambda item: self.recompress(item[1], extents[item[0]]), images)
+            for (idnum, image), recompressed in zip(images, results):
+                stats['bytes_before'] += len(image._data)
+                if recompressed is None:
+                    stats['bytes_after'] += len(image._data)
+                    continue
+                pdf_writer._objects[idnum - 1] = recompressed
+                stats['images_replaced'] += 1
+                stats['bytes_after'] += len(recompressed._data)
+        return stats
+
+def add_downsample_options(parser):
+    """Add the image downsampling options shared by the command line tools to an OptionParser"""
+    parser.add_option("--downsample", type="int", dest="downsample", metavar="DPI",
+                      help=f"Resample images displayed above {DOWNSAMPLE_THRESHOLD:g}x this resolution "
+                           f"down to it and recompress them (needs Pillow, e.g. {DEFAULT_DPI})")
+    parser.add_option("--jpeg-quality", type="int", dest="jpeg_quality", default=DEFAULT_JPEG_QUALITY,
+                      help=f"JPEG quality of recompressed images (default: {DEFAULT_JPEG_QUALITY})")
+    parser.add_option("--image-color", dest="image_color", choices=COLOR_MODES,
+                      help="Recompress images as: " + ", ".join(COLOR_MODES) +
+                           f" (implies --downsample {DEFAULT_DPI} when given alone)")
+    parser.add_option("--bilevel-encoding", dest="bilevel_encoding", choices=BILEVEL_ENCODINGS,
+                      help="Encoding of bilevel images: " + ", ".join(BILEVEL_ENCODINGS) +
+                           " (default: ccitt when Pillow has libtiff)")
+
+def downsampler_from_options(parser, options):
+    """
+    Build the ImageDownsampler requested on the command line
+
+    Args:
+        parser: OptionParser given to add_downsample_options; invalid
+            options are reported with parser.error
+        options: Parsed options
+
+    Returns:
+        ImageDownsampler, or None if no downsampling option was given
+    """
+    if options.downsample is None and options.image_color is None:
+        return None
+    try:
+        return ImageDownsampler(options.downsample or DEFAULT_DPI, options.jpeg_quality,
+                                options.image_color or 'keep', options.bilevel_encoding)
+    except (ValueError, RuntimeError) as e:
+        parser.error(str(e))
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Page geometries and split engines
+
+A geometry maps an A3 page box to the boxes of its two halves, in the
+order they are emitted. An engine builds the PageObject for one half.
+"""
+import PyPDF2
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    FloatObject,
+    NameObject,
+    RectangleObject,
+)
+
+from .scan import scan_half_page
+
+# Name under which the A3 sheet is registered in each half's resources
+SHEET_XOBJECT_NAME = '/A3Sheet'
+
+def page_box(page):
+    """
+    Return the mediabox of a page as floats
+
+    Args:
+        page: PyPDF2 PageObject
+
+    Returns:
+        Tuple (x0, y0, x1, y1)
+    """
+    mediabox = page.mediabox
+    x0, y0 = float(mediabox.lower_left[0]), float(mediabox.lower_left[1])
+    x1, y1 = float(mediabox.upper_right[0]), float(mediabox.upper_right[1])
+    return x0, y0, x1, y1
+
+def half_boxes(box):
+    """
+    Split a page box into its two A4 halves
+
+    Landscape (wide) pages are split into left and right halves,
+    portrait (tall) pages into top and bottom halves.
+
+    Args:
+        box: Tuple (x0, y0, x1, y1) of the A3 page
+
+    Returns:
+        Tuple (first_box, second_box) where first is left/top
+    """
+    x0, y0, x1, y1 = box
+    width = x1 - x0
+    height = y1 - y0
+
+    if width > height:
+        mid_x = x0 + width / 2
+        return (x0, y0, mid_x, y1), (mid_x, y0, x1, y1)
+
+    mid_y = y0 + height / 2
+    return (x0, mid_y, x1, y1), (x0, y0, x1, mid_y)
+
+def half_boxes_rtl(box):
+    """
+    Like half_boxes, but right before left for landscape pages (vertical writing)
+
+    Portrait pages are still split top first.
+    """
+    first_box, second_box = half_boxes(box)
+    x0, y0, x1, y1 = box
+    if x1 - x0 > y1 - y0:
+        return second_box, first_box
+    return first_box, second_box
+
+def top_bottom_boxes(box):
+    """Split a page into top and bottom halves, whatever its orientation"""
+    x0, y0, x1, y1 = box
+    mid_y = y0 + (y1 - y0) / 2
+    return (x0, mid_y, x1, y1), (x0, y0, x1, mid_y)
+
+def bottom_top_boxes(box):
+    """
+    Split a page into bottom and top halves
+
+    For spreads scanned sideways onto a portrait page: after rotating
+    clockwise, the bottom half is the left page.
+    """
+    first_box, second_box = top_bottom_boxes(box)
+    return second_box, first_box
+
+GEOMETRIES = {
+    'auto': half_boxes,
+    'auto-rtl': half_boxes_rtl,
+    'top-bottom': top_bottom_boxes,
+    'bottom-top': bottom_top_boxes,
+}
+
+def merge_half_page(original_page, box):
+    """
+    Create one half by merging the page into a blank page and cropping it
+
+    Args:
+        original_page: A3 PageObject
+        box: Tuple (x0, y0, x1, y1) of the half in A3 coordinates
+
+    Returns:
+        PageObject with the full A3 mediabox and the half as cropbox
+    """
+    sheet_box = page_box(original_page)
+    half_page = PyPDF2.PageObject.create_blank_page(
+        width=sheet_box[2] - sheet_box[0], height=sheet_box[3] - sheet_box[1])
+    half_page.merge_page(original_page)
+    half_page.cropbox.lower_left = box[:2]
+    half_page.cropbox.upper_right = box[2:]
+    return half_page
+
+def split_page_merge(pdf_writer, original_page, geometry=half_boxes):
+    """
+    Split a page by merging it into two blank pages and cropping each one
+
+    This is the original implementation: every content stream is parsed
+    and rewritten once per half.
+
+    Args:
+        pdf_writer: PdfWriter the halves will be added to (unused)
+        original_page: A3 PageObject
+        geometry: Function returning the two half boxes (see GEOMETRIES)
+
+    Returns:
+        Tuple (first_page, second_page) in geometry order
+    """
+    return tuple(merge_half_page(original_page, box)
+                 for box in geometry(page_box(original_page)))
+
+def _content_stream(original_page):
+    """
+    Build the stream object holding a page's drawing operators
+
+    A single content stream keeps its encoded bytes and filters so it is
+    copied without being decoded. Content arrays have to be joined, so
+    their parts are decoded once and deflated again.
+    """
+    contents = original_page.get('/Contents')
+    if contents is None:
+        return DecodedStreamObject()
+
+    contents = contents.get_object()
+    if isinstance(contents, EncodedStreamObject):
+        stream = EncodedStreamObject()
+        stream._data = contents._data
+        for key in ('/Filter', '/DecodeParms'):
+            if key in contents:
+                stream[NameObject(key)] = contents.raw_get(key)
+        return stream
+
+    if isinstance(contents, ArrayObject):
+        data = b''.join(part.get_object().get_data() + b'\n' for part in contents)
+        stream = DecodedStreamObject()
+        stream.set_data(data)
+        return stream.flate_encode()
+
+    stream = DecodedStreamObject()
+    stream.set_data(contents.get_data())
+    return stream
+
+def page_to_form_xobject(pdf_writer, original_page):
+    """
+    Register an A3 page as a Form XObject in the writer
+
+    Args:
+        pdf_writer: PdfWriter the XObject will be written to
+        original_page: A3 PageObject
+
+    Returns:
+        IndirectObject referencing the Form XObject
+    """
+    form = _content_stream(original_page)
+    form[NameObject('/Type')] = NameObject('/XObject')
+    form[NameObject('/Subtype')] = NameObject('/Form')
+    form[NameObject('/BBox')] = ArrayObject(FloatObject(v) for v in page_box(original_page))
+
+    resources = original_page.raw_get('/Resources') if '/Resources' in original_page else None
+    if resources is not None:
+        # Cloning translates reader references so shared fonts/images are written once
+        form[NameObject('/Resources')] = resources.clone(pdf_writer)
+
+    return pdf_writer._add_object(form)
+
+def xobject_half_page(pdf_writer, form_ref, box):
+    """
+    Create an A4 page that draws the clipped part of a shared Form XObject
+
+    Args:
+        pdf_writer: PdfWriter the page will be added to
+        form_ref: IndirectObject returned by page_to_form_xobject
+        box: Tuple (x0, y0, x1, y1) of the half in A3 coordinates
+
+    Returns:
+        PageObject sized to the half
+    """
+    x0, y0, x1, y1 = box
+    width = x1 - x0
+    height = y1 - y0
+
+    half_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
+    half_page[NameObject('/Resources')] = DictionaryObject({
+        NameObject('/XObject'): DictionaryObject({
+            NameObject(SHEET_XOBJECT_NAME): form_ref,
+        }),
+    })
+
+    # Clip to the half, then shift the sheet so the half sits at the origin
+    content = DecodedStreamObject()
+    content.set_data(
+        f"q 0 0 {width:g} {height:g} re W n "
+        f"1 0 0 1 {-x0:g} {-y0:g} cm {SHEET_XOBJECT_NAME} Do Q".encode()
+    )
+    half_page[NameObject('/Contents')] = pdf_writer._add_object(content)
+
+    return half_page
+
+def split_page_xobject(pdf_writer, original_page, geometry=half_boxes):
+    """
+    Split a page into two halves that share one Form XObject
+
+    The A3 content stream is stored once and never parsed; each half only
+    adds a few bytes of clip and offset operators.
+
+    Args:
+        pdf_writer: PdfWriter the halves will be added to
+        original_page: A3 PageObject
+        geometry: Function returning the two half boxes (see GEOMETRIES)
+
+    Returns:
+        Tuple (first_page, second_page) in geometry order
+    """
+    form_ref = page_to_form_xobject(pdf_writer, original_page)
+    first_box, second_box = geometry(page_box(original_page))
+    return (
+        xobject_half_page(pdf_writer, form_ref, first_box),
+        xobject_half_page(pdf_writer, form_ref, second_box),
+    )
+
+# Keys that must not be shared between the two halves of a page
+PASSTHROUGH_EXCLUDED_KEYS = {
+    '/Parent', '/Annots',
+    '/MediaBox', '/CropBox', '/BleedBox', '/TrimBox', '/ArtBox',
+}
+
+def passthrough_half_page(original_page, box):
+    """
+    Create one half as a shallow copy of the page dictionary with new boxes
+
+    Args:
+        original_page: A3 PageObject
+        box: Tuple (x0, y0, x1, y1) of the half in A3 coordinates
+
+    Returns:
+        PageObject sharing /Contents and /Resources with original_page
+    """
+    half_page = PyPDF2.PageObject(original_page.pdf)
+    for key in original_page:
+        if key not in PASSTHROUGH_EXCLUDED_KEYS:
+            half_page[NameObject(key)] = original_page.raw_get(key)
+
+    half_page[NameObject('/MediaBox')] = RectangleObject(box)
+    half_page[NameObject('/CropBox')] = RectangleObject(box)
+    return half_page
+
+def split_page_passthrough(pdf_writer, original_page, geometry=half_boxes):
+    """
+    Split a page by cloning its dictionary twice and changing only the boxes
+
+    Both halves keep the original /Contents and /Resources as indirect
+    references, so the writer stores them once and no content stream is
+    ever decoded. Each half gets its own dictionary; cropping the same
+    reader page twice would leave both halves with the second box.
+
+    Args:
+        pdf_writer: PdfWriter the halves will be added to (unused)
+        original_page: A3 PageObject
+        geometry: Function returning the two half boxes (see GEOMETRIES)
+
+    Returns:
+        Tuple (first_page, second_page) in geometry order
+    """
+    return tuple(passthrough_half_page(original_page, box)
+                 for box in geometry(page_box(original_page)))
+
+def split_page_scan(pdf_writer, original_page, geometry=half_boxes):
+    """
+    Split a scanned page so each half embeds only its own part of the image
+
+    Pages that draw a single image (see scan.find_scan_image) get a cropped
+    copy of that image per half instead of sharing the full A3 image, which
+    roughly halves the output size of scanner PDFs. Any other page is split
+    like the xobject engine.
+
+    Args:
+        pdf_writer: PdfWriter the halves will be added to
+        original_page: A3 PageObject
+        geometry: Function returning the two half boxes (see GEOMETRIES)
+
+    Returns:
+        Tuple (first_page, second_page) in geometry order
+    """
+    halves = []
+    form_ref = None
+    for side in (0, 1):
+        half_page, form_ref = split_page_side(pdf_writer, original_page, side, 'scan', form_ref, geometry)
+        halves.append(half_page)
+    return tuple(halves)
+
+SPLIT_ENGINES = {
+    'xobject': split_page_xobject,
+    'passthrough': split_page_passthrough,
+    'merge': split_page_merge,
+    'scan': split_page_scan,
+}
+
+DEFAULT_ENGINE = 'xobject'
+
+def split_page_side(pdf_writer, original_page, side, engine=DEFAULT_ENGINE, form_ref=None,
+                    geometry=half_boxes):
+    """
+    Create only one half of a page
+
+    Args:
+        pdf_writer: PdfWriter the half will be added to
+        original_page: A3 PageObject
+        side: 0 for the first half of the geometry, 1 for the second
+        engine: Split engine name (see SPLIT_ENGINES)
+        form_ref: Form XObject of this page from an earlier call (xobject and scan engines)
+        geometry: Function returning the two half boxes (see GEOMETRIES)
+
+    Returns:
+        Tuple (half_page, form_ref); pass form_ref back in for the other side
+        so both halves share one XObject
+    """
+    box = geometry(page_box(original_page))[side]
+
+    if engine == 'scan':
+        half_page = scan_half_page(pdf_writer, original_page, box)
+        if half_page is not None:
+            return half_page, None
+        engine = 'xobject'  # Not a single-image page
+
+    if engine == 'xobject':
+        if form_ref is None:
+            form_ref = page_to_form_xobject(pdf_writer, original_page)
+        return xobject_half_page(pdf_writer, form_ref, box), form_ref
+
+    if engine == 'passthrough':
+        return passthrough_half_page(original_page, box), None
+
+    return merge_half_page(original_page, box), None
+
+def iter_ordered_pages(pdf_writer, pdf_reader, order, engine=DEFAULT_ENGINE, geometry=half_boxes):
+    """
+    Produce A4 pages in output order, splitting each A3 page only when needed
+
+    Instead of splitting every sheet up front and holding all halves until
+    the last one is written, each half is built from its source page at the
+    moment it is due and handed straight to the caller. The only state kept
+    between pages is the Form XObject reference of sheets whose other half
+    is still to come (xobject engine, and the scan engine on non-scan pages).
+
+    Args:
+        pdf_writer: PdfWriter the pages will be added to
+        pdf_reader: PdfReader of the A3 document
+        order: List of half indices (None for a blank page), e.g. from ImpositionPlan.order
+        engine: Split engine name (see SPLIT_ENGINES)
+        geometry: Function returning the two half boxes (see GEOMETRIES)
+
+    Yields:
+        PageObject for each entry of order, or None where a blank page is due
+    """
+    pending_forms = {}  # {sheet_idx: form_ref} for sheets with one half emitted
+
+    for half_idx in order:
+        if half_idx is None:
+            yield None
+            continue
+
+        sheet_idx, side = divmod(half_idx, 2)
+        form_ref = pending_forms.pop(sheet_idx, None)
+        half_page, new_form_ref = split_page_side(
+            pdf_writer, pdf_reader.pages[sheet_idx], side, engine, form_ref, geometry)
+        if form_ref is None and new_form_ref is not None:
+            pending_forms[sheet_idx] = new_form_ref
+
+        yield half_page
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Hot folder: split PDFs as they arrive in an inbox directory
+
+The inbox is watched with inotify on Linux (through ctypes, no extra
+dependency) and rescanned periodically, which also serves as the polling
+fallback where inotify is unavailable or misses writes (e.g. on network
+mounts). A file is handed to the worker pool once it is complete:
+
+    - inotify reported it closed after writing or moved into the inbox, or
+      its size and mtime have not changed for `settle` seconds, and
+    - the end of the file holds the %%EOF marker of a finished PDF.
+
+Files are split by a3divider.batch.split_file in a process pool that is
+started and warmed up once, so the latency per file is only the split
+itself. At most `max_pending` files are queued on the pool at a time; the
+rest wait in the inbox.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import shutil
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .batch import STATUS_OK, is_up_to_date, output_path_for, split_file
+
+logger = logging.getLogger(__name__)
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+# Bytes at the end of a file searched for the %%EOF marker
+EOF_SEARCH_BYTES = 2048
+
+# Seconds between checks of the pending files when inotify is used
+WATCH_TICK = 0.5
+
+class InotifyWatcher:
+    """
+    Report files closed after writing or moved into a directory (Linux only)
+    """
+
+    def __init__(self, directory):
+        """
+        Raises:
+            OSError: if inotify is not available
+        """
+        libc_name = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or libc_name is None:
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+
+        self.directory = Path(directory)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(self.directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {self.directory}")
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for events
+
+        Returns:
+            Tuple (paths, overflow); overflow means events were lost and the
+            directory has to be rescanned
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return [], False
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return [], False
+
+        paths = []
+        overflow = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif mask & IN_IGNORED:
+                raise OSError(f"{self.directory} is no longer watched")
+            elif name:
+                paths.append(self.directory / os.fsdecode(name))
+        return paths, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+def has_pdf_eof(path):
+    """Whether the end of a file holds the %%EOF marker of a finished PDF"""
+    try:
+        with open(path, 'rb') as pdf_file:
+            pdf_file.seek(0, os.SEEK_END)
+            pdf_file.seek(max(0, pdf_file.tell() - EOF_SEARCH_BYTES))
+            return b'%%EOF' in pdf_file.read()
+    except OSError:
+        return False
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def _warm_up():
+    """Pool initializer: parse a tiny PDF so PyPDF2 is loaded before the first file"""
+    import io
+    import PyPDF2
+
+    buffer = io.BytesIO()
+    pdf_writer = PyPDF2.PdfWriter()
+    pdf_writer.add_blank_page(width=842, height=595)
+    pdf_writer.write(buffer)
+    buffer.seek(0)
+    len(PyPDF2.PdfReader(buffer).pages)
+
+class HotFolder:
+    """
+    Watch an inbox and split every finished PDF into an outbox
+    """
+
+    def __init__(self, splitter, inbox, outbox, suffix, workers=1, settle=2.0, interval=1.0,
+                 rescan=30.0, poll=False, archive=None, callback=None, linearize=False,
+                 compact=False, downsample=None):
+        """
+        Args:
+            splitter: Splitter applied to every file (see batch.mode_splitter)
+            inbox: Directory to watch
+            outbox: Directory the results are written to
+            suffix: Output file name suffix (see batch.OUTPUT_SUFFIXES)
+            workers: Worker processes (0 = CPU count)
+            settle: Seconds a file must stay unchanged when no close event was seen
+            interval: Seconds between scans when polling
+            rescan: Seconds between full scans when inotify is used, to pick up
+                files whose events were missed
+            poll: Do not use inotify even where it is available
+            archive: Optional directory successfully split inputs are moved to
+            callback: Called with the batch record of every split file
+            linearize: Write linearized PDFs for fast web view
+            compact: Compact the outputs (see sinks)
+            downsample: Optional ImageDownsampler applied to the outputs
+        """
+        self.splitter = splitter
+        self.inbox = Path(inbox)
+        self.outbox = Path(outbox)
+        self.suffix = suffix
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = 2 * self.workers
+        self.settle = settle
+        self.interval = interval
+        self.rescan = rescan
+        self.poll = poll
+        self.archive = Path(archive) if archive is not None else None
+        self.callback = callback
+        self.linearize = linearize
+        self.compact = compact
+        self.downsample = downsample
+
+        self._pending = {}   # {path: [signature, since, closed]} waiting to be complete
+        self._running = {}   # {future: path}
+        self._failed = {}    # {path: signature} not retried until the file changes
+        self._stopped = False
+
+    def stop(self):
+        """Ask run() to return after the running splits have finished"""
+        self._stopped = True
+
+    def run(self):
+        """Watch the inbox until stop() is called"""
+        self.outbox.mkdir(parents=True, exist_ok=True)
+
+        watcher = None
+        if not self.poll:
+            try:
+                watcher = InotifyWatcher(self.inbox)
+            except OSError as e:
+                logger.info("inotify unavailable (%s), polling instead", e)
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_up) as executor:
+            # Start every worker now rather than on the first file
+            for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+                future.result()
+            logger.info("Watching %s with %d workers (%s)", self.inbox, self.workers,
+                        'inotify' if watcher is not None else 'polling')
+
+            last_scan = None
+            try:
+                while not self._stopped:
+                    if watcher is None or last_scan is None or time.monotonic() - last_scan >= self.rescan:
+                        self._scan()
+                        last_scan = time.monotonic()
+
+                    if watcher is not None:
+                        paths, overflow = watcher.wait(WATCH_TICK)
+                        for path in paths:
+                            if self._is_candidate(path):
+                                self._consider(path, closed=True)
+                        if overflow:
+                            last_scan = None
+                    else:
+                        time.sleep(self.interval)
+
+                    self._collect()
+                    self._dispatch(executor)
+            finally:
+                if watcher is not None:
+                    watcher.close()
+                for future in list(self._running):
+                    future.result()
+                self._collect()
+
+    def _is_candidate(self, path):
+        """PDFs, except hidden and temporary files and outputs written into the inbox"""
+        return (path.suffix.lower() == '.pdf' and not path.name.startswith(('.', '~'))
+                and not path.name.endswith(self.suffix))
+
+    def _scan(self):
+        try:
+            entries = list(self.inbox.iterdir())
+        except FileNotFoundError:
+            logger.warning("Inbox %s does not exist", self.inbox)
+            return
+        for path in entries:
+            if self._is_candidate(path) and path.is_file():
+                self._consider(path, closed=False)
+
+    def _consider(self, path, closed):
+        """Start tracking a new or changed file"""
+        if path in self._running.values():
+            return
+        signature = _signature(path)
+        if signature is None or self._failed.get(path) == signature:
+            return
+        if is_up_to_date(path, output_path_for(path, self.suffix, self.outbox)):
+            return
+
+        entry = self._pending.get(path)
+        if entry is None or entry[0] != signature:
+            self._pending[path] = [signature, time.monotonic(), closed]
+        elif closed:
+            entry[2] = True
+
+    def _dispatch(self, executor):
+        """Queue complete files on the pool, up to max_pending at a time"""
+        now = time.monotonic()
+        for path, entry in list(self._pending.items()):
+            if len(self._running) >= self.max_pending:
+                return
+
+            signature = _signature(path)
+            if signature is None:
+                del self._pending[path]
+                continue
+            if signature != entry[0]:
+                self._pending[path] = [signature, now, False]
+                continue
+            if not (entry[2] or now - entry[1] >= self.settle) or not has_pdf_eof(path):
+                continue
+
+            del self._pending[path]
+            output_path = output_path_for(path, self.suffix, self.outbox)
+            future = executor.submit(split_file, self.splitter, path, output_path, self.linearize,
+                                     self.compact, self.downsample)
+            self._running[future] = path
+
+    def _collect(self):
+        """Handle finished splits"""
+        for future in [future for future in self._running if future.done()]:
+            path = self._running.pop(future)
+            record = future.result()
+
+            if record['status'] == STATUS_OK:
+                self._failed.pop(path, None)
+                if self.archive is not None:
+                    self.archive.mkdir(parents=True, exist_ok=True)
+                    shutil.move(str(path), str(self.archive / path.name))
+            else:
+                self._failed[path] = _signature(path)
+
+            if self.callback is not None:
+                self.callback(record)
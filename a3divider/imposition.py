@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Imposition plans: which A4 pages sit on which scanned A3 page
+
+A plan is compiled once per (scheme, page count, options) into two flat
+integer arrays and memoized, so large jobs reuse the same tables:
+
+    sheet_pages[2*i + side]  A4 page number (1-based) on side 0 (left/top)
+                             or side 1 (right/bottom) of A3 page i
+    gather[p - 1]            half index 2*i + side that becomes A4 page p,
+                             or -1 where no scanned half exists
+
+Reordering split halves is then a single indexed gather over `gather`.
+"""
+from array import array
+from functools import lru_cache
+
+# Plans kept in memory (each is two int arrays of one entry per A4 page)
+PLAN_CACHE_SIZE = 64
+
+# Default pages per signature for perfect binding (4 folded sheets)
+DEFAULT_SIGNATURE_PAGES = 16
+
+BINDING_SCHEMES = {
+    'saddle': '中綴じ',
+    'perfect': '無線綴じ（複数折丁）',
+    'duplex': '両面スキャン（表面→裏面）',
+}
+
+class ImpositionPlan:
+    """
+    Compiled page permutation for one binding scheme and page count
+    """
+
+    __slots__ = ('scheme', 'total_pages', 'rtl', 'sheet_pages', 'gather')
+
+    def __init__(self, scheme, total_pages, rtl, sheet_pages):
+        self.scheme = scheme
+        self.total_pages = total_pages
+        self.rtl = rtl
+        self.sheet_pages = sheet_pages
+
+        self.gather = array('i', [-1]) * total_pages
+        for half_idx, page_num in enumerate(sheet_pages):
+            self.gather[page_num - 1] = half_idx
+
+    @property
+    def num_sheets(self):
+        return len(self.sheet_pages) // 2
+
+    def mapping(self):
+        """Return the plan as generate_booklet_mapping-style (sheet, [left, right]) tuples"""
+        return [(i + 1, [self.sheet_pages[2 * i], self.sheet_pages[2 * i + 1]])
+                for i in range(self.num_sheets)]
+
+    def order(self, num_sheets, total_pages=None):
+        """
+        Gather order for a scan with num_sheets A3 pages
+
+        Args:
+            num_sheets: Number of A3 pages actually present in the input
+            total_pages: Number of A4 pages to output (default: the whole plan)
+
+        Returns:
+            List of half indices, None where a blank page is due
+        """
+        if total_pages is None:
+            total_pages = self.total_pages
+        limit = 2 * num_sheets
+        return [half_idx if 0 <= half_idx < limit else None
+                for half_idx in self.gather[:total_pages]]
+
+def _saddle_sheet_pages(total_pages, offset=0):
+    """
+    Saddle-stitch sides in scan order, using the formula from the Codex analysis:
+
+        Left(i) = S + (2b - 1) * j + b
+        Right(i) = T + 1 - Left(i)
+
+    where S = T / 2, j = i - 1 and b = j mod 2.
+    """
+    S = total_pages // 2
+    pages = []
+    for j in range(S):
+        b = j % 2
+        left = S + (2 * b - 1) * j + b
+        pages.extend((offset + left, offset + total_pages + 1 - left))
+    return pages
+
+def _pad(total_pages, multiple):
+    return ((total_pages + multiple - 1) // multiple) * multiple
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def compile_plan(scheme, total_pages, signature_pages=DEFAULT_SIGNATURE_PAGES, rtl=False):
+    """
+    Compile (or fetch the memoized) plan for a binding scheme
+
+    Schemes:
+        saddle:  one saddle-stitched booklet, scanned from the centre spread outwards
+        perfect: consecutive saddle-stitched signatures of signature_pages pages
+                 (perfect binding), scanned signature by signature
+        duplex:  a saddle-stitched booklet scanned as all first sides, then all
+                 second sides (one pass per side of the stack)
+
+    Args:
+        scheme: One of BINDING_SCHEMES
+        total_pages: A4 page count; padded up to a whole number of sheets
+            (multiple of 4, or of signature_pages for perfect binding)
+        signature_pages: Pages per signature for perfect binding (multiple of 4)
+        rtl: Right-to-left binding; swaps the two halves of every A3 page
+
+    Returns:
+        ImpositionPlan
+
+    Raises:
+        ValueError: for an unknown scheme or invalid page counts
+    """
+    if scheme not in BINDING_SCHEMES:
+        raise ValueError(f"Unknown binding scheme: {scheme}")
+    if total_pages <= 0:
+        raise ValueError("total_pages must be positive")
+
+    if scheme == 'perfect':
+        if signature_pages <= 0 or signature_pages % 4 != 0:
+            raise ValueError("signature_pages must be a positive multiple of 4")
+        total_pages = _pad(total_pages, signature_pages)
+        sheet_pages = []
+        for offset in range(0, total_pages, signature_pages):
+            sheet_pages.extend(_saddle_sheet_pages(signature_pages, offset))
+    else:
+        total_pages = _pad(total_pages, 4)
+        sheet_pages = _saddle_sheet_pages(total_pages)
+        if scheme == 'duplex':
+            sides = [sheet_pages[k:k + 2] for k in range(0, len(sheet_pages), 2)]
+            sheet_pages = [page for side in sides[0::2] + sides[1::2] for page in side]
+
+    if rtl:
+        for k in range(0, len(sheet_pages), 2):
+            sheet_pages[k], sheet_pages[k + 1] = sheet_pages[k + 1], sheet_pages[k]
+
+    return ImpositionPlan(scheme, total_pages, rtl, array('i', sheet_pages))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Parallel A3 -> A4 splitting
+
+The A3 page range is cut into contiguous shards that are split in a
+ProcessPoolExecutor. Each worker runs a Splitter restricted to its shard
+and writes the halves (in source order) to a partial PDF; the parent then
+gathers the halves from all partials in the requested output order. Small
+documents are split in-process, where the cost of starting workers and
+re-reading partials would outweigh the gain.
+"""
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import PyPDF2
+
+from .sinks import FileSink
+
+# Below this many A3 pages the split runs serially
+PARALLEL_MIN_SHEETS = 32
+
+def shard_order(start, stop, num_sheets):
+    """Ordering of a shard: the halves of A3 pages [start, stop) in source order"""
+    return range(2 * start, 2 * stop)
+
+def shards(num_sheets, workers):
+    """Cut range(num_sheets) into up to 2 contiguous shards per worker"""
+    count = min(num_sheets, workers * 2)
+    bounds = [num_sheets * k // count for k in range(count + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _split_shard(splitter, input_path, partial_path):
+    """Worker: split one shard of A3 pages into a partial PDF"""
+    splitter.split(input_path, FileSink(partial_path))
+    return partial_path
+
+@contextmanager
+def parallel_halves(input_path, shard_splitters, workers):
+    """
+    Split the shards of an A3 PDF in worker processes
+
+    Args:
+        input_path: Path of the A3 PDF (workers open it themselves)
+        shard_splitters: One Splitter per shard, in page order, each with a
+            shard_order ordering
+        workers: Number of worker processes
+
+    Yields:
+        List of all halves in source order, read lazily from the partial
+        PDFs, which are deleted when the block exits
+    """
+    partial_dir = tempfile.mkdtemp(prefix='split_parallel_')
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_split_shard, shard_splitter, str(input_path),
+                                str(Path(partial_dir) / f'{k:06d}.pdf'))
+                for k, shard_splitter in enumerate(shard_splitters)
+            ]
+            partial_paths = [future.result() for future in futures]
+
+        halves = []
+        for partial_path in partial_paths:
+            halves.extend(PyPDF2.PdfReader(partial_path).pages)
+        yield halves
+
+    finally:
+        shutil.rmtree(partial_dir, ignore_errors=True)
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Preflight: describe a PDF without splitting it
+
+Only the trailer, the cross-reference table and the page tree are read.
+The dictionaries of content streams and images are parsed straight from
+their file offsets, so their data (the scanned images) is never loaded;
+only Flate content streams are inflated, piece by piece, to measure them:
+
+    sheets          number of A3 pages
+    pages           per-page size, orientation, rotation and image resolution
+    encrypted       whether the document is encrypted (and needs a password)
+    image_pixels    pixels of all images, what decoding them would allocate
+    content_decoded_bytes
+                    size of the content streams once decoded, what the
+                    merge engine and content-array joins allocate
+    estimated_ms    predicted split time per engine (see estimate_ms)
+
+The page count lets the UI fill in the booklet page count, and the cost
+estimate lets the server size a job before doing any heavy work. Page
+trees nested deeper than MAX_TREE_DEPTH, reaching a node twice (cycles and
+shared kids) or holding more than MAX_TREE_NODES_PER_PAGE nodes per page
+are rejected before PyPDF2 walks them recursively. Content streams are
+only inflated until their total passes max_content_bytes, so a Flate
+bomb costs the preflight no more than that.
+"""
+import io
+import os
+import zlib
+
+import PyPDF2
+from PyPDF2.errors import PdfReadError
+from PyPDF2.filters import ASCII85Decode, ASCIIHexDecode
+from PyPDF2.generic import ArrayObject, IndirectObject, read_object
+
+from .engines import SPLIT_ENGINES, page_box
+from .timings import stream_size
+
+# Bytes read at an object's offset to find its dictionary
+STREAM_HEAD_BYTES = 4096
+
+# Deepest /Pages nesting accepted (real documents use a handful of levels)
+MAX_TREE_DEPTH = 32
+
+# Page tree nodes accepted per page in /Count (a balanced tree needs fewer than 2)
+MAX_TREE_NODES_PER_PAGE = 3
+
+# Decoded content stream bytes measured per document before decoding stops
+MAX_CONTENT_BYTES = 256 * 1024 * 1024
+
+# Encoded bytes read, and decoded bytes produced, per inflate step
+DECODE_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# Flate filter names (full and abbreviated inline-image form)
+FLATE_FILTERS = ('/FlateDecode', '/Fl')
+
+def _ascii_hex_decode(data):
+    # PyPDF2's ASCIIHexDecode only takes and returns str
+    return ASCIIHexDecode.decode(data.decode('latin-1')).encode('latin-1')
+
+# Filters that may precede Flate (e.g. reportlab's [/ASCII85Decode /FlateDecode]);
+# they expand the data at most fourfold, so they are decoded in one piece
+ASCII_FILTERS = {
+    '/ASCII85Decode': ASCII85Decode.decode,
+    '/A85': ASCII85Decode.decode,
+    '/ASCIIHexDecode': _ascii_hex_decode,
+    '/AHx': _ascii_hex_decode,
+}
+
+# Pages with one image and at most this much content are counted as scans
+SCAN_CONTENT_BYTES = 256
+
+# Rough cost model of one split (without downsampling), in milliseconds on one core:
+#   base + per_sheet * sheets + per_content_kb * content KB
+#        + per_image_mb * image MB + per_scan_mb * MB of images on scan pages
+# Fitted on the benchmark documents. Only the merge engine parses content
+# streams, and only the scan engine crops images (Flate images are decoded;
+# JPEGs are cropped by jpegtran, or copied like xobject without it); the
+# others copy both without decoding them.
+COST_BASE_MS = 5.0
+COST_MODEL = {
+    'xobject': {'per_sheet': 0.85, 'per_content_kb': 0.0, 'per_image_mb': 2.0, 'per_scan_mb': 0.0},
+    'passthrough': {'per_sheet': 0.95, 'per_content_kb': 0.0, 'per_image_mb': 2.0, 'per_scan_mb': 0.0},
+    'merge': {'per_sheet': 2.0, 'per_content_kb': 70.0, 'per_image_mb': 2.0, 'per_scan_mb': 0.0},
+    'scan': {'per_sheet': 0.85, 'per_content_kb': 0.0, 'per_image_mb': 2.0, 'per_scan_mb': 140.0},
+}
+
+# Added by image downsampling (decode, resample, encode), per million image pixels
+COST_DOWNSAMPLE_PER_MPIXEL = 30.0
+
+def _stream_dict(reader, reference):
+    """
+    Read the dictionary of an indirect object without loading stream data
+
+    Args:
+        reader: PdfReader the reference belongs to
+        reference: IndirectObject
+
+    Returns:
+        DictionaryObject (or whatever the object is, if it is no stream)
+    """
+    offset = reader.xref.get(reference.generation, {}).get(reference.idnum)
+    if offset is None:
+        return reference.get_object()  # In an object stream, so not a stream itself
+
+    reader.stream.seek(offset)
+    head = reader.stream.read(STREAM_HEAD_BYTES)
+    start = head.find(b'obj')
+    ends = [end for end in (head.find(b'stream', start), head.find(b'endobj', start)) if end >= 0]
+    if start < 0 or not ends:
+        return reference.get_object()
+    return read_object(io.BytesIO(head[start + 3:min(ends)].lstrip()), reader)
+
+def _stream_length(reader, reference, dictionary=None):
+    """Encoded length of a stream, from its /Length entry"""
+    if not isinstance(reference, IndirectObject):
+        return 0
+    if dictionary is None:
+        dictionary = _stream_dict(reader, reference)
+    length = dictionary.get('/Length', 0)
+    return int(length.get_object() if isinstance(length, IndirectObject) else length)
+
+def _stream_data_offset(reader, reference):
+    """File offset of the data of a stream, or None if it cannot be found"""
+    offset = reader.xref.get(reference.generation, {}).get(reference.idnum)
+    if offset is None:
+        return None
+    reader.stream.seek(offset)
+    head = reader.stream.read(STREAM_HEAD_BYTES)
+    start = head.find(b'stream', max(head.find(b'obj'), 0))
+    if start < 0:
+        return None
+    start += len(b'stream')
+    # The keyword is followed by CRLF or LF (some writers use a lone CR)
+    if head[start:start + 2] == b'\r\n':
+        start += 2
+    elif head[start:start + 1] in (b'\n', b'\r'):
+        start += 1
+    return offset + start
+
+def _decoded_length(reader, reference, limit):
+    """
+    Decoded length of a content stream, counted no further than just past limit
+
+    Flate data is inflated from the file one piece at a time and thrown
+    away, so memory and time stay bounded by limit; ASCII filters before
+    it are decoded first. Filters after Flate are not applied. Unfiltered
+    streams, other filters and unreadable data count their encoded length.
+    """
+    if not isinstance(reference, IndirectObject):
+        return 0
+    dictionary = _stream_dict(reader, reference)
+    length = _stream_length(reader, reference, dictionary)
+    filters = dictionary.get('/Filter')
+    filters = filters.get_object() if filters is not None else []
+    if not isinstance(filters, ArrayObject):
+        filters = [filters]
+    flate = next((index for index, name in enumerate(filters) if name in FLATE_FILTERS), None)
+    if limit < 0 or flate is None or any(name not in ASCII_FILTERS for name in filters[:flate]):
+        return length
+    data_offset = _stream_data_offset(reader, reference)
+    if data_offset is None:
+        return length
+
+    reader.stream.seek(data_offset)
+    decompressor = zlib.decompressobj()
+    decoded = 0
+    try:
+        if flate:
+            encoded = reader.stream.read(length)
+            for name in filters[:flate]:
+                encoded = ASCII_FILTERS[name](encoded)
+            pieces = (encoded[start:start + DECODE_CHUNK_SIZE]
+                      for start in range(0, len(encoded), DECODE_CHUNK_SIZE))
+        else:
+            pieces = (reader.stream.read(min(length - start, DECODE_CHUNK_SIZE))
+                      for start in range(0, length, DECODE_CHUNK_SIZE))
+        for data in pieces:
+            if not data or decoded > limit or decompressor.eof:
+                break
+            while data and decoded <= limit:
+                decoded += len(decompressor.decompress(data, DECODE_CHUNK_SIZE))
+                data = decompressor.unconsumed_tail
+    except (zlib.error, ValueError, PdfReadError):
+        return max(decoded, length)
+    return decoded
+
+def _check_page_tree(reader):
+    """
+    Make sure the page tree is a small, shallow tree before PyPDF2 flattens it
+
+    Every node is visited once: a node reached twice (a cycle, or a kid
+    shared by several parents, which PyPDF2 would walk once per path) is
+    rejected, so the walk is linear in the size of the file.
+
+    Raises:
+        PdfReadError: if the tree is nested deeper than MAX_TREE_DEPTH, a
+            node is reached twice or the tree has more than
+            MAX_TREE_NODES_PER_PAGE nodes per page of its /Count
+    """
+    root = reader.trailer['/Root'].get_object().raw_get('/Pages')
+    try:
+        count = int(root.get_object().get('/Count', 0))
+    except (TypeError, ValueError):
+        count = 0
+    max_nodes = MAX_TREE_NODES_PER_PAGE * max(count, 1) + MAX_TREE_DEPTH
+    visited = set()
+    nodes = 0
+    pending = [(root, 1)]
+    while pending:
+        node, depth = pending.pop()
+        nodes += 1
+        if depth > MAX_TREE_DEPTH:
+            raise PdfReadError(f"Page tree is nested deeper than {MAX_TREE_DEPTH} levels")
+        if nodes > max_nodes:
+            raise PdfReadError(f"Page tree has more than {max_nodes} nodes for {count} pages")
+        if isinstance(node, IndirectObject):
+            if node.idnum in visited:
+                raise PdfReadError(f"Page tree reaches object {node.idnum} more than once")
+            visited.add(node.idnum)
+        node = node.get_object()
+        if node.get('/Type', '/Pages') == '/Pages':
+            kids = node.raw_get('/Kids') if '/Kids' in node else []
+            pending.extend((kid, depth + 1) for kid in kids.get_object())
+
+def _page_images(reader, page):
+    """Return [(width, height, encoded bytes)] of the images in a page's resources"""
+    resources = page.get('/Resources')
+    xobjects = resources.get_object().get('/XObject') if resources is not None else None
+    if xobjects is None:
+        return []
+    xobjects = xobjects.get_object()
+
+    images = []
+    for name in xobjects:
+        reference = xobjects.raw_get(name)
+        if not isinstance(reference, IndirectObject):
+            continue
+        xobject = _stream_dict(reader, reference)
+        if xobject.get('/Subtype') != '/Image':
+            continue
+        images.append((int(xobject['/Width']), int(xobject['/Height']),
+                       _stream_length(reader, reference)))
+    return images
+
+def _describe_page(reader, page, decode_limit):
+    """
+    Size, orientation, images and content size of one page
+
+    The content streams are decoded up to decode_limit bytes (none if it
+    is negative; see _decoded_length).
+    """
+    x0, y0, x1, y1 = page_box(page)
+    width, height = x1 - x0, y1 - y0
+
+    contents = page.raw_get('/Contents') if '/Contents' in page else None
+    if isinstance(contents, IndirectObject):
+        resolved = _stream_dict(reader, contents)
+        if isinstance(resolved, ArrayObject):
+            contents = resolved
+    parts = contents if isinstance(contents, ArrayObject) else [contents]
+    content_bytes = sum(_stream_length(reader, part) for part in parts)
+    content_decoded_bytes = 0
+    for part in parts:
+        content_decoded_bytes += _decoded_length(reader, part, decode_limit - content_decoded_bytes)
+
+    images = _page_images(reader, page)
+    # Resolution of the largest image, assuming it covers the page
+    dpi = None
+    if images:
+        columns, rows, _ = max(images, key=lambda image: image[0] * image[1])
+        dpi = round(max(columns, rows) * 72 / max(width, height))
+
+    return {
+        'width': round(width, 2),
+        'height': round(height, 2),
+        'orientation': 'landscape' if width > height else 'portrait',
+        'rotate': int(page.get('/Rotate', 0)),
+        'images': len(images),
+        'dpi': dpi,
+        'content_bytes': content_bytes,
+        'content_decoded_bytes': content_decoded_bytes,
+        'image_bytes': sum(image[2] for image in images),
+        'image_pixels': sum(image[0] * image[1] for image in images),
+    }
+
+def estimate_ms(figures, engine, downsample=False):
+    """
+    Predict the time of a split from preflight figures
+
+    Args:
+        figures: Dict with sheets, content_bytes, image_bytes,
+            scan_image_bytes and image_pixels (a preflight result)
+        engine: Split engine name (see COST_MODEL)
+        downsample: Whether the images are downsampled as well (counted
+            as if every image needed it)
+
+    Returns:
+        Estimated milliseconds (integer)
+    """
+    model = COST_MODEL[engine]
+    cost = (COST_BASE_MS + model['per_sheet'] * figures['sheets']
+            + model['per_content_kb'] * figures['content_bytes'] / 1024
+            + model['per_image_mb'] * figures['image_bytes'] / (1024 * 1024)
+            + model['per_scan_mb'] * figures['scan_image_bytes'] / (1024 * 1024))
+    if downsample:
+        cost += COST_DOWNSAMPLE_PER_MPIXEL * figures['image_pixels'] / 1e6
+    return round(cost)
+
+def preflight_pdf(source, password=None, max_content_bytes=MAX_CONTENT_BYTES):
+    """
+    Describe a PDF without splitting it
+
+    Args:
+        source: Path or seekable binary stream of the A3 PDF
+        password: Optional password for encrypted documents
+        max_content_bytes: Decoded content bytes after which no further
+            content streams are decoded; content_decoded_bytes above it
+            means the document decodes to more (and is at least that)
+
+    Returns:
+        Dict with file_bytes, encrypted, password_required, sheets, a4_pages,
+        pages (see _describe_page), content_bytes, content_decoded_bytes,
+        image_bytes, scan_image_bytes, image_pixels, max_dpi and
+        estimated_ms ({engine: ms}); sheets
+        and the fields after it are None if the document is encrypted with
+        an unknown password
+
+    Raises:
+        PyPDF2.errors.PdfReadError: if the file is not a readable PDF or
+            its page tree is malformed (see _check_page_tree)
+    """
+    if isinstance(source, (str, os.PathLike)):
+        file_bytes = os.path.getsize(source)
+    else:
+        file_bytes = stream_size(source)
+
+    reader = PyPDF2.PdfReader(source)
+    result = dict.fromkeys(('sheets', 'a4_pages', 'pages', 'content_bytes', 'content_decoded_bytes',
+                            'image_bytes', 'scan_image_bytes', 'image_pixels', 'max_dpi', 'estimated_ms'))
+    result.update(file_bytes=file_bytes, encrypted=reader.is_encrypted, password_required=False)
+    if reader.is_encrypted and not reader.decrypt(password or ''):
+        result['password_required'] = True
+        return result
+
+    _check_page_tree(reader)
+    pages = []
+    content_decoded_bytes = 0
+    for page in reader.pages:
+        pages.append(_describe_page(reader, page, max_content_bytes - content_decoded_bytes))
+        content_decoded_bytes += pages[-1]['content_decoded_bytes']
+    dpis = [page['dpi'] for page in pages if page['dpi'] is not None]
+    result.update(
+        sheets=len(pages),
+        a4_pages=2 * len(pages),
+        pages=pages,
+        content_bytes=sum(page['content_bytes'] for page in pages),
+        content_decoded_bytes=content_decoded_bytes,
+        image_bytes=sum(page['image_bytes'] for page in pages),
+        scan_image_bytes=sum(page['image_bytes'] for page in pages
+                             if page['images'] == 1 and page['content_bytes'] <= SCAN_CONTENT_BYTES),
+        image_pixels=sum(page['image_pixels'] for page in pages),
+        max_dpi=max(dpis) if dpis else None,
+    )
+    result['estimated_ms'] = {engine: estimate_ms(result, engine) for engine in SPLIT_ENGINES}
+    return result
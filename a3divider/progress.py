@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Progress events of a running split, with an estimate of the time left
+
+Splitter calls its progress callback once the input is parsed, after each
+output page and while the output is written, and keeps the page and byte
+counters of its SplitTimings up to date. SplitProgress is such a callback:
+it turns the calls into events for a listener, at most one per interval
+(and one whenever the stage changes):
+
+    stage        'split' while pages are produced, 'write' while the
+                 document is written out
+    sheets       A3 pages read
+    pages_done   A4 pages produced so far, of pages_total
+    bytes_in     size of the input
+    bytes_out    bytes of the output written so far
+    elapsed      seconds since the split started
+    eta          estimated seconds left, or None if there is no basis yet
+
+While splitting, the estimate comes from the pages per second measured so
+far; until the first page is done, a prior estimate such as a preflight
+cost (see preflight.estimate_ms) is used if given. The write stage (which
+also downsamples and compacts) produces no pages, and its output size is
+not known in advance, so its expected duration is fixed when it starts:
+what is left of the prior estimate, or otherwise WRITE_SHARE of the time
+the split stage took.
+"""
+import time
+
+# Expected duration of the write stage relative to the split stage, without a
+# prior estimate (0.3 to 1 on the benchmark documents, depending on the engine)
+WRITE_SHARE = 0.5
+
+class SplitProgress:
+    """
+    Progress callback for Splitter.split that reports events with an ETA
+    """
+
+    def __init__(self, timings, listener, interval=0.5, estimate_ms=None):
+        """
+        Args:
+            timings: SplitTimings passed to the same split call
+            listener: Callable listener(event) receiving the event dicts
+            interval: Minimum seconds between events of the same stage
+            estimate_ms: Optional prior estimate of the whole split, used
+                for the ETA before any throughput has been measured
+        """
+        self.timings = timings
+        self.listener = listener
+        self.interval = interval
+        self.estimate_ms = estimate_ms
+        # The counters of a reused SplitTimings keep growing; report this split's share
+        self._base = (timings.pages_in, timings.bytes_in, timings.bytes_out)
+        self._start = time.monotonic()
+        self._stage = None
+        self._stage_start = self._start
+        self._last_event = None
+        self._write_seconds = None  # Expected duration of the write stage, once it has started
+
+    def _eta(self, stage, pages_done, pages_total, now):
+        """Seconds left (None if unknown)"""
+        stage_seconds = now - self._stage_start
+        if stage == 'write':
+            return max(0.0, self._write_seconds - stage_seconds)
+        if pages_done > 0 and stage_seconds > 0:
+            return (pages_total - pages_done) * stage_seconds / pages_done
+        if self.estimate_ms is not None:
+            return max(0.0, self.estimate_ms / 1000 - (now - self._start))
+        return None
+
+    def __call__(self, pages_done, pages_total):
+        now = time.monotonic()
+        stage = 'split' if pages_done < pages_total or self._stage is None else 'write'
+        if stage != self._stage:
+            if stage == 'write':
+                split_seconds = now - self._stage_start
+                prior_left = (self.estimate_ms / 1000 - (now - self._start)
+                              if self.estimate_ms is not None else 0)
+                self._write_seconds = prior_left if prior_left > 0 else WRITE_SHARE * split_seconds
+            self._stage = stage
+            self._stage_start = now
+        elif self._last_event is not None and now - self._last_event < self.interval:
+            return
+        self._last_event = now
+
+        pages_in, bytes_in, bytes_out = self._base
+        bytes_in = self.timings.bytes_in - bytes_in
+        bytes_out = self.timings.bytes_out - bytes_out
+        eta = self._eta(stage, pages_done, pages_total, now)
+        self.listener({
+            'stage': stage,
+            'sheets': self.timings.pages_in - pages_in,
+            'pages_done': pages_done,
+            'pages_total': pages_total,
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'elapsed': round(now - self._start, 3),
+            'eta': None if eta is None else round(eta, 1),
+        })
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Rewriting the output with qpdf: linearization and object streams
+
+PyPDF2 writes every object uncompressed with a classic xref table and
+cannot linearize. Where that matters the written document is rewritten
+with pikepdf when it is installed, otherwise with the qpdf command line
+tool:
+
+    linearize       first page and hint tables at the front ("fast web
+                    view"), so a browser shows page 1 while the rest is
+                    still downloading
+    object_streams  small objects packed into compressed object streams,
+                    with a cross-reference stream instead of the table
+"""
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+# qpdf exits with 3 when it succeeded with warnings
+QPDF_WARNINGS = 3
+
+def rewrite_backend():
+    """Return 'pikepdf', 'qpdf' or None when the output cannot be rewritten"""
+    if pikepdf is not None:
+        return 'pikepdf'
+    if shutil.which('qpdf'):
+        return 'qpdf'
+    return None
+
+def rewrite_pdf(source, destination, linearize=False, object_streams=False):
+    """
+    Rewrite a PDF with qpdf
+
+    Args:
+        source: Seekable binary stream positioned at the start of the PDF
+        destination: Writable binary stream
+        linearize: Write a linearized PDF
+        object_streams: Pack objects into object streams (with an xref stream)
+
+    Raises:
+        RuntimeError: if neither pikepdf nor qpdf is available, or qpdf fails
+    """
+    backend = rewrite_backend()
+    if backend == 'pikepdf':
+        stream_mode = (pikepdf.ObjectStreamMode.generate if object_streams
+                       else pikepdf.ObjectStreamMode.preserve)
+        with pikepdf.open(source) as pdf:
+            pdf.save(destination, linearize=bool(linearize), object_stream_mode=stream_mode)
+        return
+    if backend is None:
+        raise RuntimeError("Rewriting the output needs pikepdf or the qpdf command")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = Path(temp_dir) / 'input.pdf'
+        output_path = Path(temp_dir) / 'output.pdf'
+        with open(input_path, 'wb') as input_file:
+            shutil.copyfileobj(source, input_file)
+
+        command = ['qpdf']
+        if linearize:
+            command.append('--linearize')
+        if object_streams:
+            command.append('--object-streams=generate')
+        result = subprocess.run(command + [str(input_path), str(output_path)],
+                                capture_output=True, text=True)
+        if result.returncode not in (0, QPDF_WARNINGS):
+            raise RuntimeError(f"qpdf failed: {result.stderr.strip()}")
+
+        with open(output_path, 'rb') as output_file:
+            shutil.copyfileobj(output_file, destination)
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Image-level cropping of scanned pages
+
+A scanner page is typically one full-page image drawn by a content stream
+like "q 1190 0 0 842 0 0 cm /Im0 Do Q". Cropping such a page with boxes or
+clip paths still embeds the whole A3 image in both halves; here each half
+gets an image holding only its own pixels:
+
+    DCTDecode   cropped losslessly along iMCU boundaries with jpegtran
+    FlateDecode 8-bit images are cropped on the decoded rows and deflated
+
+Both keep every pixel as it was. Pages that are not a single axis-aligned
+image, or whose image cannot be cropped (masks, other filters, JPEG
+without jpegtran installed), are reported as None so the caller can fall
+back to another engine. JPEGs are never decoded and re-encoded, which
+would lose quality and, since the xobject engine already shares one image
+between both halves, would not make the output smaller either.
+"""
+import math
+import shutil
+import subprocess
+import zlib
+
+import PyPDF2
+from PyPDF2.generic import (
+    ArrayObject,
+    ContentStream,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    NameObject,
+    NumberObject,
+)
+
+# Name of the cropped image in each half's resources
+HALF_IMAGE_NAME = '/Scan'
+
+# Image dictionary keys copied to the cropped image
+IMAGE_KEYS = ('/ColorSpace', '/BitsPerComponent', '/Decode', '/Intent', '/Interpolate')
+
+# Operators allowed in the content stream of a scanned page
+SCAN_OPERATORS = {b'q', b'Q', b'cm', b'Do'}
+
+# JPEG start-of-frame markers (baseline, extended, progressive, lossless, arithmetic)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Components per sample of the device color spaces
+COLOR_COMPONENTS = {'/DeviceGray': 1, '/DeviceRGB': 3, '/DeviceCMYK': 4}
+
+def jpeg_header(data):
+    """
+    Read the frame header of a JPEG
+
+    Returns:
+        Tuple (width, height, mcu_width, mcu_height, components), or None if
+        no frame header is found or it is truncated or malformed
+    """
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        length = int.from_bytes(data[pos + 2:pos + 4], 'big')
+        if marker in SOF_MARKERS:
+            if pos + 10 > len(data):
+                return None
+            height = int.from_bytes(data[pos + 5:pos + 7], 'big')
+            width = int.from_bytes(data[pos + 7:pos + 9], 'big')
+            components = data[pos + 9]
+            if components == 0 or pos + 10 + 3 * components > len(data):
+                return None
+            factors = [data[pos + 11 + 3 * i] for i in range(components)]
+            h_max = max(factor >> 4 for factor in factors)
+            v_max = max(factor & 0x0F for factor in factors)
+            if h_max == 0 or v_max == 0:
+                return None
+            # A single component is not interleaved and crops on 8x8 blocks
+            if components == 1:
+                h_max = v_max = 1
+            return width, height, 8 * h_max, 8 * v_max, components
+        pos += 2 + length
+    return None
+
+def color_components(color_space):
+    """
+    Return the number of components of an image color space
+
+    Args:
+        color_space: /ColorSpace value of an image
+
+    Returns:
+        1, 3 or 4 for device and ICC-based color spaces, None for others
+        (Indexed, Separation, ...)
+    """
+    color_space = color_space.get_object() if color_space is not None else None
+    if isinstance(color_space, ArrayObject) and color_space[0] == '/ICCBased':
+        return int(color_space[1].get_object()['/N'])
+    return COLOR_COMPONENTS.get(color_space)
+
+def multiply_matrix(m1, m2):
+    """Concatenate two PDF matrices (m1 applied first)"""
+    a1, b1, c1, d1, e1, f1 = m1
+    a2, b2, c2, d2, e2, f2 = m2
+    return (a1 * a2 + b1 * c2, a1 * b2 + b1 * d2,
+            c1 * a2 + d1 * c2, c1 * b2 + d1 * d2,
+            e1 * a2 + f1 * c2 + e2, e1 * b2 + f1 * d2 + f2)
+
+def find_scan_image(page):
+    """
+    Detect a page that only draws one image
+
+    Args:
+        page: PyPDF2 PageObject
+
+    Returns:
+        Tuple (image stream, (x, y, width, height) of the image on the page),
+        or None if the page is anything else
+    """
+    resources = page.get('/Resources')
+    contents = page.get('/Contents')
+    if resources is None or contents is None:
+        return None
+    resources = resources.get_object()
+    xobjects = resources.get('/XObject')
+    if xobjects is None or set(resources) - {'/XObject', '/ProcSet'}:
+        return None
+    xobjects = xobjects.get_object()
+    if len(xobjects) != 1:
+        return None
+
+    try:
+        operations = ContentStream(contents.get_object(), page.pdf).operations
+    except Exception:
+        return None
+
+    matrix = (1, 0, 0, 1, 0, 0)
+    saved = []
+    placement = None
+    for operands, operator in operations:
+        if operator not in SCAN_OPERATORS:
+            return None
+        if operator == b'q':
+            saved.append(matrix)
+        elif operator == b'Q':
+            if not saved:
+                return None
+            matrix = saved.pop()
+        elif operator == b'cm':
+            matrix = multiply_matrix(tuple(float(v) for v in operands), matrix)
+        elif placement is not None:
+            return None  # Second Do
+        else:
+            placement = (operands[0], matrix)
+
+    if placement is None or placement[0] not in xobjects:
+        return None
+    image = xobjects[placement[0]].get_object()
+    a, b, c, d, e, f = placement[1]
+    if image.get('/Subtype') != '/Image' or b or c or a <= 0 or d <= 0:
+        return None
+    if '/SMask' in image or '/Mask' in image or image.get('/ImageMask'):
+        return None
+    return image, (e, f, a, d)
+
+def _pixel_box(image, placement, box):
+    """Pixel rectangle (left, top, right, bottom) of the image covering box"""
+    x, y, width, height = placement
+    columns, rows = int(image['/Width']), int(image['/Height'])
+    x0, y0, x1, y1 = box
+    left = max(0, math.floor((x0 - x) / width * columns))
+    right = min(columns, math.ceil((x1 - x) / width * columns))
+    top = max(0, math.floor((y + height - y1) / height * rows))
+    bottom = min(rows, math.ceil((y + height - y0) / height * rows))
+    if left >= right or top >= bottom:
+        return None
+    return left, top, right, bottom
+
+def _crop_jpeg_lossless(data, left, top, right, bottom):
+    """
+    Crop a JPEG with jpegtran
+
+    Args:
+        data: JPEG bytes
+        left, top: iMCU-aligned top left corner
+        right, bottom: Exclusive bottom right corner
+
+    Returns:
+        JPEG bytes, or None if jpegtran failed or cropped something else
+    """
+    result = subprocess.run(
+        ['jpegtran', '-copy', 'none', '-crop', f'{right - left}x{bottom - top}+{left}+{top}'],
+        input=data, capture_output=True)
+    if result.returncode != 0:
+        return None
+    cropped = jpeg_header(result.stdout)
+    if cropped is None or cropped[:2] != (right - left, bottom - top):
+        return None
+    return result.stdout
+
+def _crop_jpeg(data, left, top, right, bottom):
+    """
+    Crop a JPEG losslessly with jpegtran
+
+    The top left corner is moved up and left to the nearest iMCU boundary,
+    as jpegtran does, so the result may start before the requested pixel.
+
+    Returns:
+        Tuple (jpeg bytes, left, top) of what was actually cropped, or None
+        if jpegtran is not installed or failed
+    """
+    if not shutil.which('jpegtran'):
+        return None
+    header = jpeg_header(data)
+    if header is None:
+        return None
+    mcu_width, mcu_height = header[2], header[3]
+    left -= left % mcu_width
+    top -= top % mcu_height
+
+    cropped = _crop_jpeg_lossless(data, left, top, right, bottom)
+    if cropped is None:
+        return None
+    return cropped, left, top
+
+def _crop_flate(image, left, top, right, bottom):
+    """
+    Crop an 8-bit Flate image on its decoded rows
+
+    Returns:
+        Tuple (deflated bytes, left, top), or None for other bit depths or color spaces
+    """
+    if int(image.get('/BitsPerComponent', 0)) != 8:
+        return None
+    components = color_components(image.get('/ColorSpace'))
+    if components is None:
+        return None
+
+    data = image.get_data()
+    stride = int(image['/Width']) * components
+    rows = [data[row * stride + left * components:row * stride + right * components]
+            for row in range(top, bottom)]
+    return zlib.compress(b''.join(rows)), left, top
+
+def crop_image(image, pixel_box):
+    """
+    Crop an image XObject
+
+    Args:
+        image: Image stream from find_scan_image
+        pixel_box: (left, top, right, bottom) in pixels
+
+    Returns:
+        Tuple (stream data, filter, left, top, width, height) of the cropped
+        image, or None if it cannot be cropped
+    """
+    image_filter = image.get('/Filter')
+    if isinstance(image_filter, ArrayObject):
+        image_filter = image_filter[0] if len(image_filter) == 1 else None
+
+    if image_filter == '/DCTDecode':
+        cropped = _crop_jpeg(image._data, *pixel_box)
+    elif image_filter == '/FlateDecode':
+        cropped = _crop_flate(image, *pixel_box)
+    else:
+        cropped = None
+
+    if cropped is None:
+        return None
+    data, left, top = cropped
+    return data, image_filter, left, top, pixel_box[2] - left, pixel_box[3] - top
+
+def scan_half_page(pdf_writer, original_page, box):
+    """
+    Create an A4 page holding only the pixels of its half of a scanned page
+
+    Args:
+        pdf_writer: PdfWriter the page will be added to
+        original_page: A3 PageObject
+        box: Tuple (x0, y0, x1, y1) of the half in A3 coordinates
+
+    Returns:
+        PageObject sized to the half, or None if the page is not a single
+        image that can be cropped
+    """
+    found = find_scan_image(original_page)
+    if found is None:
+        return None
+    image, placement = found
+    pixel_box = _pixel_box(image, placement, box)
+    if pixel_box is None:
+        return None
+    cropped = crop_image(image, pixel_box)
+    if cropped is None:
+        return None
+    data, image_filter, left, top, columns, rows = cropped
+
+    half_image = EncodedStreamObject()
+    for key in IMAGE_KEYS:
+        if key in image:
+            half_image[NameObject(key)] = image.raw_get(key).clone(pdf_writer)
+    half_image[NameObject('/Type')] = NameObject('/XObject')
+    half_image[NameObject('/Subtype')] = NameObject('/Image')
+    half_image[NameObject('/Width')] = NumberObject(columns)
+    half_image[NameObject('/Height')] = NumberObject(rows)
+    half_image[NameObject('/Filter')] = NameObject(image_filter)
+    half_image._data = data
+
+    # Where the cropped pixels sit on the A3 page, relative to the half
+    x, y, width, height = placement
+    pixel_width = width / int(image['/Width'])
+    pixel_height = height / int(image['/Height'])
+    image_x = x + left * pixel_width - box[0]
+    image_y = y + height - (top + rows) * pixel_height - box[1]
+
+    half_width = box[2] - box[0]
+    half_height = box[3] - box[1]
+    half_page = PyPDF2.PageObject.create_blank_page(width=half_width, height=half_height)
+    half_page[NameObject('/Resources')] = DictionaryObject({
+        NameObject('/XObject'): DictionaryObject({
+            NameObject(HALF_IMAGE_NAME): pdf_writer._add_object(half_image),
+        }),
+    })
+
+    # Clip to the half: iMCU alignment and rounding may add pixels of the other half
+    content = DecodedStreamObject()
+    content.set_data(
+        f"q 0 0 {half_width:g} {half_height:g} re W n "
+        f"{columns * pixel_width:g} 0 0 {rows * pixel_height:g} {image_x:g} {image_y:g} cm "
+        f"{HALF_IMAGE_NAME} Do Q".encode()
+    )
+    half_page[NameObject('/Contents')] = pdf_writer._add_object(content)
+    return half_page
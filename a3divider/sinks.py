@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Output sinks for Splitter
+
+A sink owns the PdfWriter the output pages are built in (engines register
+shared objects such as Form XObjects in it), receives the pages in output
+order and writes the document once the split is finished:
+
+    writer            PdfWriter the pages are built in
+    add_page(page)    append one output page
+    finish(progress)  write the document and return the number of bytes
+                      written; progress(bytes_written), if given, is
+                      called as the output is written
+
+Both sinks can downsample its images (see downsample) and compact the
+document (see compact) before it is written, and write linearized PDFs or
+object streams (see rewrite).
+"""
+import os
+import tempfile
+from pathlib import Path
+
+import PyPDF2
+
+from .compact import compact_available, compact_writer
+from .rewrite import rewrite_backend, rewrite_pdf
+
+class _CountingStream:
+    """Binary stream wrapper that reports the bytes written through it"""
+
+    def __init__(self, stream, progress):
+        self._stream = stream
+        self._progress = progress
+        self.written = 0
+
+    def write(self, data):
+        result = self._stream.write(data)
+        self.written += len(data)
+        self._progress(self.written)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+def _check_linearize(linearize):
+    if linearize and rewrite_backend() is None:
+        raise RuntimeError("Linearized output needs pikepdf or the qpdf command")
+    return linearize
+
+class StreamSink:
+    """
+    Write the output to a binary stream
+    """
+
+    def __init__(self, stream, linearize=False, compact=False, downsample=None):
+        """
+        Args:
+            stream: Writable binary stream; rewound to the start after
+                writing when it is seekable
+            linearize: Write a linearized PDF for fast web view
+            compact: Merge identical objects, compress unfiltered streams
+                and, where pikepdf or qpdf is available, pack objects into
+                object streams
+            downsample: Optional ImageDownsampler applied to the images
+
+        Raises:
+            RuntimeError: if linearize is set but neither pikepdf nor qpdf is available
+        """
+        self.stream = stream
+        self.writer = PyPDF2.PdfWriter()
+        self.linearize = _check_linearize(linearize)
+        self.compact = compact
+        self.downsample = downsample
+
+    def add_page(self, page):
+        self.writer.add_page(page)
+
+    def _write(self, stream):
+        if self.downsample is not None:
+            self.downsample.apply(self.writer)
+        if self.compact and compact_available():
+            compact_writer(self.writer)
+        object_streams = self.compact and rewrite_backend() is not None
+        if not (self.linearize or object_streams):
+            self.writer.write(stream)
+            return
+        with tempfile.TemporaryFile() as written:
+            self.writer.write(written)
+            written.seek(0)
+            rewrite_pdf(written, stream, self.linearize, object_streams)
+
+    def finish(self, progress=None):
+        self._write(self.stream if progress is None else _CountingStream(self.stream, progress))
+        if not self.stream.seekable():
+            return 0
+        size = self.stream.tell()
+        self.stream.seek(0)
+        return size
+
+class FileSink(StreamSink):
+    """
+    Write the output to a file, replacing it only once it is complete
+    """
+
+    def __init__(self, path, linearize=False, compact=False, downsample=None):
+        """
+        Args:
+            path: Output file; written as <path>.part first, so an interrupted
+                split never leaves a truncated PDF under the final name
+            linearize: Write a linearized PDF for fast web view
+            compact: Compact the output (see StreamSink)
+            downsample: Optional ImageDownsampler applied to the images
+        """
+        super().__init__(None, linearize, compact, downsample)
+        self.path = Path(path)
+
+    def finish(self, progress=None):
+        partial_path = self.path.with_name(self.path.name + '.part')
+        try:
+            with open(partial_path, 'wb') as output_file:
+                self._write(output_file if progress is None else _CountingStream(output_file, progress))
+            os.replace(partial_path, self.path)
+        except BaseException:
+            try:
+                os.remove(partial_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return self.path.stat().st_size
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+The Splitter: one pipeline behind the web app and every command line tool
+
+    source PDF -> ordering -> engine + geometry -> rotation -> sink
+
+Each step is pluggable:
+    engine    how a half page is built (see engines.SPLIT_ENGINES)
+    geometry  which two boxes a page is cut into and which comes first
+              (a name from engines.GEOMETRIES or any function box -> (box, box))
+    ordering  which half goes where in the output: None keeps the source
+              order, BookletOrdering restores a bound booklet, and any
+              function num_sheets -> list of half indices (None for a
+              blank page) can be used
+    sink      where the output pages go (see sinks)
+"""
+import os
+import time
+from functools import partial
+
+import PyPDF2
+
+from .engines import DEFAULT_ENGINE, GEOMETRIES, SPLIT_ENGINES, iter_ordered_pages
+from .imposition import DEFAULT_SIGNATURE_PAGES, compile_plan
+from .parallel import PARALLEL_MIN_SHEETS, parallel_halves, shard_order, shards
+from .timings import SplitTimings, stream_size
+
+# A4 size used for pages missing from the source
+BLANK_PAGE_SIZE = (595, 842)
+
+class BookletOrdering:
+    """
+    Output order of a bound booklet (see imposition.compile_plan)
+    """
+
+    def __init__(self, binding='saddle', total_pages=None, signature_pages=DEFAULT_SIGNATURE_PAGES,
+                 rtl=False):
+        """
+        Args:
+            binding: Binding scheme (see imposition.BINDING_SCHEMES)
+            total_pages: A4 pages to output (default: two per A3 page)
+            signature_pages: Pages per signature for perfect binding
+            rtl: Right-to-left binding
+        """
+        self.binding = binding
+        self.total_pages = total_pages
+        self.signature_pages = signature_pages
+        self.rtl = rtl
+
+    def plan(self, num_sheets):
+        """Return the memoized ImpositionPlan for a scan with num_sheets A3 pages"""
+        return compile_plan(self.binding, self.total_pages or 2 * num_sheets,
+                            self.signature_pages, self.rtl)
+
+    def __call__(self, num_sheets):
+        return self.plan(num_sheets).order(num_sheets, self.total_pages or 2 * num_sheets)
+
+class Splitter:
+    """
+    Split an A3 PDF into A4 pages
+    """
+
+    def __init__(self, engine=DEFAULT_ENGINE, geometry='auto', ordering=None, rotate=0,
+                 workers=1, min_parallel_sheets=PARALLEL_MIN_SHEETS):
+        """
+        Args:
+            engine: Split engine name (see engines.SPLIT_ENGINES)
+            geometry: Geometry name (see engines.GEOMETRIES) or function
+            ordering: None for source order, or function num_sheets -> order
+            rotate: Clockwise rotation of every half in degrees (multiple of 90)
+            workers: Worker processes (1 splits in this process, 0 = CPU count);
+                only used for sources given as paths
+            min_parallel_sheets: Split serially below this many A3 pages
+
+        Raises:
+            ValueError: for an unknown engine or geometry
+        """
+        if engine not in SPLIT_ENGINES:
+            raise ValueError(f"Unknown split engine: {engine}")
+        if isinstance(geometry, str):
+            if geometry not in GEOMETRIES:
+                raise ValueError(f"Unknown geometry: {geometry}")
+            geometry = GEOMETRIES[geometry]
+
+        self.engine = engine
+        self.geometry = geometry
+        self.ordering = ordering
+        self.rotate = rotate
+        self.workers = workers or os.cpu_count() or 1
+        self.min_parallel_sheets = min_parallel_sheets
+
+    def order(self, num_sheets):
+        """Return the output order for num_sheets A3 pages (half indices, None for blanks)"""
+        if self.ordering is None:
+            return range(2 * num_sheets)
+        return self.ordering(num_sheets)
+
+    def split(self, source, sink, progress=None, timings=None):
+        """
+        Split a document and write the result to a sink
+
+        Args:
+            source: Path or seekable binary stream of the A3 PDF
+            sink: Output sink (see sinks)
+            progress: Optional callback progress(a4_pages_done, a4_pages_total),
+                called once the input is parsed, after each page and while
+                the output is written (see progress.SplitProgress)
+            timings: Optional SplitTimings that receives the stage durations
+                (parse, split, rotate, add, write) and page/byte counts;
+                the counts are kept current for the progress callback
+
+        Returns:
+            Number of A4 pages written
+        """
+        if timings is None:
+            timings = SplitTimings()
+        lap = time.perf_counter()
+
+        pdf_reader = PyPDF2.PdfReader(source)
+        num_sheets = len(pdf_reader.pages)
+        order = self.order(num_sheets)
+        is_path = isinstance(source, (str, os.PathLike))
+        timings.pages_in += num_sheets
+        timings.bytes_in += os.path.getsize(source) if is_path else stream_size(source)
+        lap = timings.lap('parse', lap)
+        if progress is not None:
+            progress(0, len(order))
+
+        if is_path and self.workers != 1 and num_sheets >= self.min_parallel_sheets:
+            shard_splitters = [
+                Splitter(self.engine, self.geometry, partial(shard_order, start, stop), self.rotate)
+                for start, stop in shards(num_sheets, self.workers)
+            ]
+            with parallel_halves(source, shard_splitters, self.workers) as halves:
+                # Halves from the workers are already rotated
+                pages = (None if half_idx is None else halves[half_idx] for half_idx in order)
+                self._emit(pages, len(order), sink, 0, progress, timings, lap)
+        else:
+            pages = iter_ordered_pages(sink.writer, pdf_reader, order, self.engine, self.geometry)
+            self._emit(pages, len(order), sink, self.rotate, progress, timings, lap)
+
+        return len(order)
+
+    def _emit(self, pages, total_pages, sink, rotate, progress, timings, lap):
+        """Hand the pages to the sink in order and finish it"""
+        for page_num, half_page in enumerate(pages, 1):
+            lap = timings.lap('split', lap)
+            if half_page is None:
+                # Create blank page if missing
+                half_page = PyPDF2.PageObject.create_blank_page(
+                    width=BLANK_PAGE_SIZE[0], height=BLANK_PAGE_SIZE[1])
+            elif rotate:
+                half_page.rotate(rotate)
+                lap = timings.lap('rotate', lap)
+
+            sink.add_page(half_page)
+            timings.pages_out += 1
+            lap = timings.lap('add', lap)
+
+            if progress is not None:
+                progress(page_num, total_pages)
+
+        bytes_out = timings.bytes_out
+
+        def written(num_bytes):
+            timings.bytes_out = bytes_out + num_bytes
+            progress(total_pages, total_pages)
+
+        with timings.stage('write'):
+            timings.bytes_out = bytes_out + sink.finish(None if progress is None else written)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Per-stage timers and page/byte counters of a split
+"""
+import os
+import time
+from contextlib import contextmanager
+
+# Stages of a split call, in the order they run
+SPLIT_STAGES = ('parse', 'split', 'rotate', 'add', 'write')
+
+def stream_size(stream):
+    """Return the total size of a seekable binary stream without moving it"""
+    position = stream.tell()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(position)
+    return size
+
+def format_server_timing(stages, total=None):
+    """
+    Format stage durations as a Server-Timing header value
+
+    Args:
+        stages: {stage: seconds}
+        total: Optional overall duration in seconds
+
+    Returns:
+        e.g. 'parse;dur=1.2, split;dur=30.5, total;dur=40.1' (milliseconds)
+    """
+    entries = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in stages.items()]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+class SplitTimings:
+    """
+    Per-stage timers and page/byte counters of one request or split call
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.pages_in = 0
+        self.pages_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def lap(self, stage, since):
+        """
+        Add the time since a perf_counter value to a stage
+
+        Returns the current perf_counter value, so consecutive stages of a
+        loop can be timed with one clock read each:
+
+            lap = timings.lap('split', lap)
+        """
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - since
+        return now
+
+    @contextmanager
+    def stage(self, stage):
+        """Time the enclosed block as a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.lap(stage, start)
+
+    def split_seconds(self):
+        """Total time of the split stages (excluding e.g. upload spooling)"""
+        return sum(self.stages.get(stage, 0.0) for stage in SPLIT_STAGES)
+
+    def server_timing(self, total=None):
+        """Return the stages as a Server-Timing header value"""
+        return format_server_timing(self.stages, total)
+
+    def as_dict(self):
+        """Return a JSON-serializable copy (durations rounded to microseconds)"""
+        return {
+            'stages': {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            'pages_in': self.pages_in,
+            'pages_out': self.pages_out,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Cost-based admission control for the web application
+
+Before a split runs, its cost is estimated from a preflight of the upload
+(see a3divider.preflight), which only reads the page tree and stream
+dictionaries. An admitted split holds its estimated milliseconds as a
+lease until it has finished, whether it runs in the request or waits in
+the job pool:
+
+    <pid>-<lease_id>.json  {pid, cost_ms, created}
+
+The leases are files, so the budgets hold across all gunicorn workers:
+
+    global budget   estimated work admitted by all workers together
+    worker budget   estimated work admitted by one worker (its requests
+                    and the jobs queued in its pool)
+
+A split that does not fit waits (requests) or is turned away with a
+retry hint (jobs), unless nothing else holds the budget, so huge scans
+still run one at a time. Splits below small_cost_ms are always admitted,
+which keeps small jobs fast while large ones are shed. Documents that
+are too large to split at all are refused outright.
+"""
+import fcntl
+import json
+import math
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from a3divider import estimate_ms, preflight_pdf
+from store import pid_alive
+
+# Seconds between budget checks while a request waits for admission
+POLL_INTERVAL = 0.25
+
+# Longest Retry-After hint in seconds
+MAX_RETRY_AFTER = 300
+
+class Overloaded(Exception):
+    """
+    A split did not fit the budgets
+
+    Attributes:
+        retry_after: Seconds after which the budget is expected to have room
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Budgets of estimated split time shared by the gunicorn workers
+    """
+
+    def __init__(self, root, global_budget_ms=120000, worker_budget_ms=60000, small_cost_ms=1000,
+                 max_wait=10, max_sheets=5000, max_page_pixels=300000000, max_content_bytes=256 * 1024 * 1024,
+                 max_age=3600, metrics=None):
+        """
+        Args:
+            root: Directory holding one lease file per admitted split
+            global_budget_ms: Estimated milliseconds admitted by all workers together
+            worker_budget_ms: Estimated milliseconds admitted by one worker
+            small_cost_ms: Splits estimated at or below this are always admitted
+            max_wait: Seconds a request waits for room before it is turned away
+            max_sheets: Largest number of A3 pages accepted
+            max_page_pixels: Largest number of image pixels accepted on one page
+                (decoding more is treated as a decompression bomb)
+            max_content_bytes: Largest decoded size of all content streams
+                accepted (Flate bombs; the preflight stops inflating there)
+            max_age: Seconds after which a lease is considered leaked and dropped
+            metrics: Optional Metrics registry the decisions are recorded in
+        """
+        self.root = Path(root)
+        self.global_budget_ms = global_budget_ms
+        self.worker_budget_ms = worker_budget_ms
+        self.small_cost_ms = small_cost_ms
+        self.max_wait = max_wait
+        self.max_sheets = max_sheets
+        self.max_page_pixels = max_page_pixels
+        self.max_content_bytes = max_content_bytes
+        self.max_age = max_age
+        self.metrics = metrics
+
+    def _record(self, outcome):
+        if self.metrics is not None:
+            self.metrics.inc('a3divider_admission_total', outcome=outcome)
+
+    def size(self, source, options):
+        """
+        Estimate the cost of a split from a preflight of its input
+
+        Args:
+            source: Path or seekable binary stream of the A3 PDF
+            options: Keyword arguments of the split function (engine, downsample)
+
+        Returns:
+            Estimated milliseconds
+
+        Raises:
+            ValueError: with a message suitable for the user, if the document
+                cannot be read or is too large to split
+        """
+        try:
+            figures = preflight_pdf(source, max_content_bytes=self.max_content_bytes)
+        except Exception as e:
+            self._record('refused')
+            raise ValueError(f'PDFを読み込めませんでした: {str(e)}')
+
+        if figures['password_required']:
+            self._record('refused')
+            raise ValueError('パスワードで保護されたPDFは処理できません')
+        if figures['sheets'] > self.max_sheets:
+            self._record('refused')
+            raise ValueError(f'ページ数が上限 ({self.max_sheets}ページ) を超えています')
+        if any(page['image_pixels'] > self.max_page_pixels for page in figures['pages']):
+            self._record('refused')
+            raise ValueError(f'画像の画素数が上限 (1ページあたり{self.max_page_pixels // 1000000}メガピクセル) '
+                             f'を超えています')
+        if figures['content_decoded_bytes'] > self.max_content_bytes:
+            self._record('refused')
+            raise ValueError(f'ページの内容が展開後のサイズの上限 ({self.max_content_bytes // (1024 * 1024)}MB) '
+                             f'を超えています')
+
+        return estimate_ms(figures, options['engine'], options.get('downsample') is not None)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the lock that makes checking and taking the budget one step across processes"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / 'lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _leases(self):
+        """Return the leases of live processes, deleting those of exited processes and leaked ones"""
+        leases = []
+        cutoff = time.time() - self.max_age
+        for path in self.root.glob('*.json'):
+            try:
+                with open(path) as lease_file:
+                    lease = json.load(lease_file)
+            except (OSError, ValueError):
+                continue
+            if not pid_alive(lease['pid']) or lease['created'] < cutoff:
+                path.unlink(missing_ok=True)
+                continue
+            leases.append(lease)
+        return leases
+
+    def usage(self):
+        """Return (global, this worker's) estimated milliseconds currently admitted"""
+        with self._locked():
+            leases = self._leases()
+        pid = os.getpid()
+        return (sum(lease['cost_ms'] for lease in leases),
+                sum(lease['cost_ms'] for lease in leases if lease['pid'] == pid))
+
+    def _excess(self, cost_ms, leases):
+        """Milliseconds by which admitting cost_ms now would overrun a budget (0 if it fits)"""
+        if cost_ms <= self.small_cost_ms:
+            return 0
+        pid = os.getpid()
+        used = sum(lease['cost_ms'] for lease in leases)
+        used_here = sum(lease['cost_ms'] for lease in leases if lease['pid'] == pid)
+        # An empty budget takes any split, so a job larger than the budget still runs alone
+        excess = 0
+        if used > 0:
+            excess = max(excess, used + cost_ms - self.global_budget_ms)
+        if used_here > 0:
+            excess = max(excess, used_here + cost_ms - self.worker_budget_ms)
+        return excess
+
+    def admit(self, cost_ms, wait=0):
+        """
+        Take cost_ms of the budgets, waiting up to wait seconds for room
+
+        Args:
+            cost_ms: Estimated milliseconds (from size())
+            wait: Seconds to wait for admitted splits to finish
+
+        Returns:
+            Lease ID, to be passed to release() once the split has finished
+
+        Raises:
+            Overloaded: if the split still does not fit after wait seconds
+        """
+        start = time.monotonic()
+        attempts = 0
+        while True:
+            attempts += 1
+            with self._locked():
+                excess = self._excess(cost_ms, self._leases())
+                if excess <= 0:
+                    lease_id = f'{os.getpid()}-{uuid.uuid4().hex}'
+                    tmp_path = self.root / f'{lease_id}.tmp'
+                    with open(tmp_path, 'w') as lease_file:
+                        json.dump({'pid': os.getpid(), 'cost_ms': cost_ms, 'created': time.time()},
+                                  lease_file)
+                    os.replace(tmp_path, self.root / f'{lease_id}.json')
+                    break
+
+            waited = time.monotonic() - start
+            if waited >= wait:
+                self._record('rejected')
+                # Admitted work is assumed to finish at its estimated pace
+                retry_after = min(MAX_RETRY_AFTER, max(1, math.ceil(excess / 1000)))
+                raise Overloaded('サーバーが混雑しています。しばらくしてから再度お試しください', retry_after)
+            time.sleep(min(POLL_INTERVAL, wait - waited))
+
+        waited = time.monotonic() - start
+        self._record('admitted' if attempts == 1 else 'waited')
+        if self.metrics is not None:
+            self.metrics.observe('a3divider_admission_wait_seconds', waited)
+            self.metrics.inc('a3divider_admitted_cost_milliseconds', cost_ms)
+        return lease_id
+
+    def release(self, lease_id):
+        """Return the budget taken by admit()"""
+        path = self.root / f'{lease_id}.json'
+        try:
+            with open(path) as lease_file:
+                cost_ms = json.load(lease_file)['cost_ms']
+        except (OSError, ValueError):
+            return  # Already dropped by _leases()
+        path.unlink(missing_ok=True)
+        if self.metrics is not None:
+            self.metrics.inc('a3divider_admitted_cost_milliseconds', -cost_ms)
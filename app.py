@@ -2,17 +2,48 @@
 """
 A3 to A4 PDF Splitter Web Application
 """
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for
-import PyPDF2
+from flask import Flask, Response, render_template, request, send_file, flash, redirect, url_for, jsonify, g
+import json
 import os
+import re
+import hashlib
 import tempfile
+import threading
+import time
 from pathlib import Path
 from werkzeug.utils import secure_filename
 import io
 
+from a3divider import (
+    BINDING_SCHEMES,
+    DEFAULT_ENGINE,
+    DEFAULT_SIGNATURE_PAGES,
+    SPLIT_ENGINES,
+    BookletOrdering,
+    Splitter,
+    SplitTimings,
+    StreamSink,
+    compile_plan,
+    preflight_pdf,
+    rewrite_backend,
+)
+from a3divider.downsample import (
+    COLOR_MODES,
+    DEFAULT_DPI,
+    DEFAULT_JPEG_QUALITY,
+    ImageDownsampler,
+    downsample_available,
+)
+from admission import AdmissionController, Overloaded
+from jobs import JobQueue
+from result_cache import ResultCache, make_cache_key
+from metrics import Metrics
+from store import Store
+from uploads import UploadStore
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
+app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max request size (larger files are sent in chunks)
 
 # Production settings
 if os.environ.get('FLASK_ENV') == 'production':
@@ -21,213 +52,393 @@ if os.environ.get('FLASK_ENV') == 'production':
     app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
 ALLOWED_EXTENSIONS = {'pdf'}
+SHA256_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+# Uploads and results are kept on disk so memory use does not grow with file size
+PROCESSING_DIR = Path(os.environ.get('PDF_PROCESSING_DIR', '/tmp/pdf_processing'))
+SPOOL_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# Job records, the result cache index and metrics, shared by all gunicorn workers
+store = Store(PROCESSING_DIR / 'a3divider.sqlite3')
+
+# Counters shared by the gunicorn workers and their job processes, served at /metrics
+metrics = Metrics(store)
+
+# Splits are sized by a preflight and only run while they fit the shared budgets
+admission = AdmissionController(
+    PROCESSING_DIR / 'admission',
+    global_budget_ms=int(os.environ.get('ADMISSION_BUDGET_MS', 120000)),
+    worker_budget_ms=int(os.environ.get('ADMISSION_WORKER_BUDGET_MS', 60000)),
+    small_cost_ms=int(os.environ.get('ADMISSION_SMALL_COST_MS', 1000)),
+    max_wait=float(os.environ.get('ADMISSION_MAX_WAIT', 10)),
+    max_sheets=int(os.environ.get('ADMISSION_MAX_SHEETS', 5000)),
+    max_page_pixels=int(os.environ.get('ADMISSION_MAX_PAGE_PIXELS', 300000000)),
+    max_content_bytes=int(os.environ.get('ADMISSION_MAX_CONTENT_BYTES', 256 * 1024 * 1024)),
+    metrics=metrics,
+)
+
+# Results of repeated uploads with the same options are served from disk
+result_cache = ResultCache(
+    PROCESSING_DIR / 'cache',
+    store,
+    max_bytes=int(os.environ.get('RESULT_CACHE_MAX_BYTES', 1024 * 1024 * 1024)),
+    ttl=int(os.environ.get('RESULT_CACHE_TTL', 86400)),
+)
+
+# Job progress is pushed as Server-Sent Events; each stream is closed after
+# JOB_EVENTS_MAX_SECONDS and reopened by the browser, so no connection is held forever
+JOB_EVENTS_INTERVAL = 0.5
+JOB_EVENTS_KEEPALIVE = 15
+JOB_EVENTS_MAX_SECONDS = float(os.environ.get('JOB_EVENTS_MAX_SECONDS', 60))
+JOB_EVENTS_RETRY_MS = 1000
+# Each stream holds a worker thread while it is open; streams beyond this many per
+# worker are refused (the page then polls), so the other threads keep serving requests
+JOB_EVENTS_MAX_STREAMS = int(os.environ.get('JOB_EVENTS_MAX_STREAMS', 4))
+job_event_streams = threading.BoundedSemaphore(JOB_EVENTS_MAX_STREAMS)
+
+# Large files are uploaded as resumable chunks, so MAX_CONTENT_LENGTH only caps each request
+upload_store = UploadStore(
+    PROCESSING_DIR / 'uploads',
+    chunk_size=int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)),
+    max_bytes=int(os.environ.get('UPLOAD_MAX_BYTES', 1024 * 1024 * 1024)),
+    max_age=int(os.environ.get('UPLOAD_MAX_AGE', 86400)),
+)
+# Seconds a client waits before finalizing again while an earlier finalize is assembling
+UPLOAD_FINALIZE_RETRY_AFTER = 2
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def generate_booklet_mapping(total_pages):
+def spool_upload(file):
     """
-    Generate booklet page mapping using the discovered formula
+    Copy an uploaded file to the processing directory in fixed-size chunks
 
     Args:
-        total_pages: Total number of A4 pages in the final document (must be multiple of 4)
+        file: werkzeug FileStorage from request.files
 
     Returns:
-        List of tuples: (A3_sheet_number, [left_A4_page, right_A4_page])
+        Tuple (path of the spooled PDF, SHA-256 hex digest of its bytes)
+    """
+    PROCESSING_DIR.mkdir(parents=True, exist_ok=True)
+    fd, upload_path = tempfile.mkstemp(prefix='upload_', suffix='.pdf', dir=PROCESSING_DIR)
+    digest = hashlib.sha256()
+    with os.fdopen(fd, 'wb') as spool_file:
+        for chunk in iter(lambda: file.stream.read(SPOOL_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            spool_file.write(chunk)
+    return upload_path, digest.hexdigest()
+
+def create_result_file():
+    """Open a new result file in the processing directory for writing"""
+    PROCESSING_DIR.mkdir(parents=True, exist_ok=True)
+    return tempfile.NamedTemporaryFile(prefix='result_', suffix='.pdf', dir=PROCESSING_DIR, delete=False)
+
+def remove_file(path):
+    """Delete a temporary file, ignoring files that are already gone"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def send_pdf_file(pdf_file, download_name):
     """
-    # Ensure total_pages is multiple of 4
-    if total_pages % 4 != 0:
-        padded_pages = ((total_pages + 3) // 4) * 4
-        total_pages = padded_pages
+    Stream an open PDF file as a download
 
-    S = total_pages // 2  # Number of A3 sheets
-    mapping = []
+    The file may already be unlinked or moved; the open handle keeps
+    the data readable until the response has been sent.
+    """
+    size = os.fstat(pdf_file.fileno()).st_size
+    response = send_file(
+        pdf_file,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=download_name
+    )
+    response.content_length = size
+    return response
+
+def open_cached_result(cache_key, wait=0):
+    """
+    Open a cached result for reading, or return None on a miss
 
-    for i in range(1, S + 1):  # A3 sheet numbers 1 to S
-        j = i - 1  # 0-based index
-        b = j % 2  # 0 for even positions, 1 for odd positions
+    wait is the number of seconds to wait for an identical split that
+    another request or job is computing (see ResultCache.wait).
+    """
+    cached_path = result_cache.wait(cache_key, wait) if wait else result_cache.get(cache_key)
+    if cached_path is None:
+        return None
+    try:
+        return open(cached_path, 'rb')
+    except FileNotFoundError:
+        return None  # Evicted by another worker in the meantime
 
-        # Apply the formula from Codex analysis:
-        # Left(i) = S + (2b - 1) * j + b
-        # Right(i) = T + 1 - Left(i)
-        left = S + (2 * b - 1) * j + b
-        right = total_pages + 1 - left
+def generate_booklet_mapping(total_pages):
+    """
+    Generate booklet page mapping using the discovered formula
 
-        mapping.append((i, [left, right]))
+    Args:
+        total_pages: Total number of A4 pages in the final document (must be multiple of 4)
 
-    return mapping
+    Returns:
+        List of tuples: (A3_sheet_number, [left_A4_page, right_A4_page])
+    """
+    # Padding to a multiple of 4 and the formula live in the memoized saddle-stitch plan
+    return compile_plan('saddle', total_pages).mapping()
 
-def split_pdf_simple(file_stream, vertical_mode=False, rotate_mode=False):
+def split_pdf_simple(file_stream, vertical_mode=False, rotate_mode=False, engine=DEFAULT_ENGINE,
+                     output_stream=None, progress=None, timings=None, linearize=False, compact=False,
+                     downsample=None):
     """
     Split A3 PDF pages into A4 pages (Simple Mode - Phase 1)
+
+    The result is written to output_stream (a new BytesIO if omitted),
+    which is returned rewound to the start when it is seekable.
+    progress, if given, is called as progress(a4_pages_done, a4_pages_total).
+    timings, if given, is a SplitTimings that receives the stage durations
+    (parse, split, rotate, add, write) and page/byte counts.
+    linearize writes a linearized PDF whose first page shows before the download completes;
+    compact merges identical objects and compresses the output (see a3divider.compact);
+    downsample, if given, is a dict of ImageDownsampler arguments (dpi, quality, color).
     """
-    pdf_reader = PyPDF2.PdfReader(file_stream)
-    pdf_writer = PyPDF2.PdfWriter()
-
-    # Process each page
-    for i in range(len(pdf_reader.pages)):
-        original_page = pdf_reader.pages[i]
-
-        # Get page dimensions
-        mediabox = original_page.mediabox
-        x0, y0 = float(mediabox.lower_left[0]), float(mediabox.lower_left[1])
-        x1, y1 = float(mediabox.upper_right[0]), float(mediabox.upper_right[1])
-
-        # Calculate width and height
-        width = x1 - x0
-        height = y1 - y0
-
-        # A3 landscape (wide) - split left and right
-        if width > height:
-            mid_x = x0 + width / 2
-
-            # Left half
-            left_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
-            left_page.merge_page(original_page)
-            left_page.cropbox.lower_left = (x0, y0)
-            left_page.cropbox.upper_right = (mid_x, y1)
-
-            # Right half
-            right_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
-            right_page.merge_page(original_page)
-            right_page.cropbox.lower_left = (mid_x, y0)
-            right_page.cropbox.upper_right = (x1, y1)
-
-            # Optional rotation
-            if rotate_mode:
-                left_page.rotate(90)
-                right_page.rotate(90)
-
-            # Page order
-            if vertical_mode:
-                pdf_writer.add_page(right_page)
-                pdf_writer.add_page(left_page)
-            else:
-                pdf_writer.add_page(left_page)
-                pdf_writer.add_page(right_page)
-
-        # A3 portrait (tall) - split top and bottom
-        else:
-            mid_y = y0 + height / 2
-
-            # Top half
-            top_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
-            top_page.merge_page(original_page)
-            top_page.cropbox.lower_left = (x0, mid_y)
-            top_page.cropbox.upper_right = (x1, y1)
-
-            # Bottom half
-            bottom_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
-            bottom_page.merge_page(original_page)
-            bottom_page.cropbox.lower_left = (x0, y0)
-            bottom_page.cropbox.upper_right = (x1, mid_y)
-
-            # Optional rotation
-            if rotate_mode:
-                top_page.rotate(90)
-                bottom_page.rotate(90)
-
-            pdf_writer.add_page(top_page)
-            pdf_writer.add_page(bottom_page)
-
-    # Write to bytes
-    output_stream = io.BytesIO()
-    pdf_writer.write(output_stream)
-    output_stream.seek(0)
+    # Left/right for landscape (wide), top/bottom for portrait (tall);
+    # vertical writing puts the right half first
+    splitter = Splitter(engine, geometry='auto-rtl' if vertical_mode else 'auto',
+                        rotate=90 if rotate_mode else 0)
+
+    if output_stream is None:
+        output_stream = io.BytesIO()
+    sink = StreamSink(output_stream, linearize, compact, make_downsampler(downsample))
+    splitter.split(file_stream, sink, progress, timings)
     return output_stream
 
-def split_pdf_booklet(file_stream, total_pages=None, rotate_mode=False):
+def split_pdf_booklet(file_stream, total_pages=None, rotate_mode=False, engine=DEFAULT_ENGINE,
+                      output_stream=None, progress=None, binding='saddle',
+                      signature_pages=DEFAULT_SIGNATURE_PAGES, rtl=False, timings=None,
+                      linearize=False, compact=False, downsample=None):
     """
     Split A3 PDF and reorder pages according to booklet pattern (Booklet Mode - Phase 2)
-    """
-    pdf_reader = PyPDF2.PdfReader(file_stream)
-    num_a3_pages = len(pdf_reader.pages)
-
-    # Auto-detect total pages if not specified
-    if total_pages is None:
-        total_pages = num_a3_pages * 2
-
-    # Generate mapping
-    mapping = generate_booklet_mapping(total_pages)
 
-    # Split and collect all A4 pages first
-    split_pages = {}  # {A4_page_number: PageObject}
-
-    for a3_idx in range(num_a3_pages):
-        if a3_idx >= len(mapping):
-            break
+    The result is written to output_stream (a new BytesIO if omitted),
+    which is returned rewound to the start when it is seekable.
+    progress, if given, is called as progress(a4_pages_done, a4_pages_total).
+    binding, signature_pages and rtl select the imposition plan (see a3divider.compile_plan);
+    total_pages defaults to two A4 pages per A3 page.
+    timings, if given, is a SplitTimings that receives the stage durations
+    (parse, split, rotate, add, write) and page/byte counts.
+    linearize writes a linearized PDF whose first page shows before the download completes;
+    compact merges identical objects and compresses the output (see a3divider.compact);
+    downsample, if given, is a dict of ImageDownsampler arguments (dpi, quality, color).
+    """
+    splitter = Splitter(engine, ordering=BookletOrdering(binding, total_pages, signature_pages, rtl),
+                        rotate=90 if rotate_mode else 0)
 
-        original_page = pdf_reader.pages[a3_idx]
-        a3_sheet_num, [left_a4, right_a4] = mapping[a3_idx]
+    if output_stream is None:
+        output_stream = io.BytesIO()
+    sink = StreamSink(output_stream, linearize, compact, make_downsampler(downsample))
+    splitter.split(file_stream, sink, progress, timings)
+    return output_stream
 
-        # Get page dimensions
-        mediabox = original_page.mediabox
-        x0, y0 = float(mediabox.lower_left[0]), float(mediabox.lower_left[1])
-        x1, y1 = float(mediabox.upper_right[0]), float(mediabox.upper_right[1])
+# Background jobs run in process pools so long scans do not hit the gunicorn timeout;
+# a queued job names its split function, looked up here by the worker that runs it
+job_queue = JobQueue(
+    PROCESSING_DIR / 'jobs',
+    store,
+    {split_function.__name__: split_function for split_function in (split_pdf_simple, split_pdf_booklet)},
+    cache=result_cache,
+    release=admission.release,
+    max_workers=int(os.environ.get('JOB_WORKERS', 2)),
+    max_age=int(os.environ.get('JOB_MAX_AGE', 3600)),
+    metrics=metrics,
+    aging=float(os.environ.get('JOB_AGING_SECONDS', 30)),
+    nice=int(os.environ.get('JOB_NICE', 10)),
+)
+
+def make_downsampler(downsample):
+    """Build the ImageDownsampler for the downsample option of the split functions"""
+    if downsample is None:
+        return None
+    return ImageDownsampler(**downsample)
+
+def parse_downsample_options(form):
+    """
+    Read the image downsampling options
 
-        width = x1 - x0
-        height = y1 - y0
+    Returns:
+        Dict of ImageDownsampler arguments, or None if downsampling is off
 
-        # Split based on orientation
-        if width > height:  # Landscape (wide)
-            mid_x = x0 + width / 2
+    Raises:
+        ValueError: with a message suitable for the user
+    """
+    if 'downsample' not in form:
+        return None
+    if not downsample_available():
+        raise ValueError('画像の縮小はこのサーバーでは利用できません')
+
+    try:
+        dpi = int(form.get('downsample_dpi') or DEFAULT_DPI)
+        quality = int(form.get('jpeg_quality') or DEFAULT_JPEG_QUALITY)
+    except ValueError:
+        raise ValueError('解像度とJPEG品質は数値で入力してください')
+    if not 36 <= dpi <= 1200:
+        raise ValueError('解像度は36〜1200dpiで入力してください')
+    if not 1 <= quality <= 95:
+        raise ValueError('JPEG品質は1〜95で入力してください')
+    color = form.get('image_color', 'keep')
+    if color not in COLOR_MODES:
+        raise ValueError('画像の色の指定が正しくありません')
+    return {'dpi': dpi, 'quality': quality, 'color': color}
+
+def parse_split_options(form, filename):
+    """
+    Read the processing options shared by /upload and /jobs
 
-            # Left half
-            left_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
-            left_page.merge_page(original_page)
-            left_page.cropbox.lower_left = (x0, y0)
-            left_page.cropbox.upper_right = (mid_x, y1)
+    Args:
+        form: request.form
+        filename: Name of the uploaded file
 
-            # Right half
-            right_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
-            right_page.merge_page(original_page)
-            right_page.cropbox.lower_left = (mid_x, y0)
-            right_page.cropbox.upper_right = (x1, y1)
+    Returns:
+        Tuple (split_function, options, output_filename)
 
-        else:  # Portrait (tall)
-            mid_y = y0 + height / 2
+    Raises:
+        ValueError: with a message suitable for the user
+    """
+    processing_mode = form.get('mode', 'simple')
+    vertical_mode = 'vertical' in form
+    rotate_mode = 'rotate' in form
+    engine = form.get('engine', DEFAULT_ENGINE)
+    if engine not in SPLIT_ENGINES:
+        raise ValueError('分割方式が正しくありません')
+    linearize = 'linearize' in form
+    if linearize and rewrite_backend() is None:
+        raise ValueError('Web表示用の最適化はこのサーバーでは利用できません')
+    compact = 'compact' in form
+    downsample = parse_downsample_options(form)
+
+    # Generate output filename based on mode
+    original_name = Path(filename).stem
+
+    if processing_mode == 'booklet':
+        # Phase 2: Booklet mode
+        total_pages = form.get('total_pages')
+        if total_pages:
+            try:
+                total_pages = int(total_pages)
+                if total_pages <= 0:
+                    raise ValueError("ページ数は正の数である必要があります")
+            except ValueError as e:
+                raise ValueError(f'ページ数エラー: {str(e)}')
+        else:
+            total_pages = None  # Auto-detect
 
-            # Top half (left)
-            left_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
-            left_page.merge_page(original_page)
-            left_page.cropbox.lower_left = (x0, mid_y)
-            left_page.cropbox.upper_right = (x1, y1)
+        binding = form.get('binding', 'saddle')
+        if binding not in BINDING_SCHEMES:
+            raise ValueError('製本方式が正しくありません')
 
-            # Bottom half (right)
-            right_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
-            right_page.merge_page(original_page)
-            right_page.cropbox.lower_left = (x0, y0)
-            right_page.cropbox.upper_right = (x1, mid_y)
+        signature_pages = form.get('signature_pages') or DEFAULT_SIGNATURE_PAGES
+        try:
+            signature_pages = int(signature_pages)
+            if signature_pages <= 0 or signature_pages % 4 != 0:
+                raise ValueError("折丁のページ数は4の倍数である必要があります")
+        except ValueError as e:
+            raise ValueError(f'折丁ページ数エラー: {str(e)}')
+
+        options = {
+            'total_pages': total_pages,
+            'rotate_mode': rotate_mode,
+            'engine': engine,
+            'binding': binding,
+            'signature_pages': signature_pages,
+            'rtl': 'rtl' in form,
+            'linearize': linearize,
+            'compact': compact,
+            'downsample': downsample,
+        }
+        return split_pdf_booklet, options, f"{original_name}_booklet_reordered.pdf"
+
+    # Phase 1: Simple mode (default)
+    options = {'vertical_mode': vertical_mode, 'rotate_mode': rotate_mode, 'engine': engine,
+               'linearize': linearize, 'compact': compact, 'downsample': downsample}
+    return split_pdf_simple, options, f"{original_name}_simple_split.pdf"
+
+@app.before_request
+def start_job_dispatcher():
+    """Let this worker's pool take queued jobs of all workers"""
+    job_queue.start()
+
+@app.before_request
+def start_request_timing():
+    g.timings = SplitTimings()
+    g.request_start = time.perf_counter()
+    metrics.inc('a3divider_http_requests_in_flight')
+
+@app.after_request
+def add_server_timing(response):
+    """Report the stages timed while handling the request"""
+    if 'timings' in g:
+        response.headers['Server-Timing'] = g.timings.server_timing(
+            total=time.perf_counter() - g.request_start)
+    return response
+
+@app.teardown_request
+def finish_request_timing(exc):
+    if 'request_start' not in g:
+        return
+    metrics.inc('a3divider_http_requests_in_flight', -1)
+    metrics.observe('a3divider_http_request_duration_seconds',
+                    time.perf_counter() - g.request_start, endpoint=request.endpoint or 'none')
+
+def admit_split(source, options, wait=0):
+    """
+    Size a split from a preflight of its input and take its share of the budgets
 
-        # Optional rotation
-        if rotate_mode:
-            left_page.rotate(90)
-            right_page.rotate(90)
+    Returns:
+        Tuple (lease ID for admission.release(), estimated milliseconds)
 
-        # Store pages with their A4 page numbers
-        split_pages[left_a4] = left_page
-        split_pages[right_a4] = right_page
+    Raises:
+        ValueError: if the document is refused outright
+        Overloaded: if the budgets have no room after wait seconds
+    """
+    with g.timings.stage('admission'):
+        cost_ms = admission.size(source, options)
+        return admission.admit(cost_ms, wait), cost_ms
 
-    # Create new PDF with pages in correct order (1, 2, 3, ...)
-    pdf_writer = PyPDF2.PdfWriter()
+def client_identity():
+    """
+    Identify the client a job is queued for, to share the pool fairly
 
-    for page_num in range(1, total_pages + 1):
-        if page_num in split_pages:
-            pdf_writer.add_page(split_pages[page_num])
-        else:
-            # Create blank page if missing
-            blank_page = PyPDF2.PageObject.create_blank_page(width=595, height=842)  # A4 size
-            pdf_writer.add_page(blank_page)
-
-    # Write to bytes
-    output_stream = io.BytesIO()
-    pdf_writer.write(output_stream)
-    output_stream.seek(0)
-    return output_stream
+    The web page sends a random X-Client-ID kept in the browser; other
+    clients are told apart by their address (behind the proxy, the first
+    X-Forwarded-For entry).
+    """
+    client_id = request.headers.get('X-Client-ID', '')[:64]
+    if client_id:
+        return client_id
+    return request.access_route[0] if request.access_route else request.remote_addr
+
+def overloaded_response(e):
+    """503 JSON response asking the client to retry after the hinted delay"""
+    return jsonify(error=str(e), retry_after=e.retry_after), 503, {'Retry-After': str(e.retry_after)}
+
+def render_index():
+    return render_template('index.html', linearize_available=rewrite_backend() is not None,
+                           downsample_available=downsample_available(),
+                           default_dpi=DEFAULT_DPI, default_jpeg_quality=DEFAULT_JPEG_QUALITY,
+                           upload_chunk_size=upload_store.chunk_size,
+                           upload_max_mb=upload_store.max_bytes // (1024 * 1024))
+
+def run_split(split_function, input_stream, output_stream, options):
+    """Run a split in the request, recording its timings in g.timings and /metrics"""
+    outcome = 'error'
+    try:
+        with metrics.track('a3divider_splits_in_progress', source='request'):
+            split_function(input_stream, output_stream=output_stream, timings=g.timings, **options)
+        outcome = 'success'
+    finally:
+        metrics.record_split(split_function.__name__, options['engine'], g.timings, outcome)
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_index()
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
@@ -244,42 +455,67 @@ def upload_file():
 
     if file and allowed_file(file.filename):
         try:
-            # Get processing mode
-            processing_mode = request.form.get('mode', 'simple')
-            vertical_mode = 'vertical' in request.form
-            rotate_mode = 'rotate' in request.form
-
-            # Generate output filename based on mode
-            original_name = Path(file.filename).stem
-
-            if processing_mode == 'booklet':
-                # Phase 2: Booklet mode
-                total_pages = request.form.get('total_pages')
-                if total_pages:
-                    try:
-                        total_pages = int(total_pages)
-                        if total_pages <= 0:
-                            raise ValueError("ページ数は正の数である必要があります")
-                    except ValueError as e:
-                        flash(f'ページ数エラー: {str(e)}', 'error')
-                        return redirect(url_for('index'))
-                else:
-                    total_pages = None  # Auto-detect
-
-                output_stream = split_pdf_booklet(file.stream, total_pages, rotate_mode)
-                output_filename = f"{original_name}_booklet_reordered.pdf"
-
-            else:
-                # Phase 1: Simple mode (default)
-                output_stream = split_pdf_simple(file.stream, vertical_mode, rotate_mode)
-                output_filename = f"{original_name}_simple_split.pdf"
-
-            return send_file(
-                output_stream,
-                mimetype='application/pdf',
-                as_attachment=True,
-                download_name=output_filename
-            )
+            try:
+                split_function, options, output_filename = parse_split_options(request.form, file.filename)
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(url_for('index'))
+
+            # Spool the upload to disk and write the result next to it
+            with g.timings.stage('spool'):
+                upload_path, input_hash = spool_upload(file)
+            cache_key = make_cache_key(input_hash, mode=split_function.__name__, **options)
+            with g.timings.stage('cache'):
+                cached_result = open_cached_result(cache_key)
+            if cached_result is not None:
+                remove_file(upload_path)
+                return send_pdf_file(cached_result, output_filename)
+
+            # Identical uploads are split once: wait for the split already in progress
+            owns_flight = result_cache.claim(cache_key, 'request') is None
+            if not owns_flight:
+                with g.timings.stage('cache'):
+                    cached_result = open_cached_result(cache_key, wait=admission.max_wait)
+                if cached_result is not None:
+                    remove_file(upload_path)
+                    return send_pdf_file(cached_result, output_filename)
+
+            try:
+                # Wait a little for a busy server rather than failing at once
+                try:
+                    lease, _ = admit_split(upload_path, options, wait=admission.max_wait)
+                except ValueError as e:
+                    remove_file(upload_path)
+                    flash(str(e), 'error')
+                    return redirect(url_for('index'))
+                except Overloaded as e:
+                    remove_file(upload_path)
+                    flash(str(e), 'error')
+                    return render_index(), 503, {'Retry-After': str(e.retry_after)}
+
+                result_file = None
+                try:
+                    with open(upload_path, 'rb') as input_stream, create_result_file() as result_file:
+                        run_split(split_function, input_stream, result_file, options)
+                except Exception:
+                    if result_file is not None:
+                        remove_file(result_file.name)
+                    raise
+                finally:
+                    admission.release(lease)
+                    remove_file(upload_path)
+
+                # Keep the result open while it moves into the cache
+                result_stream = open(result_file.name, 'rb')
+                try:
+                    result_cache.put(cache_key, result_file.name)
+                except OSError:
+                    remove_file(result_file.name)
+            finally:
+                if owns_flight:
+                    result_cache.release(cache_key, 'request')
+
+            return send_pdf_file(result_stream, output_filename)
 
         except Exception as e:
             flash(f'エラーが発生しました: {str(e)}', 'error')
@@ -288,6 +524,435 @@ def upload_file():
     flash('PDFファイルのみアップロード可能です', 'error')
     return redirect(url_for('index'))
 
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a split job and return its ID without waiting for the result"""
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify(error='ファイルが選択されていません'), 400
+
+    if not allowed_file(file.filename):
+        return jsonify(error='PDFファイルのみアップロード可能です'), 400
+
+    try:
+        split_function, options, output_filename = parse_split_options(request.form, file.filename)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    with g.timings.stage('spool'):
+        upload_path, input_hash = spool_upload(file)
+    return start_job(upload_path, input_hash, split_function, options, output_filename)
+
+def start_job(upload_path, input_hash, split_function, options, output_filename, admitted=None):
+    """
+    Serve a spooled upload from the cache or queue a job for it
+
+    The upload file is moved into the job or deleted. A job identical to
+    one in progress follows it (see JobQueue.follow). Other jobs that are
+    not cached are admitted first, unless admitted already holds the
+    (lease, estimated milliseconds) of admit_split(); the lease is
+    released when the job has finished.
+
+    Returns:
+        202 response with the job ID and its status, events and result URLs,
+        413 if the document is refused, or 503 if the server is busy
+    """
+    cache_key = make_cache_key(input_hash, mode=split_function.__name__, **options)
+    lease, cost_ms = admitted or (None, None)
+    try:
+        job_id = None
+        with g.timings.stage('cache'):
+            cached_path = result_cache.get(cache_key)
+        if cached_path is not None:
+            try:
+                job_id = job_queue.add_finished(cached_path, output_filename)
+            except OSError:
+                pass  # Evicted by another worker in the meantime
+        owner = result_cache.owner(cache_key)
+        if job_id is None and owner is not None and owner.startswith('job:'):
+            job_id = job_queue.follow(owner[len('job:'):], output_filename)
+        if job_id is None:
+            if lease is None:
+                try:
+                    lease, cost_ms = admit_split(upload_path, options)
+                except ValueError as e:
+                    return jsonify(error=str(e)), 413
+                except Overloaded as e:
+                    return overloaded_response(e)
+            job_id = job_queue.submit(split_function.__name__, upload_path, options, output_filename,
+                                      cache_key=cache_key, lease=lease, cost_ms=cost_ms,
+                                      client=client_identity())
+            lease = None
+    finally:
+        if lease is not None:
+            admission.release(lease)
+        remove_file(upload_path)
+
+    return jsonify(job_links(job_id)), 202
+
+def job_links(job_id):
+    """Return the ID of a job with its status, events and result URLs"""
+    return {
+        'id': job_id,
+        'status_url': url_for('job_status', job_id=job_id),
+        'events_url': url_for('job_events', job_id=job_id),
+        'result_url': url_for('job_result', job_id=job_id),
+    }
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """
+    Start a chunked upload
+
+    Takes 'filename' and 'size' (bytes). The file is then sent with
+    PUT /uploads/<id>/chunks/<n> in chunks of chunk_size bytes, in any
+    order and in parallel, and finished with POST /uploads/<id>/complete.
+    """
+    filename = request.form.get('filename', '')
+    if not allowed_file(filename):
+        return jsonify(error='PDFファイルのみアップロード可能です'), 400
+
+    try:
+        size = int(request.form.get('size', ''))
+    except ValueError:
+        return jsonify(error='ファイルサイズが正しくありません'), 400
+
+    try:
+        session = upload_store.create(filename, size)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    return jsonify(
+        id=session['id'],
+        chunk_size=session['chunk_size'],
+        total_chunks=session['total_chunks'],
+        upload_url=url_for('upload_status', upload_id=session['id']),
+        complete_url=url_for('complete_upload', upload_id=session['id']),
+    ), 201
+
+@app.route('/uploads/<upload_id>')
+def upload_status(upload_id):
+    """
+    Report which chunks of an upload have arrived, so an interrupted upload can resume
+
+    Once the upload has been finalized, 'job' holds the job started from it.
+    """
+    session = upload_store.session(upload_id)
+    if session is None:
+        return jsonify(error='アップロードが見つかりません'), 404
+
+    job_id = upload_store.job(upload_id)
+    return jsonify(
+        id=upload_id,
+        size=session['size'],
+        chunk_size=session['chunk_size'],
+        total_chunks=session['total_chunks'],
+        received=upload_store.received(upload_id),
+        upload_url=url_for('upload_status', upload_id=upload_id),
+        complete_url=url_for('complete_upload', upload_id=upload_id),
+        job=None if job_id is None else job_links(job_id),
+        finalizing=upload_store.finalizing(upload_id),
+    )
+
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    """
+    Store one chunk of an upload
+
+    The optional X-Chunk-SHA256 header holds the hex digest of the chunk;
+    a chunk that does not match it is rejected and can be sent again.
+    """
+    session = upload_store.session(upload_id)
+    if session is None:
+        return jsonify(error='アップロードが見つかりません'), 404
+
+    try:
+        with g.timings.stage('spool'):
+            upload_store.put_chunk(session, index, request.stream, request.headers.get('X-Chunk-SHA256'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    return jsonify(index=index)
+
+def finalized_response(upload_id):
+    """
+    Response to a finalize request for an upload another request has finalized, or None
+
+    Returns the job started from the upload, or while the other request is
+    still assembling it a 503 asking the client to retry.
+    """
+    job_id = upload_store.job(upload_id)
+    if job_id is not None:
+        if job_queue.status(job_id) is None:
+            return jsonify(error='ジョブが見つかりません'), 404
+        return jsonify(job_links(job_id)), 202
+    if upload_store.finalizing(upload_id):
+        return (jsonify(error='アップロードを処理中です', retry_after=UPLOAD_FINALIZE_RETRY_AFTER), 503,
+                {'Retry-After': str(UPLOAD_FINALIZE_RETRY_AFTER)})
+    return None
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """
+    Assemble a fully received upload and start its split job (same form fields as /jobs)
+
+    Finalizing an upload again (e.g. after a lost response) returns the
+    job started the first time, or 503 with retry_after while the first
+    request is still assembling the upload.
+    """
+    session = upload_store.session(upload_id)
+    if session is None:
+        return jsonify(error='アップロードが見つかりません'), 404
+
+    finalized = finalized_response(upload_id)
+    if finalized is not None:
+        return finalized
+
+    try:
+        split_function, options, output_filename = parse_split_options(request.form, session['filename'])
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    # Admit the job before assembling, so a busy server keeps the chunks for a retry
+    try:
+        upload_stream = upload_store.open(session)
+    except ValueError as e:
+        # Another finalize may have deleted the chunks since the check above
+        return finalized_response(upload_id) or (jsonify(error=str(e)), 409)
+    try:
+        with upload_stream:
+            lease, cost_ms = admit_split(upload_stream, options)
+    except ValueError as e:
+        return jsonify(error=str(e)), 413
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    try:
+        with g.timings.stage('assemble'):
+            upload_path, input_hash = upload_store.assemble(session, PROCESSING_DIR)
+    except ValueError as e:
+        admission.release(lease)
+        return finalized_response(upload_id) or (jsonify(error=str(e)), 409)
+    except Exception:
+        admission.release(lease)
+        raise
+
+    try:
+        response, status_code = start_job(upload_path, input_hash, split_function, options, output_filename,
+                                          (lease, cost_ms))
+    except Exception:
+        upload_store.discard(session)  # The chunks are gone; the client has to upload again
+        raise
+    if status_code == 202:
+        upload_store.finish(session, response.get_json()['id'])
+    else:
+        upload_store.discard(session)
+    return response, status_code
+
+@app.route('/cache/lookup', methods=['POST'])
+def cache_lookup():
+    """
+    Check whether a result exists for a file the browser has already hashed
+
+    Takes the same form fields as /jobs, with 'hash' (SHA-256 hex digest
+    of the PDF) and 'filename' instead of the file itself. On a hit the
+    cached result is registered as a finished job, so the browser can
+    download it without uploading the file.
+    """
+    input_hash = request.form.get('hash', '').lower()
+    filename = request.form.get('filename', '')
+    if not SHA256_PATTERN.fullmatch(input_hash) or not allowed_file(filename):
+        return jsonify(error='ハッシュまたはファイル名が正しくありません'), 400
+
+    try:
+        split_function, options, output_filename = parse_split_options(request.form, filename)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    cache_key = make_cache_key(input_hash, mode=split_function.__name__, **options)
+    cached_path = result_cache.get(cache_key)
+    if cached_path is None:
+        return jsonify(cached=False)
+
+    try:
+        job_id = job_queue.add_finished(cached_path, output_filename)
+    except OSError:
+        return jsonify(cached=False)  # Evicted by another worker in the meantime
+
+    return jsonify(cached=True, **job_links(job_id))
+
+@app.route('/preflight', methods=['POST'])
+def preflight_upload():
+    """
+    Describe an uploaded PDF without splitting it
+
+    Returns the sheet count, page sizes and orientations, encryption
+    status, image resolution and estimated split time per engine (see
+    a3divider.preflight). Only the cross-reference table and page tree
+    are parsed, so this is cheap even for large scans.
+    """
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify(error='ファイルが選択されていません'), 400
+
+    if not allowed_file(file.filename):
+        return jsonify(error='PDFファイルのみアップロード可能です'), 400
+
+    try:
+        with g.timings.stage('preflight'):
+            result = preflight_pdf(file.stream, request.form.get('password'))
+    except Exception as e:
+        return jsonify(error=f'PDFを読み込めませんでした: {str(e)}'), 400
+    return jsonify(result)
+
+def describe_job(job_id, status):
+    """
+    Public view of a job status, with the time left and its throughput
+
+    Returns:
+        Dict with id, state, stage ('split' or 'write' while running), sheets,
+        pages_done, pages_total, bytes_in, bytes_out, elapsed and eta
+        (seconds, None if unknown), pages_per_second, bytes_per_second and error
+    """
+    now = time.time()
+    elapsed = None
+    if status['started'] is not None:
+        elapsed = (status['finished'] or now) - status['started']
+    eta = None
+    if status['state'] == 'running' and status['eta_at'] is not None:
+        eta = round(max(0.0, status['eta_at'] - now), 1)
+
+    # Throughput of the split itself once finished, of the job so far while running
+    split_seconds = sum(status['timings'].get('stages', {}).values()) or elapsed
+    pages_per_second = bytes_per_second = None
+    if split_seconds and status['pages_done']:
+        pages_per_second = round(status['pages_done'] / split_seconds, 2)
+    if split_seconds and status['bytes_out']:
+        bytes_per_second = round(status['bytes_out'] / split_seconds)
+
+    return {
+        'id': job_id,
+        'state': status['state'],
+        'stage': status['stage'],
+        'sheets': status['sheets'],
+        'pages_done': status['pages_done'],
+        'pages_total': status['pages_total'],
+        'bytes_in': status['bytes_in'],
+        'bytes_out': status['bytes_out'],
+        'elapsed': None if elapsed is None else round(elapsed, 1),
+        'eta': eta,
+        'pages_per_second': pages_per_second,
+        'bytes_per_second': bytes_per_second,
+        'error': status.get('error'),
+    }
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report the state of a job, its progress and its throughput"""
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify(error='ジョブが見つかりません'), 404
+
+    return jsonify(describe_job(job_id, status))
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Stream the progress of a job as Server-Sent Events
+
+    A 'progress' event with the job status (see describe_job) is sent
+    whenever it changes, and a final 'done' (with the result URL) or
+    'failed' event ends the stream. Streams of running jobs end after
+    JOB_EVENTS_MAX_SECONDS; EventSource then reconnects and receives the
+    current status first. While JOB_EVENTS_MAX_STREAMS streams are open in
+    this worker, 503 tells the client to poll the job status instead.
+    """
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify(error='ジョブが見つかりません'), 404
+    if not job_event_streams.acquire(blocking=False):
+        retry_after = max(1, JOB_EVENTS_RETRY_MS // 1000)
+        return (jsonify(error='進捗の配信が混雑しています', retry_after=retry_after), 503,
+                {'Retry-After': str(retry_after)})
+    result_url = url_for('job_result', job_id=job_id)
+
+    def events(status):
+        yield f'retry: {JOB_EVENTS_RETRY_MS}\n\n'
+        deadline = time.monotonic() + JOB_EVENTS_MAX_SECONDS
+        last_progress = None
+        last_sent = time.monotonic()
+        while True:
+            if status is None:
+                yield f'event: failed\ndata: {json.dumps({"error": "ジョブが見つかりません"})}\n\n'
+                return
+            described = describe_job(job_id, status)
+            if status['state'] == 'done':
+                described['result_url'] = result_url
+                yield f'event: done\ndata: {json.dumps(described)}\n\n'
+                return
+            if status['state'] == 'failed':
+                yield f'event: failed\ndata: {json.dumps(described)}\n\n'
+                return
+
+            # The ETA and elapsed time change on every read; only send new progress
+            progress = (described['state'], described['stage'], described['pages_done'],
+                        described['bytes_out'])
+            now = time.monotonic()
+            if progress != last_progress:
+                last_progress, last_sent = progress, now
+                yield f'event: progress\ndata: {json.dumps(described)}\n\n'
+            elif now - last_sent >= JOB_EVENTS_KEEPALIVE:
+                # Comments keep proxies from closing an idle stream and reveal closed clients
+                last_sent = now
+                yield ': keep-alive\n\n'
+            if now >= deadline:
+                return
+            time.sleep(JOB_EVENTS_INTERVAL)
+            status = job_queue.status(job_id)
+
+    response = Response(events(status), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Called when the server closes the stream, also if it was never iterated
+    response.call_on_close(job_event_streams.release)
+    return response
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """
+    Stream the output PDF of a finished job
+
+    The ETag is the SHA-256 of the result, so browsers can revalidate with
+    If-None-Match and resume interrupted downloads with Range/If-Range.
+    """
+    status = job_queue.status(job_id)
+    result_path = job_queue.result_path(job_id)
+    digest = job_queue.result_digest(job_id)
+    if status is None or result_path is None or digest is None:
+        return jsonify(error='結果がまだありません'), 404
+
+    # Stages of the job itself, reported alongside those of this request
+    for stage, seconds in status.get('timings', {}).get('stages', {}).items():
+        g.timings.stages[f'job-{stage}'] = seconds
+
+    return send_file(
+        result_path,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=status['download_name'],
+        conditional=True,
+        etag=digest,
+    )
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Report result cache hit/miss counters of all workers and the cache size"""
+    return jsonify(result_cache.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Split timings, page/byte totals and concurrency of all workers in the Prometheus text format"""
+    return metrics.render(gauges={'a3divider_jobs_queued': job_queue.queued_count()}), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_ENV') != 'production'
@@ -1,19 +1,85 @@
 #!/usr/bin/env python3
 """
 Create a test A3 PDF file for testing the splitter
+
+Generating documents needs reportlab (and Pillow for image documents),
+which the splitter itself does not; they are imported when a document is
+generated, so CONTENT_KINDS and the helpers can be imported without them.
 """
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A3
-from reportlab.lib import colors
-from reportlab.lib.units import cm
+import io
+
+# Kinds of synthetic content create_test_a3_pdf can generate
+CONTENT_KINDS = ('vector', 'image')
+
+# Lines of filler text per half in vector documents
+FILLER_LINES = 40
+
+def _draw_filler_text(c, x, top, page_num):
+    """Draw a column of small text lines, like a typeset page"""
+    from reportlab.lib import colors
+
+    c.setFillColor(colors.black)
+    c.setFont("Helvetica", 9)
+    for line in range(FILLER_LINES):
+        c.drawString(x, top - line * 12,
+                     f"Page {page_num} line {line + 1}: The quick brown fox jumps over the lazy dog.")
+
+def _scan_image(width, height, page_num, dpi):
+    """
+    Render a fake scan of one A3 page as a JPEG image
+
+    Each page gets its own noise and labels, so images are not deduplicated
+    and compress like real scans.
+    """
+    from PIL import Image, ImageDraw
+    from reportlab.lib.utils import ImageReader
+
+    size = (int(width / 72 * dpi), int(height / 72 * dpi))
+    # Low-frequency paper texture: noise at 1/4 resolution, scaled up
+    noise = Image.effect_noise((size[0] // 4, size[1] // 4), 24).point(lambda v: 210 + v // 6)
+    paper = noise.resize(size)
+    image = Image.merge('RGB', (paper, paper, paper))
+
+    draw = ImageDraw.Draw(image)
+    for left in (size[0] // 16, size[0] * 9 // 16):
+        draw.text((left, size[1] // 8), f"A3 Page {page_num}", fill=(20, 20, 120))
+        for line in range(FILLER_LINES):
+            top = size[1] // 6 + line * size[1] // 60
+            draw.rectangle((left, top, left + size[0] * 3 // 8, top + size[1] // 200), fill=(40, 40, 40))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=75)
+    buffer.seek(0)
+    return ImageReader(buffer)
+
+def create_test_a3_pdf(filename="test_a3.pdf", num_pages=3, kind='vector', dpi=100):
+    """
+    Create a test A3 PDF with numbered pages
+
+    Args:
+        filename: Output path
+        num_pages: Number of A3 pages (sheets)
+        kind: 'vector' for text and line art, 'image' for one full-page
+            JPEG per sheet, like a scanned document
+        dpi: Resolution of the scan images (image documents only)
+
+    Returns:
+        filename
+    """
+    if kind not in CONTENT_KINDS:
+        raise ValueError(f"Unknown content kind: {kind}")
+
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A3
+    from reportlab.pdfgen import canvas
 
-def create_test_a3_pdf(filename="test_a3.pdf"):
-    """Create a test A3 PDF with numbered pages"""
     c = canvas.Canvas(filename, pagesize=A3)
     width, height = A3
 
-    # Create 3 A3 pages for testing
-    for page_num in range(1, 4):
+    for page_num in range(1, num_pages + 1):
+        if kind == 'image':
+            c.drawImage(_scan_image(width, height, page_num, dpi), 0, 0, width, height)
+
         # Draw page border
         c.setStrokeColor(colors.black)
         c.setLineWidth(2)
@@ -55,10 +121,14 @@ def create_test_a3_pdf(filename="test_a3.pdf"):
         # Bottom right
         c.drawString(width - 40, 20, "BR")
 
+        if kind == 'vector':
+            _draw_filler_text(c, 30, height / 2 - 100, page_num)
+            _draw_filler_text(c, width / 2 + 20, height / 2 - 100, page_num)
+
         c.showPage()
 
     c.save()
-    print(f"Created test A3 PDF: {filename}")
+    print(f"Created test A3 PDF: {filename} ({num_pages} {kind} pages)")
     return filename
 
 if __name__ == "__main__":
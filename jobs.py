@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Background split jobs for the web application
+
+Job records live in the jobs table of the shared store (see store.py);
+the files of each job live in its own directory under the job root:
+
+    <job_id>/input.pdf    spooled upload
+    <job_id>/result.pdf   finished output
+
+Because records and files are shared, any gunicorn worker can report on
+or serve any job, and any worker with a free pool process picks up the
+next queued job, whichever worker accepted it. A finished result never
+changes, so its SHA-256 (kept in the record) serves as the ETag for
+conditional and range requests. While a job runs, its record holds the
+progress events of the split (stage, pages, bytes and the expected
+finish time, see a3divider.progress), at most one write per
+PROGRESS_INTERVAL.
+
+Jobs are not started in arrival order. Whenever a pool process is free,
+its worker claims the queued job
+
+    1. from the client with the fewest jobs running, so one client's
+       batch cannot take every pool process
+    2. with the smallest estimated cost, halved for every aging seconds
+       it has waited, so large jobs are still served under load
+
+Identical jobs (same cache key) submitted while one is queued or running
+are recorded as followers of it and share its result (single-flight).
+Jobs claimed by a worker that has exited are queued again.
+
+A queued job's task is plain JSON (the split function's name, its
+options and the admission lease); the worker that claims it looks the
+function up in its split_functions and adds the result cache, so no
+code or objects are loaded from the shared store.
+
+The pool processes run at a lower CPU priority (nice), so splits done
+directly in requests keep their latency while jobs run.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+
+from a3divider import SplitProgress, SplitTimings
+from store import pid_alive
+
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+STATE_QUEUED = 'queued'
+STATE_RUNNING = 'running'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+# Minimum seconds between progress writes from a running job
+PROGRESS_INTERVAL = 0.5
+
+# Seconds between looks for jobs queued by other workers
+DISPATCH_INTERVAL = 0.5
+
+DIGEST_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# Fields of a follower's status taken from the job it follows
+LEADER_FIELDS = ('state', 'stage', 'sheets', 'pages_done', 'pages_total', 'bytes_in', 'bytes_out', 'eta_at',
+                 'error', 'sha256', 'timings', 'started', 'finished')
+
+def _update(store, job_id, **fields):
+    """Set fields of a job record"""
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    store.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+def _file_digest(path):
+    """SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as result_file:
+        for chunk in iter(lambda: result_file.read(DIGEST_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def run_job(store, job_id, job_dir, split_function, options, cost_ms=0, cache=None, cache_key=None,
+            metrics=None):
+    """
+    Run one split job inside a pool process
+
+    Args:
+        store: Store holding the job record
+        job_id: ID of the job
+        job_dir: Job directory path (str)
+        split_function: split_pdf_simple or split_pdf_booklet
+        options: Keyword arguments for split_function
+        cost_ms: Estimated split time, the ETA until throughput is measured
+        cache: Optional ResultCache the result is stored in
+        cache_key: Key of the result in cache
+        metrics: Optional Metrics registry the split is recorded in
+    """
+    job_dir = Path(job_dir)
+    _update(store, job_id, state=STATE_RUNNING, started=time.time())
+
+    def report(event):
+        eta_at = None if event['eta'] is None else time.time() + event['eta']
+        _update(store, job_id, stage=event['stage'], sheets=event['sheets'], pages_done=event['pages_done'],
+                pages_total=event['pages_total'], bytes_in=event['bytes_in'], bytes_out=event['bytes_out'],
+                eta_at=eta_at)
+
+    partial_path = job_dir / 'result.pdf.part'
+    timings = SplitTimings()
+    progress = SplitProgress(timings, report, PROGRESS_INTERVAL, estimate_ms=cost_ms or None)
+    result = {'state': STATE_FAILED}
+    in_progress = (metrics.track('a3divider_splits_in_progress', source='job')
+                   if metrics is not None else nullcontext())
+    try:
+        with open(job_dir / 'input.pdf', 'rb') as input_stream, open(partial_path, 'wb') as output_stream, \
+                in_progress:
+            split_function(input_stream, output_stream=output_stream, progress=progress,
+                           timings=timings, **options)
+        os.replace(partial_path, job_dir / 'result.pdf')
+        result.update(state=STATE_DONE, sha256=_file_digest(job_dir / 'result.pdf'))
+
+        if cache is not None:
+            try:
+                cache.put(cache_key, job_dir / 'result.pdf', link=True)
+            except OSError:
+                pass  # A failed cache write must not fail the job
+    except Exception as e:
+        result.update(error=str(e))
+    finally:
+        _update(store, job_id, finished=time.time(), timings=json.dumps(timings.as_dict()), stage=None,
+                eta_at=None, bytes_out=timings.bytes_out, **result)
+        if cache is not None:
+            cache.release(cache_key, f'job:{job_id}')
+        if metrics is not None:
+            outcome = 'success' if result['state'] == STATE_DONE else 'error'
+            metrics.record_split(split_function.__name__, options['engine'], timings, outcome)
+            # The pool process may sit idle or be shut down before its next flush
+            metrics.flush()
+        try:
+            os.remove(job_dir / 'input.pdf')
+        except FileNotFoundError:
+            pass
+
+class JobQueue:
+    """
+    Run split jobs in local process pools, outside the request workers
+    """
+
+    def __init__(self, root, store, split_functions, cache=None, release=None, max_workers=2, max_age=3600,
+                 metrics=None, aging=30, nice=10):
+        """
+        Args:
+            root: Directory holding one subdirectory per job
+            store: Store holding the job records
+            split_functions: Split functions jobs may run, by name
+            cache: Optional ResultCache the results of jobs with a cache key are stored in
+            release: Optional callable release(lease) run once a job with an
+                admission lease has finished or failed, in the worker that ran it
+            max_workers: Number of pool processes per web worker
+            max_age: Seconds after which finished jobs are deleted
+            metrics: Optional Metrics registry the pool processes record splits in
+            aging: Seconds of waiting that halve the cost a queued job is ranked by
+            nice: Niceness added to the pool processes (0 to keep the web worker's)
+        """
+        self.root = Path(root)
+        self.store = store
+        self.split_functions = split_functions
+        self.cache = cache
+        self.release = release
+        self.max_workers = max_workers
+        self.max_age = max_age
+        self.metrics = metrics
+        self.aging = aging
+        self.nice = nice
+        self._executor = None
+        self._lock = threading.Lock()
+        self._dispatcher_pid = None
+        self._wakeup = None
+        self._in_pool = 0  # Jobs this process has handed to its pool
+
+    def start(self):
+        """Start handing queued jobs to this process's pool (once per process)"""
+        with self._lock:
+            if self._dispatcher_pid == os.getpid():
+                return
+            # Created after fork, so each gunicorn worker dispatches to its own pool
+            self._dispatcher_pid = os.getpid()
+            self._executor = None
+            self._in_pool = 0
+            self._wakeup = threading.Event()
+        threading.Thread(target=self._dispatch_loop, daemon=True).start()
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 initializer=os.nice, initargs=(self.nice,))
+        return self._executor
+
+    def _dispatch_loop(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                self._dispatch()
+            except Exception:
+                pass  # E.g. the database stayed locked; try again on the next round
+            self._wakeup.wait(DISPATCH_INTERVAL)
+
+    def _rank(self, job, running, now):
+        """Sort key of a queued job: fewest running jobs of its client, then aged cost"""
+        aged_cost = job['cost_ms'] * 0.5 ** ((now - job['queued']) / self.aging)
+        return (running.get(job['client'], 0), aged_cost, job['queued'])
+
+    def _claim(self):
+        """
+        Take the next queued job of any worker for this process's pool
+
+        Returns:
+            Job record, or None if no job is waiting
+        """
+        with self.store.transaction() as connection:
+            # Jobs of workers that have exited are queued again
+            for row in connection.execute('SELECT DISTINCT worker FROM jobs WHERE worker IS NOT NULL '
+                                          'AND state IN (?, ?)', (STATE_QUEUED, STATE_RUNNING)).fetchall():
+                if not pid_alive(row['worker']):
+                    connection.execute('UPDATE jobs SET worker = NULL, state = ?, started = NULL, stage = NULL, '
+                                       'eta_at = NULL WHERE worker = ? AND state IN (?, ?)',
+                                       (STATE_QUEUED, row['worker'], STATE_QUEUED, STATE_RUNNING))
+
+            queued = connection.execute('SELECT id, task, cache_key, cost_ms, client, queued FROM jobs '
+                                        'WHERE state = ? AND worker IS NULL AND leader IS NULL',
+                                        (STATE_QUEUED,)).fetchall()
+            if not queued:
+                return None
+            running = dict(connection.execute('SELECT client, COUNT(*) FROM jobs WHERE worker IS NOT NULL '
+                                              'AND state IN (?, ?) GROUP BY client',
+                                              (STATE_QUEUED, STATE_RUNNING)).fetchall())
+            now = time.time()
+            job = min(queued, key=lambda job: self._rank(job, running, now))
+            connection.execute('UPDATE jobs SET worker = ? WHERE id = ?', (os.getpid(), job['id']))
+        return job
+
+    def _dispatch(self):
+        """Hand queued jobs to the pool while it has free processes"""
+        while True:
+            with self._lock:
+                if self._in_pool >= self.max_workers:
+                    return
+            job = self._claim()
+            if job is None:
+                return
+            with self._lock:
+                self._in_pool += 1
+
+            if self.metrics is not None:
+                self.metrics.observe('a3divider_job_queue_wait_seconds', time.time() - job['queued'])
+            lease = None
+            try:
+                task = json.loads(job['task'])
+                lease = task['lease']
+                split_function = self.split_functions[task['split_function']]
+                cache = self.cache if job['cache_key'] is not None else None
+            except (TypeError, ValueError, KeyError):
+                _update(self.store, job['id'], state=STATE_FAILED, error='ジョブの内容を読み取れません',
+                        finished=time.time())
+                self._finished(job['id'], lease, None)
+                continue
+            try:
+                future = self._pool().submit(run_job, self.store, job['id'], str(self.root / job['id']),
+                                             split_function, task['options'], job['cost_ms'], cache,
+                                             job['cache_key'], self.metrics)
+            except Exception as e:
+                # The pool is broken (a process was killed); the next job gets a new one
+                self._executor = None
+                _update(self.store, job['id'], state=STATE_FAILED, error=str(e), finished=time.time())
+                self._finished(job['id'], lease, None)
+                continue
+            future.add_done_callback(partial(self._finished, job['id'], lease))
+
+    def _finished(self, job_id, lease, future):
+        with self._lock:
+            self._in_pool -= 1
+        if lease is not None and self.release is not None:
+            self.release(lease)
+        self._wakeup.set()
+
+    def job_dir(self, job_id):
+        """Return the directory of a job, or None for malformed IDs"""
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        return self.root / job_id
+
+    def _create_job(self):
+        self.cleanup()
+
+        job_id = uuid.uuid4().hex
+        job_dir = self.root / job_id
+        job_dir.mkdir(parents=True)
+        return job_id, job_dir
+
+    def _insert(self, job_id, download_name, **fields):
+        # The caller's fields override the defaults (e.g. state for add_finished)
+        fields = {'id': job_id, 'state': STATE_QUEUED, 'download_name': download_name, 'created': time.time(),
+                  **fields}
+        self.store.execute(f'INSERT INTO jobs ({", ".join(fields)}) VALUES ({", ".join("?" * len(fields))})',
+                           tuple(fields.values()))
+
+    def follow(self, leader_id, download_name):
+        """
+        Register a job that shares the result of a queued or running job
+
+        Args:
+            leader_id: ID of the job computing the result
+            download_name: File name offered when the result is downloaded
+
+        Returns:
+            Job ID, or None if the leader no longer exists or has failed
+        """
+        leader = self.store.execute('SELECT state, leader FROM jobs WHERE id = ?', (leader_id,)).fetchone()
+        if leader is None or leader['state'] == STATE_FAILED or leader['leader'] is not None:
+            return None
+
+        # Followers have no files of their own
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        self._insert(job_id, download_name, leader=leader_id)
+        return job_id
+
+    def submit(self, split_function, input_path, options, download_name, cache_key=None, lease=None,
+               cost_ms=0, client=None):
+        """
+        Queue a split job
+
+        If an identical job (same cache_key) is queued or running already,
+        the new job follows it instead and the lease is released right away.
+
+        Args:
+            split_function: Name of one of the split_functions
+            input_path: Spooled upload, moved into the job directory
+            options: Keyword arguments for split_function (JSON-serializable)
+            download_name: File name offered when the result is downloaded
+            cache_key: Optional key the result is stored under in the cache
+            lease: Optional admission lease passed to release once the job
+                has finished or failed
+            cost_ms: Estimated split time the job is scheduled by
+            client: Identity of the submitting client, for fair sharing
+
+        Returns:
+            Job ID
+        """
+        if split_function not in self.split_functions:
+            raise ValueError(f'Unknown split function: {split_function}')
+        task = json.dumps({'split_function': split_function, 'options': options, 'lease': lease})
+        cache = self.cache if cache_key is not None else None
+
+        job_id, job_dir = self._create_job()
+        if cache is not None:
+            owner = cache.claim(cache_key, f'job:{job_id}')
+            if owner is not None and owner.startswith('job:'):
+                follower_id = self.follow(owner[len('job:'):], download_name)
+                if follower_id is not None:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+                    os.remove(input_path)
+                    if lease is not None and self.release is not None:
+                        self.release(lease)
+                    return follower_id
+
+        try:
+            shutil.move(input_path, job_dir / 'input.pdf')
+            self._insert(job_id, download_name, task=task, cache_key=cache_key,
+                         cost_ms=cost_ms, client=client, pages_done=0, queued=time.time())
+        except Exception:
+            # No record refers to the directory, so cleanup would never delete it
+            shutil.rmtree(job_dir, ignore_errors=True)
+            if cache is not None:
+                cache.release(cache_key, f'job:{job_id}')
+            raise
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def add_finished(self, result_path, download_name):
+        """
+        Register an already available result (e.g. a cache hit) as a finished job
+
+        Args:
+            result_path: PDF to serve, hard-linked into the job directory
+            download_name: File name offered when the result is downloaded
+
+        Returns:
+            Job ID
+
+        Raises:
+            OSError: if result_path can no longer be read
+        """
+        job_id, job_dir = self._create_job()
+        try:
+            try:
+                os.link(result_path, job_dir / 'result.pdf')
+            except FileNotFoundError:
+                raise
+            except OSError:
+                shutil.copyfile(result_path, job_dir / 'result.pdf')
+            self._insert(job_id, download_name, state=STATE_DONE, cached=1, finished=time.time())
+        except Exception:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+        return job_id
+
+    def status(self, job_id):
+        """Return the status dict of a job, or None if it does not exist"""
+        if self.job_dir(job_id) is None:
+            return None
+        connection = self.store.connect()
+        row = connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        status = {name: row[name] for name in row.keys() if name not in ('task', 'worker')}
+        status['cached'] = bool(status['cached'])
+        if row['leader'] is not None:
+            leader = connection.execute('SELECT * FROM jobs WHERE id = ?', (row['leader'],)).fetchone()
+            if leader is None:
+                return None
+            status.update((name, leader[name]) for name in LEADER_FIELDS)
+        status['timings'] = json.loads(status['timings']) if status['timings'] else {}
+        return status
+
+    def result_path(self, job_id):
+        """Return the result path of a finished job, or None"""
+        status = self.status(job_id)
+        if status is None or status['state'] != STATE_DONE:
+            return None
+        return self.root / (status['leader'] or job_id) / 'result.pdf'
+
+    def result_digest(self, job_id):
+        """
+        Return the SHA-256 of a finished job's result, or None
+
+        Results registered by add_finished are hashed on the first call
+        and the digest is kept in the job record.
+        """
+        status = self.status(job_id)
+        if status is None or status['state'] != STATE_DONE:
+            return None
+        if status['sha256'] is None:
+            try:
+                status['sha256'] = _file_digest(self.result_path(job_id))
+            except FileNotFoundError:
+                return None  # Deleted by cleanup in the meantime
+            _update(self.store, status['leader'] or job_id, sha256=status['sha256'])
+        return status['sha256']
+
+    def queued_count(self):
+        """Number of jobs of all workers waiting for a pool process"""
+        return self.store.execute('SELECT COUNT(*) FROM jobs WHERE state = ? AND worker IS NULL '
+                                  'AND leader IS NULL', (STATE_QUEUED,)).fetchone()[0]
+
+    def cleanup(self):
+        """Delete finished jobs older than max_age, with the jobs following them"""
+        cutoff = time.time() - self.max_age
+        with self.store.transaction() as connection:
+            expired = [row['id'] for row in connection.execute(
+                'SELECT id FROM jobs WHERE state IN (?, ?) AND finished < ?',
+                (STATE_DONE, STATE_FAILED, cutoff)).fetchall()]
+            connection.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in expired])
+            connection.execute('DELETE FROM jobs WHERE leader IS NOT NULL '
+                               'AND leader NOT IN (SELECT id FROM jobs)')
+        for job_id in expired:
+            shutil.rmtree(self.root / job_id, ignore_errors=True)
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Split timings and Prometheus metrics
+
+The SplitTimings of each split (see a3divider.timings) are accumulated
+per process. Splits run both in the gunicorn workers and in their job
+pool processes, so every process keeps a snapshot of its own counters in
+the metric_snapshots table of the shared store (see store.py) and
+/metrics sums the snapshots of all processes. A process writes its
+snapshot at most every SNAPSHOT_INTERVAL seconds (and on flush()), not on
+every update. Gauges are only summed over live processes; the counters of
+processes that have exited are folded into one EXITED_PROCESS row, so the
+table does not grow with worker restarts.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from a3divider.timings import SPLIT_STAGES
+from store import pid_alive
+
+# Seconds between snapshot writes of a process with changed counters
+SNAPSHOT_INTERVAL = 1.0
+
+# Snapshot row holding the counters of all processes that have exited
+EXITED_PROCESS = 'exited'
+
+# Upper bounds (seconds) of the duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+METRICS = {
+    'a3divider_splits_total': ('counter', 'Split calls by function, engine and outcome'),
+    'a3divider_split_duration_seconds': ('histogram', 'Time spent in split calls'),
+    'a3divider_split_stage_seconds': ('histogram', 'Time spent per split stage and call'),
+    'a3divider_input_pages_total': ('counter', 'A3 pages read'),
+    'a3divider_output_pages_total': ('counter', 'A4 pages written'),
+    'a3divider_input_bytes_total': ('counter', 'Bytes of input PDFs split'),
+    'a3divider_output_bytes_total': ('counter', 'Bytes of output PDFs written'),
+    'a3divider_splits_in_progress': ('gauge', 'Split calls currently running'),
+    'a3divider_http_requests_in_flight': ('gauge', 'HTTP requests currently being handled'),
+    'a3divider_http_request_duration_seconds': ('histogram', 'HTTP request handling time by endpoint'),
+    'a3divider_jobs_queued': ('gauge', 'Jobs waiting for a pool process'),
+    'a3divider_job_queue_wait_seconds': ('histogram', 'Time jobs waited for a pool process'),
+    'a3divider_admission_total': ('counter', 'Admission decisions by outcome (admitted, waited, rejected, refused)'),
+    'a3divider_admission_wait_seconds': ('histogram', 'Time admitted splits waited for budget'),
+    'a3divider_admitted_cost_milliseconds': ('gauge', 'Estimated cost of admitted splits not yet finished'),
+    'a3divider_processes': ('gauge', 'Live processes reporting metrics'),
+}
+
+def _label_text(labels):
+    return ','.join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+
+class _ProcessState:
+    """Counters of the current process and the snapshot row they are saved to"""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.process = f'{self.pid}-{uuid.uuid4().hex[:8]}'
+        self.values = {}      # {name: {label_text: value}} for counters and gauges
+        self.histograms = {}  # {name: {label_text: [bucket counts..., sum, count]}}
+        # Request threads of a gunicorn worker update the same state
+        self.lock = threading.Lock()
+        self.dirty = False  # Changed since the snapshot was last written
+
+# {database path: _ProcessState}; replaced in forked children, which start from zero
+_process_states = {}
+_process_states_lock = threading.Lock()
+
+def _reset_lock():
+    # Another thread may have held the lock when the process forked
+    global _process_states_lock
+    _process_states_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_lock)
+
+class Metrics:
+    """
+    Process- and thread-safe registry of the METRICS above
+
+    Instances only hold the store, so they can be passed to pool
+    processes; the counters themselves are per process.
+    """
+
+    def __init__(self, store, buckets=DURATION_BUCKETS):
+        """
+        Args:
+            store: Store holding one snapshot row per process
+            buckets: Upper bounds of the duration histograms
+        """
+        self.store = store
+        self.buckets = tuple(buckets)
+
+    def _state(self):
+        with _process_states_lock:
+            state = _process_states.get(self.store.path)
+            if state is None or state.pid != os.getpid():
+                state = _process_states[self.store.path] = _ProcessState()
+                threading.Thread(target=self._flush_loop, args=(state,), daemon=True).start()
+                atexit.register(self._flush, state)
+            return state
+
+    @contextmanager
+    def _updating(self):
+        """Hold this process's state while it is changed; it is saved by the flush loop"""
+        state = self._state()
+        with state.lock:
+            yield state
+            state.dirty = True
+
+    def _flush_loop(self, state):
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            try:
+                self._flush(state)
+            except Exception:
+                pass  # E.g. the database stayed locked; the state stays dirty for the next round
+
+    def _flush(self, state):
+        with state.lock:
+            # Forked children inherit the parent's state (and its atexit hook) but not its row
+            if not state.dirty or state.pid != os.getpid():
+                return
+            self.store.execute('INSERT OR REPLACE INTO metric_snapshots (process, pid, data) VALUES (?, ?, ?)',
+                               (state.process, state.pid,
+                                json.dumps({'values': state.values, 'histograms': state.histograms})))
+            state.dirty = False
+
+    def flush(self):
+        """Write this process's snapshot now (e.g. before a pool process goes idle)"""
+        self._flush(self._state())
+
+    def _inc(self, state, name, amount, labels):
+        series = state.values.setdefault(name, {})
+        key = _label_text(labels)
+        series[key] = series.get(key, 0) + amount
+
+    def _observe(self, state, name, value, labels):
+        series = state.histograms.setdefault(name, {})
+        key = _label_text(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram[i] += 1
+                break
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter or gauge"""
+        with self._updating() as state:
+            self._inc(state, name, amount, labels)
+
+    def observe(self, name, value, **labels):
+        """Record one histogram observation"""
+        with self._updating() as state:
+            self._observe(state, name, value, labels)
+
+    @contextmanager
+    def track(self, name, **labels):
+        """Raise a gauge by one while the enclosed block runs"""
+        self.inc(name, 1, **labels)
+        try:
+            yield
+        finally:
+            self.inc(name, -1, **labels)
+
+    def record_split(self, function, engine, timings, outcome='success'):
+        """
+        Record a finished split call
+
+        Args:
+            function: Name of the split function (split_pdf_simple, ...)
+            engine: Split engine name
+            timings: SplitTimings filled in by the split function
+            outcome: 'success' or 'error'
+        """
+        with self._updating() as state:
+            self._inc(state, 'a3divider_splits_total', 1,
+                      {'function': function, 'engine': engine, 'outcome': outcome})
+            self._observe(state, 'a3divider_split_duration_seconds', timings.split_seconds(),
+                          {'function': function, 'engine': engine})
+            for stage in SPLIT_STAGES:
+                if stage in timings.stages:
+                    self._observe(state, 'a3divider_split_stage_seconds', timings.stages[stage],
+                                  {'function': function, 'stage': stage})
+            for name, amount in (('a3divider_input_pages_total', timings.pages_in),
+                                 ('a3divider_output_pages_total', timings.pages_out),
+                                 ('a3divider_input_bytes_total', timings.bytes_in),
+                                 ('a3divider_output_bytes_total', timings.bytes_out)):
+                self._inc(state, name, amount, {'function': function})
+
+    def _merge(self, values, histograms, snapshot, gauges=True):
+        """Add the counters (and gauges, unless gauges is false) of a snapshot to the totals"""
+        for name, series in snapshot['values'].items():
+            if METRICS.get(name, ('gauge',))[0] == 'gauge' and not gauges:
+                continue
+            merged = values.setdefault(name, {})
+            for key, value in series.items():
+                merged[key] = merged.get(key, 0) + value
+        for name, series in snapshot['histograms'].items():
+            merged = histograms.setdefault(name, {})
+            for key, histogram in series.items():
+                if key in merged and len(merged[key]) == len(histogram):
+                    merged[key] = [a + b for a, b in zip(merged[key], histogram)]
+                elif key not in merged:
+                    merged[key] = list(histogram)
+
+    def _fold_exited(self):
+        """Move the counters of processes that have exited into the EXITED_PROCESS row"""
+        with self.store.transaction() as connection:
+            dead = [row for row in connection.execute('SELECT process, pid, data FROM metric_snapshots '
+                                                      'WHERE process != ?', (EXITED_PROCESS,)).fetchall()
+                    if not pid_alive(row['pid'])]
+            if not dead:
+                return
+            row = connection.execute('SELECT data FROM metric_snapshots WHERE process = ?',
+                                     (EXITED_PROCESS,)).fetchone()
+            exited = json.loads(row['data']) if row is not None else {'values': {}, 'histograms': {}}
+            for row in dead:
+                self._merge(exited['values'], exited['histograms'], json.loads(row['data']), gauges=False)
+            connection.execute('INSERT OR REPLACE INTO metric_snapshots (process, pid, data) VALUES (?, 0, ?)',
+                               (EXITED_PROCESS, json.dumps(exited)))
+            connection.executemany('DELETE FROM metric_snapshots WHERE process = ?',
+                                   [(row['process'],) for row in dead])
+
+    def render(self, gauges=None):
+        """
+        Return the metrics of all processes in the Prometheus text format
+
+        Args:
+            gauges: Optional {name: value} of gauges measured at render time
+                (e.g. from the shared store) instead of by the processes
+        """
+        self.flush()
+        self._fold_exited()
+        values = {}
+        histograms = {}
+        live_processes = 0
+
+        for row in self.store.execute('SELECT process, pid, data FROM metric_snapshots'):
+            alive = row['process'] != EXITED_PROCESS and pid_alive(row['pid'])
+            live_processes += alive
+            self._merge(values, histograms, json.loads(row['data']), gauges=alive)
+
+        values['a3divider_processes'] = {'': live_processes}
+        for name, value in (gauges or {}).items():
+            values[name] = {'': value}
+
+        lines = []
+        for name, (metric_type, help_text) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            if metric_type == 'histogram':
+                for key, histogram in sorted(histograms.get(name, {}).items()):
+                    lines.extend(self._histogram_lines(name, key, histogram))
+            else:
+                for key, value in sorted(values.get(name, {}).items()):
+                    lines.append(f'{name}{{{key}}} {value:g}' if key else f'{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    def _histogram_lines(self, name, key, histogram):
+        prefix = f'{key},' if key else ''
+        cumulative = 0
+        lines = []
+        for bound, count in zip(self.buckets, histogram):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram[-1]}')
+        labels = f'{{{key}}}' if key else ''
+        lines.append(f'{name}_sum{labels} {histogram[-2]:g}')
+        lines.append(f'{name}_count{labels} {histogram[-1]}')
+        return lines
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of split results
+
+Entries are stored as <key>.pdf under the cache root and indexed in the
+shared store (see store.py) with their size, creation time (for TTL
+expiry) and last access (for LRU eviction), so every gunicorn worker
+sees the same entries and hit/miss counters.
+
+The store also records which results are being computed (flights), so
+identical uploads that arrive together are computed once: later ones
+follow the running job or wait for its result instead.
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+from store import pid_alive
+
+# Seconds between cache lookups while waiting for another worker's result
+FLIGHT_POLL_INTERVAL = 0.2
+
+def make_cache_key(input_hash, **options):
+    """
+    Build the cache key for an input file and a set of split options
+
+    Args:
+        input_hash: SHA-256 hex digest of the uploaded PDF
+        **options: Everything that changes the output (mode, rotate_mode, ...)
+
+    Returns:
+        SHA-256 hex digest
+    """
+    canonical = json.dumps(options, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f'{input_hash}:{canonical}'.encode()).hexdigest()
+
+class ResultCache:
+    """
+    Disk cache with a size cap, LRU eviction and TTL expiry
+    """
+
+    def __init__(self, root, store, max_bytes=1024 * 1024 * 1024, ttl=86400):
+        """
+        Args:
+            root: Directory holding the cached PDFs
+            store: Store holding the index, counters and flights
+            max_bytes: Total size above which least recently used entries are evicted
+            ttl: Seconds after which an entry expires
+        """
+        self.root = Path(root)
+        self.store = store
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def _path(self, key):
+        return self.root / f'{key}.pdf'
+
+    def _count(self, connection, name):
+        connection.execute('INSERT INTO cache_counters (name, value) VALUES (?, 1) '
+                           'ON CONFLICT (name) DO UPDATE SET value = value + 1', (name,))
+
+    def get(self, key):
+        """
+        Look up a cached result
+
+        Args:
+            key: Key from make_cache_key
+
+        Returns:
+            Path of the cached PDF, or None on a miss
+        """
+        path = self._path(key)
+        now = time.time()
+        with self.store.transaction() as connection:
+            entry = connection.execute('SELECT created FROM cache_entries WHERE key = ?', (key,)).fetchone()
+            if entry is None or now - entry['created'] > self.ttl or not path.exists():
+                self._count(connection, 'misses')
+                return None
+            # Record the access for LRU
+            connection.execute('UPDATE cache_entries SET accessed = ? WHERE key = ?', (now, key))
+            self._count(connection, 'hits')
+        return path
+
+    def put(self, key, result_path, link=False):
+        """
+        Store a result under key
+
+        Args:
+            key: Key from make_cache_key
+            result_path: Finished PDF on the same filesystem as the cache
+            link: Hard-link the file instead of moving it, so the caller keeps its copy
+
+        Returns:
+            Path of the cached PDF
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = self.root / f'{key}.{os.getpid()}.tmp'
+
+        if link:
+            os.link(result_path, tmp_path)
+        else:
+            os.replace(result_path, tmp_path)
+
+        size = os.stat(tmp_path).st_size
+        now = time.time()
+        with self.store.transaction() as connection:
+            os.replace(tmp_path, path)
+            connection.execute('INSERT OR REPLACE INTO cache_entries (key, size, created, accessed) '
+                               'VALUES (?, ?, ?, ?)', (key, size, now, now))
+
+        self.evict()
+        return path
+
+    def _remove(self, path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Remove expired entries, then least recently used ones until under max_bytes"""
+        now = time.time()
+        removed = []
+        with self.store.transaction() as connection:
+            for entry in connection.execute('SELECT key FROM cache_entries WHERE created < ?',
+                                            (now - self.ttl,)).fetchall():
+                removed.append(entry['key'])
+
+            total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM cache_entries '
+                                       'WHERE created >= ?', (now - self.ttl,)).fetchone()[0]
+            if total > self.max_bytes:
+                for entry in connection.execute('SELECT key, size FROM cache_entries WHERE created >= ? '
+                                                'ORDER BY accessed', (now - self.ttl,)):
+                    if total <= self.max_bytes:
+                        break
+                    removed.append(entry['key'])
+                    total -= entry['size']
+
+            connection.executemany('DELETE FROM cache_entries WHERE key = ?', [(key,) for key in removed])
+            for key in removed:
+                self._remove(self._path(key))
+
+    def stats(self):
+        """Return the hit/miss counters of all workers and the current cache size"""
+        connection = self.store.connect()
+        counters = dict(connection.execute('SELECT name, value FROM cache_counters').fetchall())
+        entries, total = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries').fetchone()
+        return {
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'entries': entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+        }
+
+    def claim(self, key, owner):
+        """
+        Record that the result for key is being computed, unless it already is
+
+        Flights of processes that have exited or older than the TTL are
+        taken over.
+
+        Args:
+            key: Key from make_cache_key
+            owner: 'job:<id>' for a background job, 'request' for a split in a request
+
+        Returns:
+            None if the caller now owns the flight, otherwise the current owner
+        """
+        with self.store.transaction() as connection:
+            current = self._owner(connection, key)
+            if current is not None:
+                return current
+            connection.execute('INSERT OR REPLACE INTO flights (cache_key, owner, pid, started) '
+                               'VALUES (?, ?, ?, ?)', (key, owner, os.getpid(), time.time()))
+        return None
+
+    def _owner(self, connection, key):
+        flight = connection.execute('SELECT owner, pid, started FROM flights WHERE cache_key = ?',
+                                    (key,)).fetchone()
+        if flight is None or not pid_alive(flight['pid']) or time.time() - flight['started'] > self.ttl:
+            return None
+        return flight['owner']
+
+    def owner(self, key):
+        """Return the owner of the live flight computing key (see claim()), or None"""
+        return self._owner(self.store.connect(), key)
+
+    def release(self, key, owner):
+        """End a flight started by claim()"""
+        self.store.execute('DELETE FROM flights WHERE cache_key = ? AND owner = ?', (key, owner))
+
+    def wait(self, key, timeout):
+        """
+        Wait for another worker's flight to put its result
+
+        Args:
+            key: Key from make_cache_key
+            timeout: Seconds to wait at most
+
+        Returns:
+            Path of the cached PDF, or None if the flight ended without a
+            result or did not finish in time
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            # Polled without counting misses; only the final lookup counts
+            connection = self.store.connect()
+            if connection.execute('SELECT 1 FROM cache_entries WHERE key = ?', (key,)).fetchone():
+                return self.get(key)
+            flight = connection.execute('SELECT 1 FROM flights WHERE cache_key = ?', (key,)).fetchone()
+            if flight is None or time.monotonic() >= deadline:
+                return self.get(key)
+            time.sleep(FLIGHT_POLL_INTERVAL)
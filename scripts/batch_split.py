@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Batch A3 PDF splitter
+複数のA3 PDFをまとめて分割するツール
+
+Takes files, directories and glob patterns, splits every PDF in a pool of
+worker processes and skips files whose output is newer than the input.
+"""
+import sys
+from pathlib import Path
+from optparse import OptionParser
+
+# Make the a3divider package in the repository root importable
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from a3divider import (
+    BINDING_SCHEMES,
+    DEFAULT_ENGINE,
+    DEFAULT_SIGNATURE_PAGES,
+    SPLIT_ENGINES,
+    rewrite_backend,
+)
+from a3divider.batch import (
+    OUTPUT_SUFFIXES,
+    STATUS_FAILED,
+    collect_inputs,
+    mode_splitter,
+    run_batch,
+    write_summary,
+)
+from a3divider.downsample import add_downsample_options, downsampler_from_options
+
+def format_record(record, index, total):
+    """One progress line per finished, skipped or failed file"""
+    line = f"[{index}/{total}] {record['status']:<7} {record['input']}"
+    if record['status'] == STATUS_FAILED:
+        line += f": {record['error']}"
+    elif record['seconds'] is not None:
+        line += f" -> {record['output']} ({record['pages']} pages, {record['seconds']:.2f}s)"
+    return line
+
+def main():
+    """Main function"""
+    usage = "usage: %prog [options] <pdf file, directory or glob>..."
+    parser = OptionParser(usage=usage)
+    parser.add_option("-m", "--mode", dest="mode", default="simple", choices=sorted(OUTPUT_SUFFIXES),
+                      help="Processing mode: simple or booklet (default: simple)")
+    parser.add_option("-e", "--engine", dest="engine", default=DEFAULT_ENGINE,
+                      choices=sorted(SPLIT_ENGINES),
+                      help="Split engine: " + ", ".join(sorted(SPLIT_ENGINES)) +
+                           f" (default: {DEFAULT_ENGINE})")
+    parser.add_option("-r", "--rotate", action="store_true", dest="rotate",
+                      help="Rotate pages 90 degrees")
+    parser.add_option("--vertical", action="store_true", dest="vertical",
+                      help="Vertical writing: right half first (simple mode)")
+    parser.add_option("-b", "--binding", dest="binding", default="saddle",
+                      choices=sorted(BINDING_SCHEMES),
+                      help="Binding scheme: " + ", ".join(sorted(BINDING_SCHEMES)) +
+                           " (booklet mode, default: saddle)")
+    parser.add_option("-s", "--signature-pages", type="int", dest="signature_pages",
+                      default=DEFAULT_SIGNATURE_PAGES,
+                      help=f"A4 pages per signature for perfect binding (default: {DEFAULT_SIGNATURE_PAGES})")
+    parser.add_option("--rtl", action="store_true", dest="rtl",
+                      help="Right-to-left binding (booklet mode)")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=1,
+                      help="Files split in parallel (0 = CPU count, default: 1)")
+    parser.add_option("-o", "--output-dir", dest="output_dir",
+                      help="Directory for the outputs (default: next to each input)")
+    parser.add_option("-R", "--recursive", action="store_true", dest="recursive",
+                      help="Include PDFs in subdirectories")
+    parser.add_option("-f", "--force", action="store_true", dest="force",
+                      help="Split files even if their output is up to date")
+    parser.add_option("--linearize", action="store_true", dest="linearize",
+                      help="Write linearized PDFs for fast web view (needs pikepdf or qpdf)")
+    parser.add_option("--compact", action="store_true", dest="compact",
+                      help="Merge identical objects and compress the output "
+                           "(object streams too with pikepdf or qpdf)")
+    add_downsample_options(parser)
+    parser.add_option("--summary", dest="summary",
+                      help="Write a per-file summary (.csv for CSV, otherwise JSON)")
+
+    (options, args) = parser.parse_args()
+
+    if not args:
+        parser.print_help()
+        sys.exit(1)
+
+    if options.signature_pages <= 0 or options.signature_pages % 4 != 0:
+        parser.error("--signature-pages must be a positive multiple of 4")
+    if options.linearize and rewrite_backend() is None:
+        parser.error("--linearize needs pikepdf or the qpdf command")
+    downsample = downsampler_from_options(parser, options)
+
+    suffix = OUTPUT_SUFFIXES[options.mode]
+    inputs = collect_inputs(args, options.recursive, exclude_suffix=suffix)
+    if not inputs:
+        print("Error: No PDF files found")
+        sys.exit(1)
+
+    splitter = mode_splitter(options.mode, options.engine, options.rotate, options.vertical,
+                             options.binding, options.signature_pages, options.rtl)
+
+    print(f"Splitting {len(inputs)} files ({options.mode} mode, {options.jobs or 'all'} jobs)...")
+    finished = 0
+
+    def print_record(record):
+        nonlocal finished
+        finished += 1
+        print(format_record(record, finished, len(inputs)), flush=True)
+
+    records = run_batch(splitter, inputs, suffix, options.output_dir, options.jobs, options.force,
+                        callback=print_record, linearize=options.linearize,
+                        compact=options.compact, downsample=downsample)
+
+    if options.summary:
+        write_summary(records, options.summary)
+        print(f"Summary written to {options.summary}")
+
+    failed = sum(record['status'] == STATUS_FAILED for record in records)
+    print(f"\nDone: {len(records) - failed} succeeded or up to date, {failed} failed")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
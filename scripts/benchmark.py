@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Benchmark harness for the A3 -> A4 splitters
+
+Generates synthetic A3 documents (vector and scanned-image content at
+several sheet counts) with create_test_pdf.py, runs every splitter on them
+and writes wall time, peak Python heap (tracemalloc) and output size per
+run to a JSON report. A report from an earlier run can be passed as the
+baseline to print the change of each measurement.
+
+Implementations measured:
+    app.split_pdf_simple / app.split_pdf_booklet   web app functions
+    scripts/pdf_a3_to_a4.py                        Phase1 CLI
+    scripts/phase2_booklet_splitter.py             Phase2 CLI
+    a3divider.Splitter[workers=N]                  process pool splitter
+    pdf_a3_to_a4.py, phase2_booklet_splitter.py,
+    pdf_A3toA4*.py                                 legacy scripts in the root
+"""
+import contextlib
+import gc
+import importlib.util
+import io
+import json
+import os
+import platform
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from optparse import OptionParser
+from pathlib import Path
+
+# Make the a3divider package in the repository root importable
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+import PyPDF2
+from a3divider import SPLIT_ENGINES, FileSink, Splitter
+from create_test_pdf import CONTENT_KINDS, create_test_a3_pdf
+
+DEFAULT_SHEETS = (10, 100, 1000)
+
+# Legacy scripts that only run as __main__ with the input path in argv
+LEGACY_SCRIPTS = ('pdf_A3toA4.py', 'pdf_A3toA4_fixed.py', 'pdf_A3toA4_v2.py', 'pdf_A3toA4_v3.py')
+
+def load_module(path, name):
+    """Import a script by path under a unique name (several share a file name)"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def ensure_document(data_dir, kind, sheets):
+    """Return the path of a synthetic A3 document, generating it on first use"""
+    path = Path(data_dir) / f'a3_{kind}_{sheets}.pdf'
+    if not path.exists():
+        partial_path = path.with_suffix('.part')
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_test_a3_pdf(str(partial_path), num_pages=sheets, kind=kind)
+        os.replace(partial_path, path)
+    return path
+
+def build_cases(engines, workers):
+    """
+    Collect the splitters to benchmark
+
+    Returns:
+        List of (implementation, engine, run) where run(input_path, work_dir)
+        splits the document and returns the output path
+    """
+    import app
+    scripts_phase1 = load_module(REPO_ROOT / 'scripts' / 'pdf_a3_to_a4.py', 'bench_scripts_phase1')
+    scripts_phase2 = load_module(REPO_ROOT / 'scripts' / 'phase2_booklet_splitter.py', 'bench_scripts_phase2')
+
+    def app_function(split_function, engine):
+        def run(input_path, work_dir):
+            output_path = work_dir / 'output.pdf'
+            with open(input_path, 'rb') as input_stream, open(output_path, 'wb') as output_stream:
+                split_function(input_stream, engine=engine, output_stream=output_stream)
+            return output_path
+        return run
+
+    def cli_function(split_function, engine, **kwargs):
+        def run(input_path, work_dir):
+            return split_function(str(input_path), engine=engine, **kwargs)
+        return run
+
+    def parallel(engine):
+        def run(input_path, work_dir):
+            output_path = work_dir / 'output.pdf'
+            Splitter(engine, workers=workers).split(str(input_path), FileSink(output_path))
+            return output_path
+        return run
+
+    cases = []
+    for engine in engines:
+        cases.extend([
+            ('app.split_pdf_simple', engine, app_function(app.split_pdf_simple, engine)),
+            ('app.split_pdf_booklet', engine, app_function(app.split_pdf_booklet, engine)),
+            ('scripts/pdf_a3_to_a4.py', engine, cli_function(scripts_phase1.split_a3_to_a4, engine)),
+            ('scripts/phase2_booklet_splitter.py', engine,
+             cli_function(scripts_phase2.split_and_reorder_pdf, engine)),
+            (f'a3divider.Splitter[workers={workers}]', engine, parallel(engine)),
+        ])
+
+    legacy_phase1 = load_module(REPO_ROOT / 'pdf_a3_to_a4.py', 'bench_legacy_phase1')
+    legacy_phase2 = load_module(REPO_ROOT / 'phase2_booklet_splitter.py', 'bench_legacy_phase2')
+    cases.append(('pdf_a3_to_a4.py', None,
+                  lambda input_path, work_dir: legacy_phase1.split_a3_to_a4(str(input_path))))
+    cases.append(('phase2_booklet_splitter.py', None,
+                  lambda input_path, work_dir: legacy_phase2.split_and_reorder_pdf(str(input_path))))
+
+    for script in LEGACY_SCRIPTS:
+        cases.append((script, None, legacy_script(script)))
+
+    return cases
+
+def legacy_script(script):
+    """Run a legacy script as __main__ and return the file it created"""
+    def run(input_path, work_dir):
+        before = set(work_dir.iterdir())
+        saved_argv = sys.argv
+        sys.argv = [script, str(input_path)]
+        try:
+            runpy.run_path(str(REPO_ROOT / script), run_name='__main__')
+        finally:
+            sys.argv = saved_argv
+        created = set(work_dir.iterdir()) - before
+        return created.pop() if created else None
+    return run
+
+def run_case(run, input_path, traced):
+    """
+    Run one splitter on a private copy of the input
+
+    The input is symlinked into a fresh directory because the CLI tools
+    write their output next to it.
+
+    Returns:
+        Tuple (seconds, peak_bytes, output_bytes, output_pages); peak_bytes is
+        None unless traced
+    """
+    work_dir = Path(tempfile.mkdtemp(prefix='a3_bench_'))
+    try:
+        linked_input = work_dir / input_path.name
+        os.symlink(input_path.resolve(), linked_input)
+
+        gc.collect()
+        if traced:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                output_path = run(linked_input, work_dir)
+        finally:
+            seconds = time.perf_counter() - start
+            peak_bytes = tracemalloc.get_traced_memory()[1] if traced else None
+            if traced:
+                tracemalloc.stop()
+
+        if output_path is None or not Path(output_path).exists():
+            raise RuntimeError("no output file was written")
+        output_path = Path(output_path)
+        return seconds, peak_bytes, output_path.stat().st_size, len(PyPDF2.PdfReader(output_path).pages)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def benchmark(documents, cases, repeat=1, measure_memory=True):
+    """
+    Run every case on every document
+
+    Wall time is taken from untraced runs (the minimum of repeat runs), since
+    tracemalloc slows allocation-heavy code down considerably; peak memory
+    comes from one extra traced run. Only the benchmark process is traced,
+    so worker processes of the parallel splitter are not included.
+
+    Args:
+        documents: List of (name, kind, sheets, path)
+        cases: List from build_cases
+        repeat: Untraced runs per case
+        measure_memory: Whether to add the traced run
+
+    Returns:
+        List of result dicts
+    """
+    results = []
+    for doc_name, kind, sheets, path in documents:
+        for implementation, engine, run in cases:
+            result = {
+                'document': doc_name,
+                'kind': kind,
+                'sheets': sheets,
+                'implementation': implementation,
+                'engine': engine,
+                'wall_times': [],
+                'wall_time': None,
+                'peak_memory': None,
+                'output_bytes': None,
+                'output_pages': None,
+                'error': None,
+            }
+            try:
+                for _ in range(repeat):
+                    seconds, _, output_bytes, output_pages = run_case(run, path, traced=False)
+                    result['wall_times'].append(round(seconds, 4))
+                result['wall_time'] = min(result['wall_times'])
+                result['output_bytes'] = output_bytes
+                result['output_pages'] = output_pages
+                if measure_memory:
+                    result['peak_memory'] = run_case(run, path, traced=True)[1]
+            except BaseException as e:
+                if isinstance(e, KeyboardInterrupt):
+                    raise
+                result['error'] = f"{type(e).__name__}: {e}"
+
+            print(format_result(result), flush=True)
+            results.append(result)
+    return results
+
+def format_result(result):
+    label = f"{result['document']:<12} {result['implementation']:<36} {result['engine'] or '-':<11}"
+    if result['error']:
+        return f"{label} ERROR {result['error']}"
+    memory = f"{result['peak_memory'] / 1e6:9.1f}MB" if result['peak_memory'] is not None else '        -'
+    return (f"{label} {result['wall_time']:9.3f}s {memory} "
+            f"{result['output_bytes'] / 1e6:9.2f}MB {result['output_pages']:6d}p")
+
+def result_key(result):
+    return (result['document'], result['implementation'], result['engine'])
+
+def compare(results, baseline_results):
+    """Print the ratio of each measurement to the matching baseline result"""
+    baseline = {result_key(result): result for result in baseline_results}
+
+    print(f"\n{'document':<12} {'implementation':<36} {'engine':<11} {'time':>8} {'memory':>8} {'size':>8}")
+    for result in results:
+        old = baseline.get(result_key(result))
+        if old is None or result['error'] or old['error']:
+            continue
+        ratios = []
+        for field in ('wall_time', 'peak_memory', 'output_bytes'):
+            if result[field] is None or not old[field]:
+                ratios.append(f"{'-':>8}")
+            else:
+                ratios.append(f"{result[field] / old[field]:7.2f}x")
+        print(f"{result['document']:<12} {result['implementation']:<36} {result['engine'] or '-':<11} "
+              + ' '.join(ratios))
+
+def main():
+    """Main function"""
+    usage = "usage: %prog [options]"
+    parser = OptionParser(usage=usage)
+    parser.add_option("-s", "--sheets", dest="sheets", default=','.join(map(str, DEFAULT_SHEETS)),
+                      help="Comma-separated A3 sheet counts (default: %default)")
+    parser.add_option("-k", "--kinds", dest="kinds", default=','.join(CONTENT_KINDS),
+                      help="Comma-separated document kinds (default: %default)")
+    parser.add_option("-e", "--engines", dest="engines", default=','.join(SPLIT_ENGINES),
+                      help="Comma-separated split engines (default: %default)")
+    parser.add_option("-i", "--implementation", action="append", dest="implementations",
+                      help="Only run implementations whose name contains this text (repeatable)")
+    parser.add_option("-r", "--repeat", type="int", dest="repeat", default=1,
+                      help="Timed runs per case; the fastest is reported (default: %default)")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=os.cpu_count() or 1,
+                      help="Worker processes for the parallel splitter (default: %default)")
+    parser.add_option("--no-memory", action="store_false", dest="memory", default=True,
+                      help="Skip the tracemalloc run")
+    parser.add_option("-d", "--data-dir", dest="data_dir",
+                      default=str(Path(tempfile.gettempdir()) / 'a3_benchmark_data'),
+                      help="Directory for the generated documents (default: %default)")
+    parser.add_option("-o", "--output", dest="output", default="benchmark_report.json",
+                      help="JSON report path (default: %default)")
+    parser.add_option("-b", "--baseline", dest="baseline",
+                      help="Earlier JSON report to compare against")
+
+    (options, args) = parser.parse_args()
+
+    engines = [engine for engine in options.engines.split(',') if engine]
+    for engine in engines:
+        if engine not in SPLIT_ENGINES:
+            parser.error(f"unknown engine: {engine}")
+    kinds = [kind for kind in options.kinds.split(',') if kind]
+    for kind in kinds:
+        if kind not in CONTENT_KINDS:
+            parser.error(f"unknown kind: {kind}")
+    sheet_counts = [int(sheets) for sheets in options.sheets.split(',') if sheets]
+
+    Path(options.data_dir).mkdir(parents=True, exist_ok=True)
+    documents = []
+    for kind in kinds:
+        for sheets in sheet_counts:
+            print(f"Preparing {kind} document with {sheets} sheets...", flush=True)
+            path = ensure_document(options.data_dir, kind, sheets)
+            documents.append((f'{kind}-{sheets}', kind, sheets, path))
+
+    cases = build_cases(engines, options.jobs)
+    if options.implementations:
+        cases = [case for case in cases
+                 if any(text in case[0] for text in options.implementations)]
+
+    results = benchmark(documents, cases, options.repeat, options.memory)
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pypdf2': PyPDF2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeat': options.repeat,
+        'documents': [
+            {'name': name, 'kind': kind, 'sheets': sheets, 'bytes': path.stat().st_size}
+            for name, kind, sheets, path in documents
+        ],
+        'results': results,
+    }
+    with open(options.output, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"\nReport written to {options.output}")
+
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            compare(results, json.load(baseline_file)['results'])
+
+if __name__ == "__main__":
+    main()
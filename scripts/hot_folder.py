@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Hot folder daemon
+スキャナーの保存先フォルダーを監視し、届いたA3 PDFを自動で分割するツール
+
+Watches an inbox directory (inotify on Linux, polling elsewhere), waits
+until each PDF has been written completely, splits it in a pool of warm
+worker processes and writes the result to an outbox. Runs until
+interrupted with Ctrl+C or SIGTERM; splits in progress are finished first.
+"""
+import json
+import logging
+import signal
+import sys
+from pathlib import Path
+from optparse import OptionParser
+
+# Make the a3divider package in the repository root importable
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from a3divider import (
+    BINDING_SCHEMES,
+    DEFAULT_ENGINE,
+    DEFAULT_SIGNATURE_PAGES,
+    SPLIT_ENGINES,
+    rewrite_backend,
+)
+from a3divider.batch import OUTPUT_SUFFIXES, STATUS_FAILED, mode_splitter
+from a3divider.downsample import add_downsample_options, downsampler_from_options
+from a3divider.hotfolder import HotFolder
+
+def main():
+    """Main function"""
+    usage = "usage: %prog [options] <inbox directory> <outbox directory>"
+    parser = OptionParser(usage=usage)
+    parser.add_option("-m", "--mode", dest="mode", default="booklet", choices=sorted(OUTPUT_SUFFIXES),
+                      help="Processing mode: simple or booklet (default: booklet)")
+    parser.add_option("-e", "--engine", dest="engine", default=DEFAULT_ENGINE,
+                      choices=sorted(SPLIT_ENGINES),
+                      help="Split engine: " + ", ".join(sorted(SPLIT_ENGINES)) +
+                           f" (default: {DEFAULT_ENGINE})")
+    parser.add_option("-r", "--rotate", action="store_true", dest="rotate",
+                      help="Rotate pages 90 degrees")
+    parser.add_option("--vertical", action="store_true", dest="vertical",
+                      help="Vertical writing: right half first (simple mode)")
+    parser.add_option("-b", "--binding", dest="binding", default="saddle",
+                      choices=sorted(BINDING_SCHEMES),
+                      help="Binding scheme: " + ", ".join(sorted(BINDING_SCHEMES)) +
+                           " (booklet mode, default: saddle)")
+    parser.add_option("-s", "--signature-pages", type="int", dest="signature_pages",
+                      default=DEFAULT_SIGNATURE_PAGES,
+                      help=f"A4 pages per signature for perfect binding (default: {DEFAULT_SIGNATURE_PAGES})")
+    parser.add_option("--rtl", action="store_true", dest="rtl",
+                      help="Right-to-left binding (booklet mode)")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=1,
+                      help="Files split in parallel (0 = CPU count, default: 1)")
+    parser.add_option("--settle", type="float", dest="settle", default=2.0,
+                      help="Seconds a file must stay unchanged before it is split "
+                           "when no close event was seen (default: 2)")
+    parser.add_option("--interval", type="float", dest="interval", default=1.0,
+                      help="Seconds between scans when polling (default: 1)")
+    parser.add_option("--poll", action="store_true", dest="poll",
+                      help="Poll the inbox instead of using inotify (e.g. for network mounts)")
+    parser.add_option("-a", "--archive", dest="archive",
+                      help="Move inputs to this directory after a successful split")
+    parser.add_option("--log", dest="log",
+                      help="Append one JSON line per split file to this file")
+    parser.add_option("--linearize", action="store_true", dest="linearize",
+                      help="Write linearized PDFs for fast web view (needs pikepdf or qpdf)")
+    parser.add_option("--compact", action="store_true", dest="compact",
+                      help="Merge identical objects and compress the output "
+                           "(object streams too with pikepdf or qpdf)")
+    add_downsample_options(parser)
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2:
+        parser.print_help()
+        sys.exit(1)
+
+    if options.signature_pages <= 0 or options.signature_pages % 4 != 0:
+        parser.error("--signature-pages must be a positive multiple of 4")
+    if options.linearize and rewrite_backend() is None:
+        parser.error("--linearize needs pikepdf or the qpdf command")
+    downsample = downsampler_from_options(parser, options)
+
+    inbox, outbox = args
+    if not Path(inbox).is_dir():
+        print(f"Error: Inbox '{inbox}' is not a directory")
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    def log_record(record):
+        if record['status'] == STATUS_FAILED:
+            logging.error("failed  %s: %s", record['input'], record['error'])
+        else:
+            logging.info("ok      %s -> %s (%s pages, %.2fs)",
+                         record['input'], record['output'], record['pages'], record['seconds'])
+        if options.log:
+            with open(options.log, 'a') as log_file:
+                log_file.write(json.dumps(record) + "\n")
+
+    splitter = mode_splitter(options.mode, options.engine, options.rotate, options.vertical,
+                             options.binding, options.signature_pages, options.rtl)
+    hot_folder = HotFolder(splitter, inbox, outbox, OUTPUT_SUFFIXES[options.mode],
+                           workers=options.jobs, settle=options.settle, interval=options.interval,
+                           poll=options.poll, archive=options.archive, callback=log_record,
+                           linearize=options.linearize, compact=options.compact,
+                           downsample=downsample)
+
+    def stop(signum, frame):
+        hot_folder.stop()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    hot_folder.run()
+    logging.info("Stopped")
+
+if __name__ == "__main__":
+    main()
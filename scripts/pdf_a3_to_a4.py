@@ -3,18 +3,31 @@
 A3 PDF to A4 PDF splitter
 Splits A3 PDF pages horizontally into two A4 pages
 """
-import PyPDF2
 import sys
 import os
-import re
 from pathlib import Path
+from optparse import OptionParser
 
-def split_a3_to_a4(input_file):
+# Make the a3divider package in the repository root importable
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from a3divider import SPLIT_ENGINES, FileSink, Splitter, rewrite_backend
+from a3divider.downsample import add_downsample_options, downsampler_from_options
+
+def split_a3_to_a4(input_file, engine='passthrough', jobs=1, linearize=False, compact=False,
+                   downsample=None):
     """
     Split A3 PDF pages into A4 pages
 
+    Landscape pages are split into left/right halves and portrait pages
+    into top/bottom halves, left/top first.
+
     Args:
         input_file: Path to the input PDF file
+        engine: Split engine name (see a3divider.SPLIT_ENGINES)
+        jobs: Number of worker processes (1 splits in this process, 0 = CPU count)
+        linearize: Write a linearized PDF for fast web view
+        compact: Merge identical objects and compress the output
+        downsample: Optional ImageDownsampler applied to the output
 
     Returns:
         Output filename if successful, None if error
@@ -25,66 +38,14 @@ def split_a3_to_a4(input_file):
         output_filename = input_path.stem + '_A4.pdf'
         output_path = input_path.parent / output_filename
 
-        # Open PDF
-        with open(input_file, 'rb') as pdf_file:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            pdf_writer = PyPDF2.PdfWriter()
-
-            # Process each page
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-
-                # Get page dimensions
-                mediabox = page.mediabox
-                x0, y0 = float(mediabox.lower_left[0]), float(mediabox.lower_left[1])
-                x1, y1 = float(mediabox.upper_right[0]), float(mediabox.upper_right[1])
-
-                # Calculate page width and height
-                width = x1 - x0
-                height = y1 - y0
-
-                # Determine if page is landscape (A3 orientation)
-                if width > height:
-                    # Split horizontally (left and right)
-                    mid_x = x0 + width / 2
-
-                    # Left page (first half)
-                    left_page = pdf_reader.pages[page_num]
-                    left_page.cropbox.lower_left = (x0, y0)
-                    left_page.cropbox.upper_right = (mid_x, y1)
-
-                    # Right page (second half)
-                    right_page = pdf_reader.pages[page_num]
-                    right_page.cropbox.lower_left = (mid_x, y0)
-                    right_page.cropbox.upper_right = (x1, y1)
-
-                    # Add pages in order (left first, then right)
-                    pdf_writer.add_page(left_page)
-                    pdf_writer.add_page(right_page)
-                else:
-                    # Split vertically (top and bottom) for portrait orientation
-                    mid_y = y0 + height / 2
-
-                    # Top page (first half)
-                    top_page = pdf_reader.pages[page_num]
-                    top_page.cropbox.lower_left = (x0, mid_y)
-                    top_page.cropbox.upper_right = (x1, y1)
-
-                    # Bottom page (second half)
-                    bottom_page = pdf_reader.pages[page_num]
-                    bottom_page.cropbox.lower_left = (x0, y0)
-                    bottom_page.cropbox.upper_right = (x1, mid_y)
-
-                    # Add pages in order (top first, then bottom)
-                    pdf_writer.add_page(top_page)
-                    pdf_writer.add_page(bottom_page)
-
-            # Write output file
-            with open(output_path, 'wb') as output_file:
-                pdf_writer.write(output_file)
-
-            print(f"Successfully split PDF: {output_path}")
-            return str(output_path)
+        if not input_path.exists():
+            raise FileNotFoundError(input_file)
+
+        Splitter(engine, workers=jobs).split(input_file, FileSink(output_path, linearize, compact,
+                                                                   downsample))
+
+        print(f"Successfully split PDF: {output_path}")
+        return str(output_path)
 
     except FileNotFoundError:
         print(f"Error: File '{input_file}' not found.")
@@ -95,12 +56,32 @@ def split_a3_to_a4(input_file):
 
 def main():
     """Main function"""
-    if len(sys.argv) != 2:
-        print("Usage: python pdf_a3_to_a4.py <input_pdf_file>")
-        print("Example: python pdf_a3_to_a4.py document.pdf")
+    usage = "usage: %prog [options] <input_pdf_file>"
+    parser = OptionParser(usage=usage)
+    parser.add_option("-e", "--engine", dest="engine", default="passthrough",
+                      choices=sorted(SPLIT_ENGINES),
+                      help="Split engine: " + ", ".join(sorted(SPLIT_ENGINES)) +
+                           " (default: passthrough)")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=1,
+                      help="Worker processes for splitting (0 = CPU count, default: 1)")
+    parser.add_option("--linearize", action="store_true", dest="linearize",
+                      help="Write linearized PDFs for fast web view (needs pikepdf or qpdf)")
+    parser.add_option("--compact", action="store_true", dest="compact",
+                      help="Merge identical objects and compress the output "
+                           "(object streams too with pikepdf or qpdf)")
+    add_downsample_options(parser)
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.print_help()
         sys.exit(1)
 
-    input_file = sys.argv[1]
+    if options.linearize and rewrite_backend() is None:
+        parser.error("--linearize needs pikepdf or the qpdf command")
+    downsample = downsampler_from_options(parser, options)
+
+    input_file = args[0]
 
     # Check if file exists
     if not os.path.exists(input_file):
@@ -113,7 +94,8 @@ def main():
         sys.exit(1)
 
     # Process the PDF
-    result = split_a3_to_a4(input_file)
+    result = split_a3_to_a4(input_file, options.engine, options.jobs, options.linearize,
+                            options.compact, downsample)
 
     if result:
         sys.exit(0)
@@ -121,4 +103,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
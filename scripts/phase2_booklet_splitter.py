@@ -6,10 +6,24 @@ A3製本PDFを分割して正しいA4ページ順に並び替えるツール
 import PyPDF2
 import sys
 import os
-import re
 from pathlib import Path
 from optparse import OptionParser
 
+# Make the a3divider package in the repository root importable
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from a3divider import (
+    BINDING_SCHEMES,
+    DEFAULT_ENGINE,
+    DEFAULT_SIGNATURE_PAGES,
+    SPLIT_ENGINES,
+    BookletOrdering,
+    FileSink,
+    Splitter,
+    compile_plan,
+    rewrite_backend,
+)
+from a3divider.downsample import add_downsample_options, downsampler_from_options
+
 def generate_booklet_mapping(total_pages):
     """
     Generate booklet page mapping using the discovered formula
@@ -26,22 +40,8 @@ def generate_booklet_mapping(total_pages):
         print(f"Warning: {total_pages} pages padded to {padded_pages} pages")
         total_pages = padded_pages
 
-    S = total_pages // 2  # Number of A3 sheets
-    mapping = []
-
-    for i in range(1, S + 1):  # A3 sheet numbers 1 to S
-        j = i - 1  # 0-based index
-        b = j % 2  # 0 for even positions, 1 for odd positions
-
-        # Apply the formula from Codex analysis:
-        # Left(i) = S + (2b - 1) * j + b
-        # Right(i) = T + 1 - Left(i)
-        left = S + (2 * b - 1) * j + b
-        right = total_pages + 1 - left
-
-        mapping.append((i, [left, right]))
-
-    return mapping
+    # The formula lives in the memoized saddle-stitch plan
+    return compile_plan('saddle', total_pages).mapping()
 
 def verify_mapping(total_pages=32):
     """Verify the mapping against known data"""
@@ -72,7 +72,9 @@ def verify_mapping(total_pages=32):
     print(f"\nMatches: {matches}/{len(known_mapping)}")
     return matches == len(known_mapping)
 
-def split_and_reorder_pdf(input_file, total_pages=None, rotate=False):
+def split_and_reorder_pdf(input_file, total_pages=None, rotate=False, engine=DEFAULT_ENGINE, jobs=1,
+                          binding='saddle', signature_pages=DEFAULT_SIGNATURE_PAGES, rtl=False,
+                          linearize=False, compact=False, downsample=None):
     """
     Split A3 PDF and reorder pages according to booklet pattern
 
@@ -80,111 +82,57 @@ def split_and_reorder_pdf(input_file, total_pages=None, rotate=False):
         input_file: Path to input A3 PDF
         total_pages: Total A4 pages (auto-detect if None)
         rotate: Whether to rotate pages 90 degrees
+        engine: Split engine name (see a3divider.SPLIT_ENGINES)
+        jobs: Number of worker processes (1 splits in this process)
+        binding: Binding scheme (see a3divider.BINDING_SCHEMES)
+        signature_pages: Pages per signature for perfect binding
+        rtl: Right-to-left binding
+        linearize: Write a linearized PDF for fast web view
+        compact: Merge identical objects and compress the output
+        downsample: Optional ImageDownsampler applied to the output
 
     Returns:
         Output filename if successful
     """
     try:
         with open(input_file, 'rb') as pdf_file:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            num_a3_pages = len(pdf_reader.pages)
-
-            # Auto-detect total pages if not specified
-            if total_pages is None:
-                total_pages = num_a3_pages * 2
-                print(f"Auto-detected: {num_a3_pages} A3 pages = {total_pages} A4 pages")
-
-            # Generate mapping
-            mapping = generate_booklet_mapping(total_pages)
-
-            # Create output filename
-            input_path = Path(input_file)
-            output_filename = input_path.stem + '_phase2_reordered.pdf'
-            output_path = input_path.parent / output_filename
-
-            # Split and collect all A4 pages first
-            split_pages = {}  # {A4_page_number: PageObject}
-
-            print(f"Splitting {num_a3_pages} A3 pages...")
-
-            for a3_idx in range(num_a3_pages):
-                if a3_idx >= len(mapping):
-                    print(f"Warning: A3 page {a3_idx + 1} exceeds mapping, skipping")
-                    break
-
-                original_page = pdf_reader.pages[a3_idx]
-                a3_sheet_num, [left_a4, right_a4] = mapping[a3_idx]
-
-                # Get page dimensions
-                mediabox = original_page.mediabox
-                x0, y0 = float(mediabox.lower_left[0]), float(mediabox.lower_left[1])
-                x1, y1 = float(mediabox.upper_right[0]), float(mediabox.upper_right[1])
-
-                width = x1 - x0
-                height = y1 - y0
-
-                # Split based on orientation
-                if width > height:  # Landscape (wide)
-                    mid_x = x0 + width / 2
-
-                    # Left half
-                    left_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
-                    left_page.merge_page(original_page)
-                    left_page.cropbox.lower_left = (x0, y0)
-                    left_page.cropbox.upper_right = (mid_x, y1)
-
-                    # Right half
-                    right_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
-                    right_page.merge_page(original_page)
-                    right_page.cropbox.lower_left = (mid_x, y0)
-                    right_page.cropbox.upper_right = (x1, y1)
-
-                else:  # Portrait (tall)
-                    mid_y = y0 + height / 2
-
-                    # Top half (left)
-                    left_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
-                    left_page.merge_page(original_page)
-                    left_page.cropbox.lower_left = (x0, mid_y)
-                    left_page.cropbox.upper_right = (x1, y1)
-
-                    # Bottom half (right)
-                    right_page = PyPDF2.PageObject.create_blank_page(width=width, height=height)
-                    right_page.merge_page(original_page)
-                    right_page.cropbox.lower_left = (x0, y0)
-                    right_page.cropbox.upper_right = (x1, mid_y)
-
-                # Optional rotation
-                if rotate:
-                    left_page.rotate(90)
-                    right_page.rotate(90)
-
-                # Store pages with their A4 page numbers
-                split_pages[left_a4] = left_page
-                split_pages[right_a4] = right_page
-
-                print(f"A3 page {a3_sheet_num:2d} -> A4 pages {left_a4:2d}, {right_a4:2d}")
-
-            # Create new PDF with pages in correct order (1, 2, 3, ...)
-            pdf_writer = PyPDF2.PdfWriter()
-
-            print(f"\nReordering pages 1-{total_pages}...")
-            for page_num in range(1, total_pages + 1):
-                if page_num in split_pages:
-                    pdf_writer.add_page(split_pages[page_num])
-                    print(f"Added A4 page {page_num}")
-                else:
-                    # Create blank page if missing
-                    blank_page = PyPDF2.PageObject.create_blank_page(width=595, height=842)  # A4 size
-                    pdf_writer.add_page(blank_page)
-                    print(f"Added blank page {page_num} (missing)")
-
-            # Write output
-            with open(output_path, 'wb') as output_file:
-                pdf_writer.write(output_file)
-
-            print(f"\nSuccessfully created: {output_path}")
-            return str(output_path)
+            num_a3_pages = len(PyPDF2.PdfReader(pdf_file).pages)
+
+        # Auto-detect total pages if not specified
+        if total_pages is None:
+            total_pages = num_a3_pages * 2
+            print(f"Auto-detected: {num_a3_pages} A3 pages = {total_pages} A4 pages")
+
+        # Memoized plan: A4 page -> (A3 page, side)
+        ordering = BookletOrdering(binding, total_pages, signature_pages, rtl)
+        plan = ordering.plan(num_a3_pages)
+        if plan.total_pages != total_pages:
+            print(f"Warning: {total_pages} pages padded to {plan.total_pages} pages")
+        mapping = plan.mapping()
+
+        # Create output filename
+        input_path = Path(input_file)
+        output_filename = input_path.stem + '_phase2_reordered.pdf'
+        output_path = input_path.parent / output_filename
+
+        for a3_idx in range(len(mapping), num_a3_pages):
+            print(f"Warning: A3 page {a3_idx + 1} exceeds mapping, skipping")
+        for a3_sheet_num, [left_a4, right_a4] in mapping[:num_a3_pages]:
+            print(f"A3 page {a3_sheet_num:2d} -> A4 pages {left_a4:2d}, {right_a4:2d}")
+        for page_num, half_idx in enumerate(ordering(num_a3_pages), 1):
+            if half_idx is None:
+                print(f"Adding blank page {page_num} (missing)")
+
+        if jobs != 1:
+            print(f"Splitting {num_a3_pages} A3 pages with {jobs or 'all'} workers...")
+        print(f"\nReordering pages 1-{total_pages}...")
+
+        # Add pages in correct order (1, 2, 3, ...), splitting each A3 page when its half is due
+        splitter = Splitter(engine, ordering=ordering, rotate=90 if rotate else 0, workers=jobs)
+        splitter.split(input_file, FileSink(output_path, linearize, compact, downsample))
+
+        print(f"\nSuccessfully created: {output_path}")
+        return str(output_path)
 
     except Exception as e:
         print(f"Error: {e}")
@@ -200,6 +148,27 @@ def main():
                      help="Total A4 pages (auto-detect if not specified)")
     parser.add_option("-r", "--rotate", action="store_true", dest="rotate",
                      help="Rotate pages 90 degrees")
+    parser.add_option("-e", "--engine", dest="engine", default=DEFAULT_ENGINE,
+                     choices=sorted(SPLIT_ENGINES),
+                     help="Split engine: " + ", ".join(sorted(SPLIT_ENGINES)) +
+                          f" (default: {DEFAULT_ENGINE})")
+    parser.add_option("-b", "--binding", dest="binding", default="saddle",
+                     choices=sorted(BINDING_SCHEMES),
+                     help="Binding scheme: " + ", ".join(sorted(BINDING_SCHEMES)) +
+                          " (default: saddle)")
+    parser.add_option("-s", "--signature-pages", type="int", dest="signature_pages",
+                     default=DEFAULT_SIGNATURE_PAGES,
+                     help=f"A4 pages per signature for perfect binding (default: {DEFAULT_SIGNATURE_PAGES})")
+    parser.add_option("--rtl", action="store_true", dest="rtl",
+                     help="Right-to-left binding (swap the halves of each A3 page)")
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", default=1,
+                     help="Worker processes for splitting (0 = CPU count, default: 1)")
+    parser.add_option("--linearize", action="store_true", dest="linearize",
+                     help="Write a linearized PDF for fast web view (needs pikepdf or qpdf)")
+    parser.add_option("--compact", action="store_true", dest="compact",
+                     help="Merge identical objects and compress the output "
+                          "(object streams too with pikepdf or qpdf)")
+    add_downsample_options(parser)
     parser.add_option("-v", "--verify", action="store_true", dest="verify",
                      help="Verify mapping formula only")
 
@@ -215,6 +184,10 @@ def main():
         parser.print_help()
         sys.exit(1)
 
+    if options.linearize and rewrite_backend() is None:
+        parser.error("--linearize needs pikepdf or the qpdf command")
+    downsample = downsampler_from_options(parser, options)
+
     input_file = args[0]
 
     if not os.path.exists(input_file):
@@ -226,7 +199,9 @@ def main():
         sys.exit(1)
 
     # Process the PDF
-    result = split_and_reorder_pdf(input_file, options.pages, options.rotate)
+    result = split_and_reorder_pdf(input_file, options.pages, options.rotate, options.engine, options.jobs,
+                                   options.binding, options.signature_pages, options.rtl, options.linearize,
+                                   options.compact, downsample)
 
     if result:
         print(f"Success! Output saved as: {result}")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+PDF preflight
+分割せずにA3 PDFのページ数・サイズ・処理時間の目安を表示するツール
+
+Reads only the cross-reference table and page tree of each file (see
+a3divider.preflight), so it answers in milliseconds even for large scans.
+"""
+import json
+import sys
+from collections import Counter
+from pathlib import Path
+from optparse import OptionParser
+
+# Make the a3divider package in the repository root importable
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from a3divider import SPLIT_ENGINES, preflight_pdf
+
+def format_result(path, result):
+    """Describe a preflight result in a few lines"""
+    if result['password_required']:
+        return f"{path}: encrypted, password required"
+
+    lines = [f"{path}: {result['sheets']} A3 pages -> {result['a4_pages']} A4 pages"
+             f"{', encrypted' if result['encrypted'] else ''}"]
+    sizes = Counter((page['width'], page['height'], page['orientation']) for page in result['pages'])
+    for (width, height, orientation), count in sizes.most_common():
+        lines.append(f"  {count:4d} x {width:g} x {height:g} pt {orientation}")
+    if result['max_dpi'] is not None:
+        lines.append(f"  images up to {result['max_dpi']} dpi")
+    lines.append("  estimated: " + ", ".join(f"{engine} {ms} ms"
+                                           for engine, ms in result['estimated_ms'].items()))
+    return "\n".join(lines)
+
+def main():
+    """Main function"""
+    usage = "usage: %prog [options] <pdf file>..."
+    parser = OptionParser(usage=usage)
+    parser.add_option("--json", action="store_true", dest="json",
+                      help="Print one JSON object per file instead of a summary")
+    parser.add_option("-e", "--engine", dest="engine", choices=sorted(SPLIT_ENGINES),
+                      help="Only estimate this split engine")
+    parser.add_option("-p", "--password", dest="password",
+                      help="Password for encrypted files")
+
+    (options, args) = parser.parse_args()
+
+    if not args:
+        parser.print_help()
+        sys.exit(1)
+
+    failed = 0
+    for path in args:
+        try:
+            result = preflight_pdf(path, options.password)
+        except Exception as e:
+            print(f"Error: {path}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+
+        if options.engine and result['estimated_ms'] is not None:
+            result['estimated_ms'] = {options.engine: result['estimated_ms'][options.engine]}
+        if options.json:
+            print(json.dumps(dict(result, input=path)))
+        else:
+            print(format_result(path, result))
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -12,4 +12,4 @@ export PYTHONPATH="${PYTHONPATH}:."
 mkdir -p /tmp/pdf_processing
 
 # Start the application with Gunicorn
-exec gunicorn --bind 0.0.0.0:$PORT --workers 2 --timeout 120 --max-requests 1000 --max-requests-jitter 100 app:app
\ No newline at end of file
+exec gunicorn --bind 0.0.0.0:$PORT --workers ${WEB_CONCURRENCY:-2} --threads ${WEB_THREADS:-8} --timeout 120 --max-requests 1000 --max-requests-jitter 100 app:app
\ No newline at end of file
@@ -1,5 +1,7 @@
 // Service Worker for A3→A4 PDF分割ツール
-const CACHE_NAME = 'pdf-splitter-v1.0.0';
+const CACHE_NAME = 'pdf-splitter-v1.2.0';
+// API paths whose responses change on every request and are never cached
+const uncachedPaths = ['/jobs/', '/uploads/', '/cache/', '/metrics'];
 const urlsToCache = [
   '/',
   '/static/style.css',
@@ -56,6 +58,12 @@ self.addEventListener('fetch', event => {
     return;
   }
 
+  // Skip job and upload status, results, cache statistics and metrics
+  const path = new URL(event.request.url).pathname;
+  if (uncachedPaths.some(prefix => path.startsWith(prefix))) {
+    return;
+  }
+
   event.respondWith(
     caches.match(event.request)
       .then(response => {
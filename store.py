@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Shared SQLite store for the web application
+
+Job records, the result cache index, in-flight computations and the
+metric snapshots of every process live in one SQLite database in
+write-ahead-log mode. All gunicorn workers and their job processes on
+the host open the same file, so any worker can pick up, report on or
+serve any job, and cache hits and counters do not depend on which
+worker answers. Readers never block the single writer in WAL mode, and
+writers wait up to timeout seconds for each other.
+
+The database must be on a local filesystem (SQLite locking is not
+reliable over network filesystems); instances on other hosts need their
+own processing directory.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    download_name TEXT NOT NULL,
+    task TEXT,              -- JSON {split_function (name), options, lease} (see jobs.py)
+    cache_key TEXT,
+    leader TEXT,            -- job whose result this job shares (single-flight)
+    cost_ms REAL NOT NULL DEFAULT 0,
+    client TEXT,
+    worker INTEGER,         -- PID of the web worker that dispatched the job
+    stage TEXT,             -- 'split' or 'write' while running (see a3divider.progress)
+    sheets INTEGER,
+    pages_done INTEGER,
+    pages_total INTEGER,
+    bytes_in INTEGER,
+    bytes_out INTEGER,
+    eta_at REAL,            -- when the running split is expected to finish
+    error TEXT,
+    sha256 TEXT,
+    timings TEXT,           -- JSON of SplitTimings.as_dict()
+    cached INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    queued REAL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, worker);
+CREATE INDEX IF NOT EXISTS jobs_leader ON jobs (leader);
+
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (accessed);
+
+CREATE TABLE IF NOT EXISTS cache_counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS flights (
+    cache_key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,    -- 'job:<id>' or 'request'
+    pid INTEGER NOT NULL,
+    started REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS metric_snapshots (
+    process TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+
+# {path: (pid, connection)} per thread; connections are not shared across fork or threads
+_connections = threading.local()
+
+def pid_alive(pid):
+    """
+    Return whether a process of this host still exists
+
+    Jobs, flights and metric snapshots in the store (and admission
+    leases) name the process that owns them; those of processes that
+    have exited are taken over or dropped.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class Store:
+    """
+    Handle to the shared database
+
+    Instances only hold the database path, so they can be passed to pool
+    processes; each process and thread opens its own connection.
+    """
+
+    def __init__(self, path, timeout=30):
+        """
+        Args:
+            path: SQLite database file, created with its schema on first use
+            timeout: Seconds a write waits for another process's transaction
+        """
+        self.path = str(path)
+        self.timeout = timeout
+
+    def connect(self):
+        """Return this thread's connection, opening it on first use"""
+        connections = getattr(_connections, 'by_path', None)
+        if connections is None:
+            connections = _connections.by_path = {}
+        pid, connection = connections.get(self.path, (None, None))
+        if pid != os.getpid():
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            connections[self.path] = (os.getpid(), connection)
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the enclosed statements as one write transaction
+
+        The write lock is taken at the start (BEGIN IMMEDIATE), so a
+        read-then-write sequence cannot be interleaved with another
+        process's.
+        """
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def execute(self, sql, parameters=()):
+        """Run one statement in its own transaction and return the cursor"""
+        return self.connect().execute(sql, parameters)
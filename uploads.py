@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Resumable chunked uploads for the web application
+
+Large scans are sent as numbered chunks instead of one multipart POST, so
+a dropped connection only costs the chunks in flight. Each upload session
+lives in its own directory under the upload root:
+
+    <upload_id>/session.json  file name, size and chunk layout
+    <upload_id>/<index>.chunk received chunks, each written atomically
+    <upload_id>/job.json      job started from the assembled file
+
+Any gunicorn worker can accept any chunk; the session is assembled into
+one file once every chunk has arrived. Before that, open() reads the
+chunks in place as one file, so a complete upload can be inspected
+without copying it. Assembling deletes the chunks but keeps the session
+until it expires, so a client whose finalize response was lost gets the
+job it already started (see finish() and job()) instead of a 404, and
+one whose finalize overlaps a running one can tell (see finalizing()).
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+UPLOAD_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+COPY_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+class _ChunkReader(io.RawIOBase):
+    """Seekable read-only view of the chunk files of a session as one file"""
+
+    def __init__(self, upload_dir, session):
+        self.upload_dir = upload_dir
+        self.chunk_size = session['chunk_size']
+        self.size = session['size']
+        self.position = 0
+        self._chunk = None  # (index, open chunk file)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        index, offset = divmod(self.position, self.chunk_size)
+        if self._chunk is None or self._chunk[0] != index:
+            if self._chunk is not None:
+                self._chunk[1].close()
+            self._chunk = (index, open(self.upload_dir / f'{index}.chunk', 'rb'))
+        chunk_file = self._chunk[1]
+        chunk_file.seek(offset)
+        count = chunk_file.readinto(memoryview(buffer)[:self.chunk_size - offset])
+        self.position += count
+        return count
+
+    def close(self):
+        if self._chunk is not None:
+            self._chunk[1].close()
+            self._chunk = None
+        super().close()
+
+class UploadStore:
+    """
+    Upload sessions on disk
+    """
+
+    def __init__(self, root, chunk_size=8 * 1024 * 1024, max_bytes=1024 * 1024 * 1024, max_age=86400):
+        """
+        Args:
+            root: Directory holding one subdirectory per upload session
+            chunk_size: Size of every chunk but the last
+            max_bytes: Largest file accepted
+            max_age: Seconds without a new chunk after which a session is deleted
+        """
+        self.root = Path(root)
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _dir(self, upload_id):
+        if not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+            return None
+        return self.root / upload_id
+
+    def create(self, filename, size):
+        """
+        Start an upload session
+
+        Args:
+            filename: Name of the file being uploaded
+            size: File size in bytes
+
+        Returns:
+            Session dict (id, filename, size, chunk_size, total_chunks, created)
+
+        Raises:
+            ValueError: with a message suitable for the user
+        """
+        if size <= 0:
+            raise ValueError('ファイルが空です')
+        if size > self.max_bytes:
+            raise ValueError(f'ファイルサイズの上限 ({self.max_bytes // (1024 * 1024)}MB) を超えています')
+
+        self.cleanup()
+
+        session = {
+            'id': uuid.uuid4().hex,
+            'filename': filename,
+            'size': size,
+            'chunk_size': self.chunk_size,
+            'total_chunks': -(-size // self.chunk_size),
+            'created': time.time(),
+        }
+        upload_dir = self.root / session['id']
+        upload_dir.mkdir(parents=True)
+        with open(upload_dir / 'session.json', 'w') as session_file:
+            json.dump(session, session_file)
+        return session
+
+    def session(self, upload_id):
+        """Return the session dict of an upload, or None if it does not exist"""
+        upload_dir = self._dir(upload_id)
+        if upload_dir is None:
+            return None
+        try:
+            with open(upload_dir / 'session.json') as session_file:
+                return json.load(session_file)
+        except (OSError, ValueError):
+            return None
+
+    def received(self, upload_id):
+        """Return the sorted indices of the chunks received so far"""
+        return sorted(int(path.stem) for path in (self.root / upload_id).glob('*.chunk'))
+
+    def job(self, upload_id):
+        """Return the ID of the job started from an upload, or None if it is not finished"""
+        upload_dir = self._dir(upload_id)
+        if upload_dir is None:
+            return None
+        try:
+            with open(upload_dir / 'job.json') as job_file:
+                return json.load(job_file)['job_id']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def finalizing(self, upload_id):
+        """Return whether an upload is being assembled and its job is not recorded yet"""
+        upload_dir = self._dir(upload_id)
+        if upload_dir is None:
+            return False
+        return (upload_dir / 'assembling').exists() and self.job(upload_id) is None
+
+    def finish(self, session, job_id):
+        """Record the job started from an assembled upload, for repeated finalize requests"""
+        upload_dir = self.root / session['id']
+        tmp_path = upload_dir / f'job.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w') as job_file:
+            json.dump({'job_id': job_id}, job_file)
+        os.replace(tmp_path, upload_dir / 'job.json')
+
+    def discard(self, session):
+        """Delete a session, e.g. after its assembled file could not be used"""
+        shutil.rmtree(self.root / session['id'], ignore_errors=True)
+
+    def put_chunk(self, session, index, stream, sha256=None):
+        """
+        Store one chunk, replacing an earlier copy of it
+
+        Args:
+            session: Session dict from session()
+            index: Chunk number, starting at 0
+            stream: Binary stream with the chunk bytes
+            sha256: Optional hex digest the chunk must match
+
+        Raises:
+            ValueError: with a message suitable for the user
+        """
+        if not 0 <= index < session['total_chunks']:
+            raise ValueError('チャンク番号が正しくありません')
+        if (self.root / session['id'] / 'assembling').exists():
+            raise ValueError('このアップロードは既に完了しています')
+        expected_size = min(session['chunk_size'], session['size'] - index * session['chunk_size'])
+
+        upload_dir = self.root / session['id']
+        # Unique per request: threads and workers may receive retries of the same chunk at once
+        tmp_path = upload_dir / f'{index}.{uuid.uuid4().hex}.tmp'
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as chunk_file:
+                for data in iter(lambda: stream.read(COPY_CHUNK_SIZE), b''):
+                    size += len(data)
+                    if size > expected_size:
+                        break
+                    digest.update(data)
+                    chunk_file.write(data)
+
+            if size != expected_size:
+                raise ValueError(f'チャンクのサイズが正しくありません (期待値 {expected_size} バイト)')
+            if sha256 is not None and digest.hexdigest() != sha256.lower():
+                raise ValueError('チャンクのチェックサムが一致しません')
+            os.replace(tmp_path, upload_dir / f'{index}.chunk')
+        finally:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+
+    def _check_complete(self, session):
+        missing = sorted(set(range(session['total_chunks'])) - set(self.received(session['id'])))
+        if missing:
+            raise ValueError(f'未送信のチャンクがあります: {missing[:10]}')
+
+    def open(self, session):
+        """
+        Open the received chunks of a complete upload as one read-only file
+
+        Args:
+            session: Session dict from session()
+
+        Returns:
+            Seekable binary stream; the session must not be assembled while it is open
+
+        Raises:
+            ValueError: if chunks are missing
+        """
+        self._check_complete(session)
+        return io.BufferedReader(_ChunkReader(self.root / session['id'], session))
+
+    def assemble(self, session, output_dir):
+        """
+        Join the chunks of a complete upload into one file and delete the chunks
+
+        The session itself is kept; record the job started from the file
+        with finish(), or delete the session with discard().
+
+        Args:
+            session: Session dict from session()
+            output_dir: Directory the assembled file is created in
+
+        Returns:
+            Tuple (path of the assembled file, SHA-256 hex digest of its bytes)
+
+        Raises:
+            ValueError: if chunks are missing or the session is already being assembled
+        """
+        upload_dir = self.root / session['id']
+        self._check_complete(session)
+
+        # Only one request may assemble a session, even when the client retries
+        try:
+            (upload_dir / 'assembling').mkdir()
+        except FileExistsError:
+            raise ValueError('このアップロードは既に処理中です')
+
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        fd, output_path = tempfile.mkstemp(prefix='upload_', suffix='.pdf', dir=output_dir)
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as output_file:
+                for index in range(session['total_chunks']):
+                    with open(upload_dir / f'{index}.chunk', 'rb') as chunk_file:
+                        for data in iter(lambda: chunk_file.read(COPY_CHUNK_SIZE), b''):
+                            digest.update(data)
+                            output_file.write(data)
+        except BaseException:
+            # Keep the chunks so the client can finalize again
+            os.remove(output_path)
+            (upload_dir / 'assembling').rmdir()
+            raise
+
+        for index in range(session['total_chunks']):
+            os.remove(upload_dir / f'{index}.chunk')
+        return output_path, digest.hexdigest()
+
+    def cleanup(self):
+        """Delete sessions that have not received a chunk (or been finished) for max_age seconds"""
+        if not self.root.exists():
+            return
+
+        cutoff = time.time() - self.max_age
+        for upload_dir in self.root.iterdir():
+            try:
+                # Storing a chunk adds a directory entry, which updates the mtime
+                last_chunk = upload_dir.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if last_chunk < cutoff:
+                shutil.rmtree(upload_dir, ignore_errors=True)